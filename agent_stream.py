@@ -0,0 +1,91 @@
+import json
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from query_results import current_result_buffer
+from response_format import MarkdownRenderer
+
+FINAL_ANSWER_MARKER = "Final Answer:"
+# Longest tool output forwarded to the browser in a step event
+MAX_OBSERVATION_LENGTH = 500
+
+
+def format_sse(event, data):
+    """
+    Formats one Server-Sent Event.
+    """
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+class StreamingAgentHandler(BaseCallbackHandler):
+    """
+    Forwards agent steps (tool chosen, SQL issued, rows returned) and the tokens
+    of the final answer to a queue as (event, data) tuples. Token events carry the
+    HTML of the answer lines completed by that token.
+    """
+
+    def __init__(self, events):
+        self.events = events
+        self._llm_output = ""
+        self._in_final_answer = False
+        self._current_tool = None
+        self._current_tool_input = None
+        self._renderer = MarkdownRenderer()
+        self._answer_started = False
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self._llm_output = ""
+        self._in_final_answer = False
+        self._renderer = MarkdownRenderer()
+        self._answer_started = False
+
+    def _put_token(self, text):
+        if not self._answer_started:
+            # The answer starts at its first non-blank character, as in the final answer text
+            text = text.lstrip()
+            if not text:
+                return
+            self._answer_started = True
+        self.events.put(("token", {"text": text, "html": self._renderer.feed(text)}))
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.on_llm_start(serialized, [], **kwargs)
+
+    def on_llm_new_token(self, token, **kwargs):
+        if self._in_final_answer:
+            self._put_token(token)
+            return
+        self._llm_output += token
+        if FINAL_ANSWER_MARKER in self._llm_output:
+            self._in_final_answer = True
+            remainder = self._llm_output.split(FINAL_ANSWER_MARKER, 1)[1].lstrip()
+            if remainder:
+                self._put_token(remainder)
+
+    def on_llm_end(self, response, **kwargs):
+        if self._in_final_answer:
+            # The last line of the answer has no newline after it
+            self.events.put(("token", {"text": "", "html": self._renderer.close(), "complete": True}))
+
+    def on_agent_action(self, action, **kwargs):
+        self._current_tool = action.tool
+        self._current_tool_input = action.tool_input
+        self.events.put(("step", {"tool": action.tool, "tool_input": action.tool_input}))
+        if action.tool == "sql_db_query":
+            self.events.put(("sql", {"statement": action.tool_input}))
+
+    def on_tool_end(self, output, **kwargs):
+        if self._current_tool == "sql_db_query":
+            result_buffer = current_result_buffer.get()
+            last_result = result_buffer.last_result if result_buffer is not None else None
+            if last_result is None or last_result.statement != self._current_tool_input:
+                last_result = None
+            self.events.put(("rows", {
+                "row_count": last_result.row_count if last_result is not None else 0,
+                "preview": str(output)[:MAX_OBSERVATION_LENGTH]
+            }))
+        else:
+            self.events.put(("observation", {
+                "tool": self._current_tool,
+                "output": str(output)[:MAX_OBSERVATION_LENGTH]
+            }))
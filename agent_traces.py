@@ -0,0 +1,367 @@
+import os
+import sys
+import csv
+import json
+import math
+import time
+import uuid
+import sqlite3
+import argparse
+import threading
+from collections import Counter, OrderedDict, deque
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from answer_cache import normalize_question
+from question_router import STOPWORDS, question_tokens
+
+AGENT_TRACES_URL = os.getenv('AGENT_TRACES_URL', 'sqlite:///.cache/agent_traces.db')
+AGENT_TRACES_ENABLED = os.getenv('AGENT_TRACES_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Cosine similarity a past question needs for its tables and SQL to be given to the agent as a hint
+AGENT_TRACE_MIN_SIMILARITY = float(os.getenv('AGENT_TRACE_MIN_SIMILARITY', '0.5'))
+# Most past runs given to the agent as hints
+AGENT_TRACE_HINTS = int(os.getenv('AGENT_TRACE_HINTS', '2'))
+# Characters of each tool output kept in a trace
+AGENT_TRACE_MAX_OUTPUT = int(os.getenv('AGENT_TRACE_MAX_OUTPUT', '2000'))
+# Seconds a trace is kept, 0 keeps traces until they are pushed out by the cap below
+AGENT_TRACES_TTL = int(os.getenv('AGENT_TRACES_TTL', str(30 * 24 * 3600)))
+# Most traces kept per schema version, the oldest are deleted beyond that
+AGENT_TRACES_MAX_PER_SCHEMA = int(os.getenv('AGENT_TRACES_MAX_PER_SCHEMA', '1000'))
+# Seconds between deletions of expired traces
+_PRUNE_INTERVAL = 60
+
+QUERY_TOOL = "sql_db_query"
+SCHEMA_TOOL = "sql_db_schema"
+CHECKER_TOOL = "sql_db_query_checker"
+
+TRACE_COLUMNS = ["id", "created_at", "database", "schema_version", "question", "answer", "succeeded",
+                 "tables", "sql", "failed_sql", "steps", "hinted_by", "llm_usage", "duration_ms"]
+
+
+def _tool_failed(output):
+    # The SQL tools report errors as their output instead of raising
+    return isinstance(output, str) and output.lstrip().startswith("Error")
+
+
+class AgentTraceRecorder(BaseCallbackHandler):
+    """
+    Records the tool steps of one agent run: the tool, its input, a truncated output
+    and whether it failed.
+    """
+
+    def __init__(self, max_output=AGENT_TRACE_MAX_OUTPUT):
+        self.max_output = max_output
+        self.steps = []
+        self._started = {}
+        self._lock = threading.Lock()
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        with self._lock:
+            self._started[run_id] = (serialized.get("name", "tool"), input_str, time.perf_counter())
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        with self._lock:
+            started = self._started.pop(run_id, None)
+        if started is None:
+            return
+        tool, tool_input, started_at = started
+        output = str(output) if output is not None else ""
+        with self._lock:
+            self.steps.append({
+                "tool": tool,
+                "input": tool_input,
+                "output": output[:self.max_output],
+                "failed": _tool_failed(output),
+                "duration_ms": round((time.perf_counter() - started_at) * 1000, 1)
+            })
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self.on_tool_end(f"Error: {error}", run_id=run_id, **kwargs)
+
+    def summary(self):
+        """
+        Returns the tables the agent looked at, the last query that ran without an
+        error and the queries that failed, with their errors.
+        """
+        with self._lock:
+            steps = list(self.steps)
+        tables = []
+        for step in steps:
+            if step["tool"] == SCHEMA_TOOL and not step["failed"]:
+                tables.extend(name.strip() for name in step["input"].split(",") if name.strip())
+        queries = [step for step in steps if step["tool"] == QUERY_TOOL]
+        working = [step["input"] for step in queries if not step["failed"]]
+        return {
+            "steps": steps,
+            "tables": list(dict.fromkeys(tables)),
+            "sql": working[-1] if working else None,
+            "failed_sql": [{"sql": step["input"], "error": step["output"][:300]} for step in queries if step["failed"]]
+        }
+
+
+class _TraceIndex:
+    """
+    The latest successful trace per normalized question of one schema version, with
+    the document frequency of their tokens, the traces each token occurs in, and the
+    TF-IDF vectors computed since the index last changed.
+    """
+
+    def __init__(self):
+        self.traces = OrderedDict()  # oldest first
+        self.postings = {}
+        self.document_frequency = Counter()
+        self.vectors = {}
+
+    def add(self, key, trace, tokens):
+        self.remove(key)
+        self.traces[key] = (trace, tokens)
+        for token in set(tokens):
+            self.postings.setdefault(token, set()).add(key)
+        self.document_frequency.update(set(tokens))
+        self.vectors.clear()
+
+    def remove(self, key):
+        entry = self.traces.pop(key, None)
+        if entry is None:
+            return
+        for token in set(entry[1]):
+            keys = self.postings[token]
+            keys.discard(key)
+            if not keys:
+                del self.postings[token]
+        self.document_frequency.subtract(set(entry[1]))
+        self.vectors.clear()
+
+    def vector(self, tokens):
+        total = len(self.traces) + 1
+        vector = {token: count * math.log(total / (1 + self.document_frequency[token])) + count
+                  for token, count in Counter(tokens).items()}
+        return vector, math.sqrt(sum(weight * weight for weight in vector.values()))
+
+    def cached_vector(self, key):
+        if key not in self.vectors:
+            self.vectors[key] = self.vector(self.traces[key][1])
+        return self.vectors[key]
+
+
+class AgentTraceStore:
+    """
+    Keeps the trace of every agent run, in a local SQLite file or in memory, for ttl
+    seconds and at most max_per_schema traces per schema version. The questions of
+    successful runs are indexed by TF-IDF, so similar new questions can start from
+    the tables and SQL that worked before. A schema version's index is loaded from
+    the file when a question for it first needs one.
+    """
+
+    def __init__(self, path=None, min_similarity=AGENT_TRACE_MIN_SIMILARITY, ttl=AGENT_TRACES_TTL,
+                 max_per_schema=AGENT_TRACES_MAX_PER_SCHEMA):
+        self.path = path
+        self.min_similarity = min_similarity
+        self.ttl = ttl
+        self.max_per_schema = max(1, max_per_schema)
+        self._indexes = {}
+        # Traces of a store without a file, per schema version
+        self._memory = {}
+        self._lock = threading.Lock()
+        self._pruned_at = 0.0
+        if path:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with self._connect() as connection:
+                connection.execute(f'CREATE TABLE IF NOT EXISTS traces ({", ".join(TRACE_COLUMNS)})')
+                connection.execute('CREATE INDEX IF NOT EXISTS traces_by_database ON traces (database, created_at)')
+                connection.execute('CREATE INDEX IF NOT EXISTS traces_by_schema ON traces (schema_version, created_at)')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    @staticmethod
+    def _from_row(row):
+        trace = dict(zip(TRACE_COLUMNS, row))
+        for column in ("tables", "failed_sql", "steps", "hinted_by", "llm_usage"):
+            trace[column] = json.loads(trace[column]) if trace[column] else None
+        trace["succeeded"] = bool(trace["succeeded"])
+        return trace
+
+    def _expired_before(self):
+        return time.time() - self.ttl if self.ttl > 0 else 0.0
+
+    def _index_for(self, schema_version):
+        # Caller holds self._lock
+        index = self._indexes.get(schema_version)
+        if index is not None:
+            return index
+        index = self._indexes[schema_version] = _TraceIndex()
+        if self.path:
+            with self._connect() as connection:
+                rows = connection.execute(
+                    'SELECT * FROM traces WHERE schema_version = ? AND succeeded = 1 AND sql IS NOT NULL '
+                    'AND created_at >= ? ORDER BY created_at DESC LIMIT ?',
+                    (schema_version, self._expired_before(), self.max_per_schema)
+                ).fetchall()
+            for row in reversed(rows):
+                self._index_trace(index, self._from_row(row))
+        return index
+
+    def _index_trace(self, index, trace):
+        tokens = [token for token in question_tokens(trace["question"]) if token not in STOPWORDS]
+        index.add(normalize_question(trace["question"]), trace, tokens)
+        while len(index.traces) > self.max_per_schema:
+            index.remove(next(iter(index.traces)))
+
+    def save(self, trace):
+        """
+        Stores a finished run and, when it succeeded, indexes its question.
+        """
+        trace = dict(trace, id=trace.get("id") or uuid.uuid4().hex, created_at=trace.get("created_at") or time.time())
+        if self.path:
+            values = [json.dumps(trace.get(column), default=str) if column in ("tables", "failed_sql", "steps",
+                                                                                 "hinted_by", "llm_usage")
+                      else trace.get(column) for column in TRACE_COLUMNS]
+            with self._connect() as connection:
+                connection.execute(f'INSERT INTO traces VALUES ({", ".join("?" * len(TRACE_COLUMNS))})', values)
+        with self._lock:
+            if not self.path:
+                self._memory.setdefault(trace["schema_version"], deque(maxlen=self.max_per_schema)).append(trace)
+            if trace["succeeded"] and trace.get("sql"):
+                self._index_trace(self._index_for(trace["schema_version"]), trace)
+        if time.time() - self._pruned_at >= _PRUNE_INTERVAL:
+            self.prune()
+        return trace["id"]
+
+    def prune(self):
+        """
+        Deletes traces older than the TTL and beyond the cap of their schema version.
+        """
+        self._pruned_at = time.time()
+        expired_before = self._expired_before()
+        if self.path:
+            with self._connect() as connection:
+                connection.execute('DELETE FROM traces WHERE created_at < ?', (expired_before,))
+                connection.execute(
+                    'DELETE FROM traces WHERE id IN (SELECT id FROM (SELECT id, ROW_NUMBER() OVER '
+                    '(PARTITION BY schema_version ORDER BY created_at DESC) AS position FROM traces) '
+                    'WHERE position > ?)', (self.max_per_schema,)
+                )
+        with self._lock:
+            for schema_version, traces in list(self._memory.items()):
+                while traces and traces[0]["created_at"] < expired_before:
+                    traces.popleft()
+                if not traces:
+                    del self._memory[schema_version]
+            for schema_version, index in list(self._indexes.items()):
+                for key in [key for key, (trace, _) in index.traces.items() if trace["created_at"] < expired_before]:
+                    index.remove(key)
+                if not index.traces:
+                    del self._indexes[schema_version]
+
+    def similar(self, question, schema_version, limit=AGENT_TRACE_HINTS):
+        """
+        Returns up to limit successful traces of the same schema whose questions are
+        most similar to this one, best first, with their similarity.
+        """
+        tokens = [token for token in question_tokens(question) if token not in STOPWORDS]
+        if not tokens or limit <= 0:
+            return []
+        expired_before = self._expired_before()
+        scored = []
+        with self._lock:
+            index = self._index_for(schema_version)
+            query_vector, query_norm = index.vector(tokens)
+            # Only traces sharing a token with the question can score above zero
+            candidates = set()
+            for token in query_vector:
+                candidates.update(index.postings.get(token, ()))
+            for key in candidates:
+                trace = index.traces[key][0]
+                if trace["created_at"] < expired_before:
+                    continue
+                vector, norm = index.cached_vector(key)
+                dot = sum(weight * vector.get(token, 0.0) for token, weight in query_vector.items())
+                score = dot / (query_norm * norm) if query_norm and norm else 0.0
+                if score >= self.min_similarity:
+                    scored.append((score, trace))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [dict(trace, similarity=round(score, 3)) for score, trace in scored[:limit]]
+
+    def export(self, database=None, since=None):
+        """
+        Yields stored traces, oldest first, optionally for one database or after a time.
+        """
+        if not self.path:
+            with self._lock:
+                traces = sorted((trace for traces in self._memory.values() for trace in traces),
+                                key=lambda trace: trace["created_at"])
+            yield from (trace for trace in traces if (database is None or trace["database"] == database)
+                        and (since is None or trace["created_at"] >= since))
+            return
+        conditions, parameters = [], []
+        if database is not None:
+            conditions.append('database = ?')
+            parameters.append(database)
+        if since is not None:
+            conditions.append('created_at >= ?')
+            parameters.append(since)
+        where = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+        with self._connect() as connection:
+            for row in connection.execute(f'SELECT * FROM traces{where} ORDER BY created_at', parameters):
+                yield self._from_row(row)
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(index.traces) for index in self._indexes.values())
+
+
+def format_hints(traces):
+    """
+    Renders similar past runs as a few-shot hint for the agent prompt.
+    """
+    lines = []
+    for trace in traces:
+        lines.append(f"Question: {trace['question']}")
+        if trace.get("tables"):
+            lines.append(f"Tables: {', '.join(trace['tables'])}")
+        lines.append(f"SQL that answered it: {trace['sql']}")
+        for failed in (trace.get("failed_sql") or [])[:1]:
+            lines.append(f"SQL that failed: {failed['sql']} ({failed['error']})")
+    return "\n".join(lines)
+
+
+def agent_trace_store_from_url(url):
+    """
+    Picks the trace storage from a URL: memory:// or sqlite:///path/to/file.db.
+    """
+    if url.startswith('sqlite:///'):
+        return AgentTraceStore(url[len('sqlite:///'):])
+    return AgentTraceStore()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export stored agent traces for offline analysis")
+    parser.add_argument("--url", default=AGENT_TRACES_URL, help="trace store, sqlite:///path/to/file.db")
+    parser.add_argument("--format", choices=["jsonl", "csv"], default="jsonl")
+    parser.add_argument("--database", help="only traces of this database")
+    parser.add_argument("--since", type=float, help="only traces after this Unix time")
+    parser.add_argument("--output", help="output file, defaults to stdout")
+    args = parser.parse_args()
+
+    store = agent_trace_store_from_url(args.url)
+    output = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+    try:
+        if args.format == "csv":
+            writer = csv.DictWriter(output, fieldnames=TRACE_COLUMNS + ["steps_count", "failed_count"])
+            writer.writeheader()
+        for trace in store.export(args.database, args.since):
+            if args.format == "jsonl":
+                output.write(json.dumps(trace, default=str) + "\n")
+                continue
+            row = {column: json.dumps(value, default=str) if isinstance(value, (list, dict)) else value
+                   for column, value in trace.items() if column in TRACE_COLUMNS}
+            writer.writerow(dict(row, steps_count=len(trace["steps"] or []),
+                                 failed_count=len(trace["failed_sql"] or [])))
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
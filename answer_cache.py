@@ -0,0 +1,196 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+ANSWER_CACHE_TTL = int(os.getenv('ANSWER_CACHE_TTL', '3600'))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', '512'))
+ANSWER_CACHE_URL = os.getenv('ANSWER_CACHE_URL', 'memory://')
+# Number of previous conversation turns that take part in the cache key
+ANSWER_CACHE_HISTORY_TURNS = int(os.getenv('ANSWER_CACHE_HISTORY_TURNS', '2'))
+
+_whitespace_pattern = re.compile(r'\s+')
+_trailing_punctuation_pattern = re.compile(r'[\s?!.,;:]+$')
+
+
+def normalize_question(question):
+    """
+    Lower-cases the question, collapses whitespace and strips trailing punctuation so
+    that "Top 10 products by sales?" and "top 10  products by sales" share a cache
+    entry. Operators, signs and decimal points are kept: "total > 100" and "total <
+    100" are different questions.
+    """
+    text = _whitespace_pattern.sub(' ', (question or '').lower()).strip()
+    return _trailing_punctuation_pattern.sub('', text)
+
+
+def make_cache_key(question, history, schema_version, history_turns=ANSWER_CACHE_HISTORY_TURNS):
+    """
+    Builds the cache key from the normalized question, the last few conversation
+    turns preceding it and the schema version.
+    """
+    recent_history = [(role, normalize_question(content)) for role, content in history[-history_turns * 2:]] if history_turns else []
+    payload = json.dumps([normalize_question(question), recent_history, schema_version])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class InMemoryBackend:
+    """
+    Process-local LRU store with per-entry expiry.
+    """
+
+    def __init__(self, max_entries=ANSWER_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteBackend:
+    """
+    Shared store for all workers on one host, standing in for Redis. Entries carry
+    an expiry and a last-access time, which is used for LRU eviction.
+    """
+
+    def __init__(self, path, max_entries=ANSWER_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        with self._connect() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS answer_cache '
+                '(key TEXT PRIMARY KEY, value TEXT, expires_at REAL, accessed_at REAL)'
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def get(self, key):
+        now = time.time()
+        with self._connect() as connection:
+            row = connection.execute('SELECT value, expires_at FROM answer_cache WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                connection.execute('DELETE FROM answer_cache WHERE key = ?', (key,))
+                return None
+            connection.execute('UPDATE answer_cache SET accessed_at = ? WHERE key = ?', (now, key))
+            return json.loads(row[0])
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO answer_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(value), now + ttl, now)
+            )
+            connection.execute('DELETE FROM answer_cache WHERE expires_at < ?', (now,))
+            connection.execute(
+                'DELETE FROM answer_cache WHERE key NOT IN '
+                '(SELECT key FROM answer_cache ORDER BY accessed_at DESC LIMIT ?)',
+                (self.max_entries,)
+            )
+
+    def clear(self):
+        with self._connect() as connection:
+            connection.execute('DELETE FROM answer_cache')
+
+    def __len__(self):
+        with self._connect() as connection:
+            return connection.execute('SELECT COUNT(*) FROM answer_cache').fetchone()[0]
+
+
+class RedisBackend:
+    """
+    Shared store backed by Redis. Redis handles expiry itself and the server should
+    be configured with an LRU maxmemory-policy for eviction.
+    """
+
+    def __init__(self, url, prefix='answer_cache:'):
+        import redis  # Optional dependency, only needed for redis:// cache URLs
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, json.dumps(value), ex=int(ttl))
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+    def __len__(self):
+        return sum(1 for _ in self.client.scan_iter(self.prefix + '*'))
+
+
+def backend_from_url(url, max_entries=ANSWER_CACHE_MAX_ENTRIES):
+    """
+    Picks a backend from a URL: memory://, sqlite:///path/to/file.db or redis://host:port/db.
+    """
+    if url.startswith('sqlite:///'):
+        return SQLiteBackend(url[len('sqlite:///'):], max_entries=max_entries)
+    if url.startswith(('redis://', 'rediss://')):
+        return RedisBackend(url)
+    return InMemoryBackend(max_entries=max_entries)
+
+
+class AnswerCache:
+    """
+    Caches the generated SQL, final answer and rendered chart of a question.
+    """
+
+    def __init__(self, backend=None, ttl=ANSWER_CACHE_TTL):
+        self.backend = backend if backend is not None else InMemoryBackend()
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.backend.set(key, value, self.ttl)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.backend)}
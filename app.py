@@ -1,19 +1,34 @@
 import os
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, MetaData, text, event
-from langchain_openai import AzureChatOpenAI
-from langchain.prompts.chat import ChatPromptTemplate
-from langchain_community.agent_toolkits.sql.base import create_sql_agent
-from langchain_community.utilities import SQLDatabase
-from langchain_community.agent_toolkits.sql.toolkit import SQLDatabaseToolkit
-from langchain.agents import AgentType
-from flask import Flask, request, jsonify, render_template, session
+from sqlalchemy.exc import SQLAlchemyError
+from flask import Blueprint, Flask, Response, request, jsonify, render_template, session, g
+import asyncio
 import logging
-import re
+import uuid
+import time
+import json
+import queue
+import functools
+import threading
 from datetime import datetime
-import matplotlib.pyplot as plt
-from io import BytesIO
-import base64
+from query_results import ResultBuffer, current_result_buffer
+from sql_trace import StatementTrace, current_statement_trace
+from answer_cache import AnswerCache, ANSWER_CACHE_URL, backend_from_url, make_cache_key
+from agent_stream import StreamingAgentHandler, format_sse
+from response_format import format_response_to_html
+from charts import CHART_FORMAT, ChartRenderer, build_chart_spec
+from conversation_store import CONVERSATION_STORE_URL, ConversationMemory, conversation_store_from_url
+from llm_usage import LLMUsageHandler
+from agent_traces import (AGENT_TRACES_ENABLED, AGENT_TRACES_URL, AgentTraceRecorder, agent_trace_store_from_url,
+                          format_hints)
+from batch import BATCH_CONCURRENCY, BatchRunner
+from single_flight import COALESCE_ENABLED, SingleFlight
+from telemetry import (RequestTrace, configure_logging, current_request_trace, register_gauges, render_metrics,
+                       request_seconds, span)
+from question_router import ROUTER_ENABLED, ROUTER_TEMPLATES_URL, template_library_from_url
+from db_pool import SQL_CONNECT_TIMEOUT
+from database_registry import DatabaseContext, DatabaseRegistry, database_urls_from_env
+from warm_up import WARM_UP_ENABLED, WarmUp
 
 # Load environment variables from .env file
 load_dotenv()
@@ -21,7 +36,8 @@ load_dotenv()
 # Retrieve environment variables
 OPENAI_API_TYPE = os.getenv('OPENAI_API_TYPE', 'azure')
 OPENAI_API_VERSION = os.getenv('OPENAI_API_VERSION', '2024-02-01')
-OPENAI_API_BASE = os.getenv('OPENAI_API_BASE', 'https://armelyopenai.openai.azure.com/')
+# AZURE_ENDPOINT takes precedence, since the OpenAI client also reads OPENAI_API_BASE and rejects it for Azure
+OPENAI_API_BASE = os.getenv('AZURE_ENDPOINT') or os.getenv('OPENAI_API_BASE', 'https://armelyopenai.openai.azure.com/')
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 OPENAI_CHAT_MODEL = os.getenv('OPENAI_CHAT_MODEL', 'gpt-4-model')
 
@@ -29,97 +45,149 @@ SQL_SERVER = os.getenv('SQL_SERVER', 'readtablewithopenai.database.windows.net')
 SQL_DB = os.getenv('SQL_DB')
 SQL_USERNAME = os.getenv('SQL_USERNAME')
 SQL_PWD = os.getenv('SQL_PWD')
+# Optional SQLAlchemy URL that replaces the Azure SQL connection, e.g. sqlite:///fixture.db for load tests
+SQL_DATABASE_URL = os.getenv('SQL_DATABASE_URL')
 
 # SQLAlchemy setup
 driver = '{ODBC Driver 17 for SQL Server}'
 odbc_str = (
     'mssql+pyodbc:///?odbc_connect='
     f'Driver={driver};Server=tcp:{SQL_SERVER};PORT=1433;DATABASE={SQL_DB};'
-    f'Uid={SQL_USERNAME};Pwd={SQL_PWD};Encrypt=yes;TrustServerCertificate=no;Connection Timeout=30;'
-)
-db_engine = create_engine(odbc_str)
-
-# Reflect database metadata and filter out system tables
-metadata = MetaData()
-metadata.reflect(bind=db_engine)
-user_tables = [table for table in metadata.tables if not table.lower().startswith("sys")]
-
-
-# Initialize AzureChatOpenAI instance
-llm = AzureChatOpenAI(
-    api_key=OPENAI_API_KEY,
-    azure_endpoint=OPENAI_API_BASE,
-    api_version=OPENAI_API_VERSION,
-    model=OPENAI_CHAT_MODEL,
-    deployment_name=OPENAI_CHAT_MODEL,
-    temperature=0
+    f'Uid={SQL_USERNAME};Pwd={SQL_PWD};Encrypt=yes;TrustServerCertificate=no;Connection Timeout={SQL_CONNECT_TIMEOUT};'
 )
 
-# Initialize SQL Database and Toolkit
-db = SQLDatabase(db_engine)
-sql_toolkit = SQLDatabaseToolkit(db=db, llm=llm)
-
-# Set up Flask and session
-app = Flask(__name__)
-app.secret_key = os.urandom(24)  # Secure session with a random key
-
-# Create SQL DB Agent
-sqldb_agent = create_sql_agent(
-    llm=llm,
-    toolkit=sql_toolkit,
-    agent_type=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
-    handle_parsing_errors=True,
-    verbose=True
-)
+def built_once(build):
+    """
+    Decorates a function that builds a shared object, so the object is built on the
+    first call and the same one is returned afterwards. Importing the app therefore
+    opens no files and starts no threads.
+    """
+    lock = threading.Lock()
+    built = []
+
+    @functools.wraps(build)
+    def get():
+        if not built:
+            with lock:
+                if not built:
+                    built.append(build())
+        return built[0]
+    return get
+
+# Cache for answers to repeated questions
+@built_once
+def get_answer_cache():
+    return AnswerCache(backend_from_url(ANSWER_CACHE_URL))
+
+# Identical questions asked at the same time are answered once, across this host's workers
+@built_once
+def get_single_flight():
+    return SingleFlight()
+
+# Charts are rendered in a process pool, off the request thread
+chart_renderer = ChartRenderer()
+
+# SQL templates learned from successful agent runs, used to skip the agent for known questions
+@built_once
+def get_template_library():
+    return template_library_from_url(ROUTER_TEMPLATES_URL)
+
+# Intermediate steps of past agent runs, used as few-shot hints for similar questions
+@built_once
+def get_agent_traces():
+    return agent_trace_store_from_url(AGENT_TRACES_URL)
+
+_llm = None
+_llm_lock = threading.Lock()
+
+def get_llm():
+    """
+    Returns the shared chat model, built on first use: AzureChatOpenAI, or the replay
+    model that serves recorded transcripts for offline benchmarks. The OpenAI client
+    stack is only imported here, so importing the app stays cheap.
+    """
+    global _llm
+    if _llm is None:
+        with _llm_lock:
+            if _llm is None:
+                from replay_llm import LLM_REPLAY_PATH, ReplayChatModel
+
+                if LLM_REPLAY_PATH:
+                    _llm = ReplayChatModel.from_file(LLM_REPLAY_PATH)
+                else:
+                    from langchain_openai import AzureChatOpenAI
+
+                    _llm = AzureChatOpenAI(
+                        api_key=OPENAI_API_KEY,
+                        azure_endpoint=OPENAI_API_BASE,
+                        api_version=OPENAI_API_VERSION,
+                        model=OPENAI_CHAT_MODEL,
+                        deployment_name=OPENAI_CHAT_MODEL,
+                        temperature=0,
+                        streaming=True  # Token callbacks feed /ask/stream
+                    )
+    return _llm
+
+# Each named database gets its own engine, schema cache and agent, opened on first use and
+# closed when idle; the LLM client, caches and Flask app are shared by all of them
+database_urls, DEFAULT_DATABASE = database_urls_from_env(SQL_DATABASE_URL or odbc_str)
 
-# Global variable to store the last SQL statement
-last_sql_statement = ""
-
-# Set up SQLAlchemy event listener to capture SQL statements
-@event.listens_for(db_engine, "before_cursor_execute")
-def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
-    global last_sql_statement
-    last_sql_statement = statement  # Store the SQL statement in a global variable
-    logging.debug("Generated SQL Statement: %s", statement)
-
-def format_response_to_html(response_text):
-    """
-    Formats the AI response text into HTML with basic support for bold, italic, 
-    lists (ordered and unordered), and URLs converted into clickable links.
-    """
-    formatted_text = re.sub(r'\*\*(.*?)\*\*', r'<b>\1</b>', response_text)
-    formatted_text = re.sub(r'\*(.*?)\*', r'<i>\1</i>', formatted_text)
-    markdown_link_pattern = r'\[([^\]]+)\]\(([^)]+)\)'
-    formatted_text = re.sub(markdown_link_pattern, r'<a href="\2" target="_blank">\1</a>', formatted_text)
-    formatted_text = formatted_text.replace('\n', '<br>')
-    formatted_text = re.sub(r'(?<=:)\s*-\s*(.*?)(<br>|$)', r'<li>\1</li>', formatted_text)
-    formatted_text = re.sub(r'(?<=:)\s*•\s*(.*?)(<br>|$)', r'<li>\1</li>', formatted_text)
-    formatted_text = re.sub(r'(?<=:)\s*\d+\.\s*(.*?)(<br>|$)', r'<li>\1</li>', formatted_text)
-    formatted_text = re.sub(r'(<li>.*?</li>)', r'<ul>\1</ul>', formatted_text, flags=re.DOTALL)
-    formatted_text = formatted_text.replace('<br><li>', '<li>').replace('</li><br>', '</li>')
-    return formatted_text
+@built_once
+def get_database_registry():
+    registry = DatabaseRegistry(database_urls, DEFAULT_DATABASE,
+                                lambda name, **urls: DatabaseContext(name, get_llm(), **urls))
+    registry.start_idle_eviction()
+    return registry
+
+def warm_up_stores():
+    for get_store in (get_answer_cache, get_single_flight, get_template_library, get_agent_traces, get_conversations):
+        get_store()
+
+def warm_up_default_database():
+    with get_database_registry().lease(DEFAULT_DATABASE) as database:
+        if database.schema_index is not None and not database.schema_index.wait():
+            raise RuntimeError("schema index build failed")
+        # Building the agent imports the LangChain agent stack
+        database.agent
+
+# Clients and connections are built in the background after start-up instead of at import;
+# requests that arrive earlier build what they need themselves
+startup = WarmUp([
+    ("stores", warm_up_stores),
+    ("llm", get_llm),
+    ("database", warm_up_default_database),
+])
+
+# Routes are registered on the app built by create_app
+routes = Blueprint("sqlagent", __name__)
 
 # Function to check if a value is null and provide a default message
 def check_if_null(value):
     return value if value else "Provide examples of records to search"
 
 # Function to build prompt with conversation history
-def build_prompt_with_history(question):
-    if 'conversation_history' not in session:
-        session['conversation_history'] = []
-    
-    # Append the new question to conversation history
-    session['conversation_history'].append(("user", question))
-    
+def build_prompt_with_history(conversation_history, conversation_summary="", schema_context=None, hints=None):
     # Build the prompt with the conversation history as a clear dialogue
     # Get the current date and format it
     current_date = datetime.now().strftime("%B %d, %Y")
     prompt_messages = [
         {"role": "system", "content": f"You are a helpful AI assistant. Today's date is {current_date}. You are an expert in querying SQL Databases."}
     ]
+    if schema_context:
+        prompt_messages.append({"role": "system", "content": (
+            "Tables relevant to the question, as Table(column TYPE, ...) with sample rows. "
+            "Query them directly and use sql_db_schema only for tables not listed here:\n" + schema_context
+        )})
+    if hints:
+        prompt_messages.append({"role": "system", "content": (
+            "Similar questions were answered before with these tables and SQL. "
+            "Start from this SQL, adapting it to the question, instead of exploring the schema again:\n" + hints
+        )})
+    if conversation_summary:
+        prompt_messages.append({"role": "system", "content": f"Summary of the earlier conversation: {conversation_summary}"})
     
     # Append each message in conversation history as user/assistant format
-    for role, content in session['conversation_history']:
+    for role, content in conversation_history:
         if role == "user":
             prompt_messages.append({"role": "user", "content": content})
         elif role == "ai":
@@ -127,6 +195,38 @@ def build_prompt_with_history(question):
     
     return prompt_messages
 
+# Function to pick the schema context for a question, follow-ups included
+def schema_context_for(database, query, conversation_history):
+    earlier_questions = [content for role, content in conversation_history if role == "user"]
+    return database.schema_context_for(" ".join(earlier_questions + [query]))
+
+# Function to summarize conversation turns that no longer fit in the prompt
+def summarize_conversation(previous_summary, turns, max_tokens):
+    transcript = "\n".join(f"{role}: {content}" for role, content in turns)
+    response = get_llm().invoke([
+        {"role": "system", "content": f"Summarize the conversation in at most {max_tokens} tokens. Keep table names, filters and figures the user may refer back to."},
+        {"role": "user", "content": f"Earlier summary: {previous_summary or 'none'}\n\nNew turns:\n{transcript}"}
+    ])
+    return response.content
+
+# Conversation history lives server-side, the session cookie only carries its id
+@built_once
+def get_conversations():
+    return ConversationMemory(conversation_store_from_url(CONVERSATION_STORE_URL), summarize_conversation)
+
+def current_conversation_id():
+    if 'conversation_id' not in session:
+        session['conversation_id'] = uuid.uuid4().hex
+    return session['conversation_id']
+
+def conversation_key(conversation_id, database):
+    # Each database has its own history, so follow-ups never refer to another database's tables
+    return conversation_id if database == DEFAULT_DATABASE else f"{conversation_id}:{database}"
+
+def reset_conversations(conversation_id):
+    for database in get_database_registry().names():
+        get_conversations().reset(conversation_key(conversation_id, database) if conversation_id else None)
+
 # Function to extract axis labels based on database query results
 def extract_axes_labels(result):
     """
@@ -137,82 +237,487 @@ def extract_axes_labels(result):
     y_label = column_names[1] if len(column_names) > 1 else "Values"
     return x_label, y_label
 
-@app.route("/")
+@routes.route("/")
 def index():
     return render_template("index.html")
 
-logging.basicConfig(level=logging.DEBUG)
+# LOG_LEVEL=INFO switches off the per-statement DEBUG logging on the request path
+configure_logging()
 
-@app.route("/ask", methods=["POST"])
-def ask():
+# Cache and pool statistics are read when /metrics is scraped
+register_gauges("sqlagent_answer_cache", lambda: get_answer_cache().stats())
+register_gauges("sqlagent_pool", lambda: get_database_registry().pool_totals())
+register_gauges("sqlagent_databases", lambda: get_database_registry().stats())
+register_gauges("sqlagent_coalesce", lambda: get_single_flight().stats())
+register_gauges("sqlagent_reads", lambda: get_database_registry().totals(DatabaseContext.replica_stats))
+register_gauges("sqlagent_materialized", lambda: get_database_registry().totals(DatabaseContext.materialized_stats))
+
+def chart_fields(chart_spec, chart_format):
+    """
+    Returns the chart part of the response: a base64 PNG, or the chart spec that
+    app.js draws itself when chart_format is "spec".
+    """
+    if chart_spec is None:
+        return {"chart_image": ""}
+    if chart_format == "spec":
+        return {"chart_image": "", "chart_spec": chart_spec}
+    with span("chart", "render"):
+        try:
+            return {"chart_image": chart_renderer.render(chart_spec)}
+        except Exception as e:
+            # app.js draws the spec itself, so a failed render still shows the chart
+            logging.warning("Chart rendering failed, returning the chart spec: %r", e)
+            return {"chart_image": "", "chart_spec": chart_spec}
+
+def lookup_cached_answer(cache_key, chart_format=CHART_FORMAT):
+    """
+    Returns the response payload and plain answer of a cached question, or None.
+    """
+    cached_answer = get_answer_cache().get(cache_key)
+    if cached_answer is None:
+        return None
+    return {
+        "summary": cached_answer["summary"],
+        "sql_statement": cached_answer["sql_statement"],
+        "sql_statements": cached_answer["sql_statements"],
+        "governor": cached_answer.get("governor", []),
+        **chart_fields(cached_answer.get("chart_spec"), chart_format),
+        "cached": True
+    }, cached_answer["answer"]
+
+class AnswerRun:
+    """
+    Request-scoped state of one agent run: the rows fetched by the agent, kept for the
+    chart path, and the statements it issued, isolated from concurrent requests.
+    """
+
+    def __init__(self, database, query, cache_key, chart_format=CHART_FORMAT):
+        self.database = database
+        self.query = query
+        self.cache_key = cache_key
+        self.chart_format = chart_format
+        self.result_buffer = ResultBuffer()
+        self.statement_trace = StatementTrace()
+        # How the question was answered: by the agent or by a learned SQL template
+        self.route = {"route": "agent"}
+        # Prompt tokens and latency of each LLM call
+        self.llm_usage = LLMUsageHandler()
+        # Timed spans of the run: agent steps, LLM calls, SQL, chart and formatting
+        self.request_trace = RequestTrace(query)
+        # Tool steps of the agent, persisted to the trace store, and the past runs given as hints
+        self.agent_trace = AgentTraceRecorder()
+        self.hinted_by = []
+        self.trace_id = None
+        self.started_at = time.perf_counter()
+
+    def callbacks(self, callbacks=None):
+        return {"callbacks": [self.llm_usage, self.agent_trace] + list(callbacks or [])}
+
+    def __enter__(self):
+        self._result_buffer_token = current_result_buffer.set(self.result_buffer)
+        self._statement_trace_token = current_statement_trace.set(self.statement_trace)
+        self._request_trace_token = current_request_trace.set(self.request_trace)
+        self.request_trace.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        current_result_buffer.reset(self._result_buffer_token)
+        current_statement_trace.reset(self._statement_trace_token)
+        current_request_trace.reset(self._request_trace_token)
+        self.request_trace.end(exc_value)
+        self.result_buffer.close()
+        self.request_trace.log()
+
+    def finish(self, final_answer, answer_is_cacheable=True):
+        """
+        Formats the answer, renders the chart when one was asked for and caches the
+        result. Returns the response payload and the plain answer.
+        """
+        query = self.query
+        statement_trace = self.statement_trace
+        with span("format"):
+            formatted_answer = format_response_to_html(final_answer)
+
+        # Check if the query is asking for a visualization
+        query_result = self.result_buffer.last_result
+        chart_spec = None
+        if query_result is not None and query_result.row_count and any(keyword in query.lower() for keyword in ["chart", "graph", "visual", "plot", "pie"]):
+            with span("chart", "spec"):
+                # Get dynamic x and y labels based on the column names in the result
+                x_label, y_label = extract_axes_labels(query_result)
+                chart_spec = build_chart_spec(query, query_result.fetchall(), x_label, y_label)
+
+        if answer_is_cacheable:
+            get_answer_cache().set(self.cache_key, {
+                "answer": final_answer,
+                "summary": formatted_answer,
+                "sql_statement": statement_trace.last_statement,
+                "sql_statements": statement_trace.to_list(),
+                "governor": statement_trace.governor_decisions,
+                "chart_spec": chart_spec
+            })
+
+        payload = {
+            "summary": formatted_answer,
+            "sql_statement": statement_trace.last_statement,
+            "sql_statements": statement_trace.to_list(),
+            "governor": statement_trace.governor_decisions,
+            "route": self.route,
+            "database": self.database.name,
+            "llm_usage": self.llm_usage.summary(),
+            "trace": {"id": self.trace_id, "hinted_by": self.hinted_by},
+            **chart_fields(chart_spec, self.chart_format)
+        }
+        payload["timings"] = self.request_trace.totals()
+        return payload, final_answer
+
+PARSING_ERROR_ANSWER = "I'm sorry, there was an issue processing your request. Could you try rephrasing your question?"
+
+# Most result rows shown to the LLM when it summarizes a templated query
+TEMPLATE_SUMMARY_ROWS = 50
+
+def answer_from_template(run, conversation_history):
+    """
+    Answers a standalone question that matches a learned SQL template by running the
+    filled-in SQL and summarizing its rows with a single LLM call. Returns None when
+    no template matches or the templated SQL fails, so the agent takes over.
+    """
+    if not ROUTER_ENABLED or conversation_history:
+        return None
+    matched = get_template_library().match(run.query, run.database.schema_version)
+    if matched is None:
+        return None
+    template, sql = matched
     try:
-        query = check_if_null(request.json.get("message"))
-        
+        records = run.database.db._execute(sql)
+    except SQLAlchemyError as e:
+        logging.warning("Templated SQL failed, falling back to the agent: %s", e)
+        return None
+
+    response = get_llm().invoke([
+        {"role": "system", "content": "You are a helpful AI assistant. Answer the user's question from the SQL query result only."},
+        {"role": "user", "content": (
+            f"Question: {run.query}\nSQL: {sql}\n"
+            f"Result ({len(records)} rows): {json.dumps(records[:TEMPLATE_SUMMARY_ROWS], default=str)}"
+        )}
+    ], config=run.callbacks())
+    run.route = {"route": "template", "template": template["question"], "similarity": template["similarity"]}
+    return response.content
+
+def learn_from_run(run, conversation_history):
+    """
+    Stores the query behind a successful standalone agent answer as a template.
+    """
+    last_result = run.result_buffer.last_result
+    if ROUTER_ENABLED and not conversation_history and last_result is not None and not last_result.truncated:
+        get_template_library().learn(run.query, last_result.statement, run.database.schema_version)
+
+def agent_hints_for(run):
+    """
+    Returns the few-shot hint built from past runs of questions similar to this one.
+    """
+    if not AGENT_TRACES_ENABLED:
+        return None
+    similar = get_agent_traces().similar(run.query, run.database.schema_version)
+    run.hinted_by = [{"id": trace["id"], "question": trace["question"], "similarity": trace["similarity"]}
+                     for trace in similar]
+    return format_hints(similar) or None
+
+def save_agent_trace(run, final_answer, succeeded=True):
+    """
+    Persists the steps of an agent run to the trace store.
+    """
+    if not AGENT_TRACES_ENABLED:
+        return
+    steps = run.agent_trace.summary()
+    last_result = run.result_buffer.last_result
+    try:
+        run.trace_id = get_agent_traces().save({
+            "database": run.database.name,
+            "schema_version": run.database.schema_version,
+            "question": run.query,
+            "answer": final_answer,
+            "succeeded": succeeded and steps["sql"] is not None,
+            "tables": steps["tables"],
+            "sql": last_result.statement if last_result is not None else steps["sql"],
+            "failed_sql": steps["failed_sql"],
+            "steps": steps["steps"],
+            "hinted_by": [hint["id"] for hint in run.hinted_by],
+            "llm_usage": run.llm_usage.summary(),
+            "duration_ms": round((time.perf_counter() - run.started_at) * 1000, 1)
+        })
+    except Exception as e:
+        logging.warning("Could not save agent trace: %s", e)
+
+def answer_question(query, conversation_history, conversation_summary="", callbacks=None, chart_format=CHART_FORMAT,
+                    database=None):
+    """
+    Answers a question about the named database (the default one when None) with its
+    SQL agent, serving repeated questions from the answer cache and waiting for the
+    answer of an identical question already in flight. Returns the response payload
+    and the plain answer for the conversation history.
+    """
+    with get_database_registry().lease(database) as database_context:
+        cache_key = make_cache_key(query, conversation_history, database_context.schema_version)
+        compute = lambda: _answer_question(database_context, cache_key, query, conversation_history,
+                                           conversation_summary, callbacks, chart_format)
+        if not COALESCE_ENABLED:
+            return compute()
+        result, coalesced = get_single_flight().run(f"{cache_key}:{chart_format}", compute)
+        return coalesced_result(result, coalesced)
+
+def coalesced_result(result, coalesced):
+    payload, final_answer = result
+    return (dict(payload, coalesced=True), final_answer) if coalesced else (payload, final_answer)
+
+def _answer_question(database, cache_key, query, conversation_history, conversation_summary, callbacks,
+                     chart_format):
+    cached = lookup_cached_answer(cache_key, chart_format)
+    if cached is not None:
+        return cached
+
+    with AnswerRun(database, query, cache_key, chart_format) as run:
+        # Known questions skip the agent
+        final_answer = answer_from_template(run, conversation_history)
+        if final_answer is not None:
+            return run.finish(final_answer)
+
         # Generate prompt with conversation history
-        final_prompt = build_prompt_with_history(query)
-        
+        schema_context = schema_context_for(database, query, conversation_history)
+        final_prompt = build_prompt_with_history(conversation_history + [("user", query)], conversation_summary,
+                                                 schema_context, agent_hints_for(run))
+
         # Generate response with error handling for parsing issues
         try:
-            response = sqldb_agent.invoke(final_prompt)
+            with span("agent"):
+                response = database.agent.invoke(final_prompt, config=run.callbacks(callbacks))
             final_answer = response.get("output") if isinstance(response, dict) else response
-            # Append the response to conversation history
-            session['conversation_history'].append(("ai", final_answer))
         except ValueError as parse_error:
             logging.error("Parsing error encountered: %s", parse_error)
-            final_answer = "I'm sorry, there was an issue processing your request. Could you try rephrasing your question?"
-            session['conversation_history'].append(("ai", final_answer))
+            save_agent_trace(run, PARSING_ERROR_ANSWER, succeeded=False)
+            return run.finish(PARSING_ERROR_ANSWER, answer_is_cacheable=False)
 
-        formatted_answer = format_response_to_html(final_answer)
+        learn_from_run(run, conversation_history)
+        save_agent_trace(run, final_answer)
+        return run.finish(final_answer)
 
-        # Check if the query is asking for a visualization
-        if any(keyword in query.lower() for keyword in ["chart", "graph", "visual", "plot", "pie"]):
-            with db_engine.connect() as connection:
-                query_result = connection.execute(text(last_sql_statement))
-                data = query_result.fetchall()
-
-            # Get dynamic x and y labels based on the column names in the result
-            x_label, y_label = extract_axes_labels(query_result)
-            
-            # Extract categories and values from data
-            categories = [row[0] for row in data]
-            values = [row[1] for row in data]
-
-            if "pie" in query.lower():
-                plt.figure(figsize=(8, 8))
-                plt.pie(values, labels=categories, autopct='%1.1f%%', startangle=140)
-                plt.title('Query Result Visualization (Pie Chart)')
-            else:
-                plt.figure(figsize=(10, 6))
-                plt.bar(categories, values)
-                plt.xlabel(x_label)
-                plt.ylabel(y_label)
-                plt.title('Query Result Visualization (Bar Chart)')
-
-            img = BytesIO()
-            plt.savefig(img, format="png")
-            img.seek(0)
-            img_base64 = base64.b64encode(img.getvalue()).decode()
-
-            return jsonify({
-                "summary": formatted_answer,
-                "sql_statement": last_sql_statement,
-                "chart_image": img_base64
-            })
-        
-        return jsonify({
-            "summary": formatted_answer,
-            "sql_statement": last_sql_statement,
-            "chart_image": ""
-        })
+async def answer_question_async(query, conversation_history, conversation_summary="", callbacks=None,
+                                chart_format=CHART_FORMAT, database=None):
+    """
+    Async variant of answer_question used by the ASGI app. The agent awaits the LLM
+    instead of holding a thread, and opening the database and chart rendering run in
+    worker threads.
+    """
+    database_context = await asyncio.to_thread(get_database_registry().acquire, database)
+    try:
+        cache_key = make_cache_key(query, conversation_history, database_context.schema_version)
+        compute = lambda: _answer_question_async(database_context, cache_key, query, conversation_history,
+                                                 conversation_summary, callbacks, chart_format)
+        if not COALESCE_ENABLED:
+            return await compute()
+        result, coalesced = await get_single_flight().run_async(f"{cache_key}:{chart_format}", compute)
+        return coalesced_result(result, coalesced)
+    finally:
+        get_database_registry().release(database_context)
+
+async def _answer_question_async(database, cache_key, query, conversation_history, conversation_summary, callbacks,
+                                 chart_format):
+    cached = await asyncio.to_thread(lookup_cached_answer, cache_key, chart_format)
+    if cached is not None:
+        return cached
+
+    with AnswerRun(database, query, cache_key, chart_format) as run:
+        final_answer = await asyncio.to_thread(answer_from_template, run, conversation_history)
+        if final_answer is not None:
+            return await asyncio.to_thread(run.finish, final_answer)
+
+        schema_context = await asyncio.to_thread(schema_context_for, database, query, conversation_history)
+        hints = await asyncio.to_thread(agent_hints_for, run)
+        final_prompt = build_prompt_with_history(conversation_history + [("user", query)], conversation_summary,
+                                                 schema_context, hints)
+        try:
+            with span("agent"):
+                response = await database.agent.ainvoke(final_prompt, config=run.callbacks(callbacks))
+            final_answer = response.get("output") if isinstance(response, dict) else response
+        except ValueError as parse_error:
+            logging.error("Parsing error encountered: %s", parse_error)
+            await asyncio.to_thread(save_agent_trace, run, PARSING_ERROR_ANSWER, False)
+            return await asyncio.to_thread(run.finish, PARSING_ERROR_ANSWER, False)
+
+        await asyncio.to_thread(learn_from_run, run, conversation_history)
+        await asyncio.to_thread(save_agent_trace, run, final_answer)
+        return await asyncio.to_thread(run.finish, final_answer)
+
+@routes.route("/ask", methods=["POST"])
+def ask():
+    try:
+        database = get_database_registry().resolve(request.json.get("database"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        query = check_if_null(request.json.get("message"))
+        conversation_id = conversation_key(current_conversation_id(), database)
+        conversation_summary, conversation_history = get_conversations().load(conversation_id)
+        chart_format = request.json.get("chart_format", CHART_FORMAT)
+        payload, final_answer = answer_question(query, conversation_history, conversation_summary,
+                                                chart_format=chart_format, database=database)
+
+        # Append the question and response to conversation history
+        get_conversations().append(conversation_id, [("user", query), ("ai", final_answer)])
+        return jsonify(payload)
     
     except Exception as e:
         logging.error("An error occurred: %s", e, exc_info=True)
         return jsonify({"error": str(e)}), 500
 
-@app.route("/reset", methods=["POST"])
+@routes.route("/ask/stream", methods=["POST"])
+def ask_stream():
+    """
+    Streams agent steps and the final answer tokens as Server-Sent Events, ending
+    with a "final" event that carries the same payload as /ask.
+    """
+    try:
+        database = get_database_registry().resolve(request.json.get("database"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    query = check_if_null(request.json.get("message"))
+    chart_format = request.json.get("chart_format", CHART_FORMAT)
+    conversation_id = conversation_key(current_conversation_id(), database)
+    conversation_summary, conversation_history = get_conversations().load(conversation_id)
+
+    events = queue.Queue()
+
+    def run_agent():
+        try:
+            payload, final_answer = answer_question(query, conversation_history, conversation_summary,
+                                                    callbacks=[StreamingAgentHandler(events)], chart_format=chart_format,
+                                                    database=database)
+            events.put(("final", payload))
+            get_conversations().append(conversation_id, [("user", query), ("ai", final_answer)])
+        except Exception as e:
+            logging.error("An error occurred: %s", e, exc_info=True)
+            events.put(("error", {"error": str(e)}))
+        finally:
+            events.put(None)
+
+    threading.Thread(target=run_agent, daemon=True).start()
+
+    def generate():
+        while True:
+            event = events.get()
+            if event is None:
+                break
+            yield format_sse(*event)
+
+    return Response(generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@routes.route("/reset", methods=["POST"])
 def reset_conversation():
-    session.pop('conversation_history', None)
+    reset_conversations(session.pop('conversation_id', None))
     return jsonify({"message": "Conversation history has been reset."})
 
+# Answers report batches with bounded concurrency and a shared LLM rate limit
+batch_runner = BatchRunner(answer_question)
+
+def parse_batch_request(data):
+    """
+    Returns the questions and the concurrency of a batch request, or raises ValueError.
+    """
+    questions = data.get("questions") if isinstance(data, dict) else None
+    if not isinstance(questions, list) or not questions:
+        raise ValueError("questions must be a non-empty list")
+    if not all(isinstance(question, str) and question.strip() for question in questions):
+        raise ValueError("each question must be a non-empty string")
+    concurrency = data.get("concurrency", BATCH_CONCURRENCY)
+    if isinstance(concurrency, str) and concurrency.strip().isdigit():
+        concurrency = int(concurrency)
+    if isinstance(concurrency, bool) or not isinstance(concurrency, int) or concurrency < 1:
+        raise ValueError("concurrency must be a positive integer")
+    return questions, concurrency
+
+@routes.route("/ask/batch", methods=["POST"])
+def ask_batch():
+    """
+    Answers a list of questions and streams one JSON line per question as it completes.
+    """
+    data = request.get_json(silent=True)
+    try:
+        questions, concurrency = parse_batch_request(data)
+        lines = batch_runner.run(questions, concurrency=concurrency,
+                                 chart_format=data.get("chart_format", CHART_FORMAT),
+                                 database=get_database_registry().resolve(data.get("database")))
+        first_line = next(lines)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def generate():
+        yield json.dumps(first_line, default=str) + "\n"
+        for line in lines:
+            yield json.dumps(line, default=str) + "\n"
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+@routes.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@routes.after_app_request
+def observe_request(response):
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    request_seconds.observe(time.perf_counter() - g.request_started, route, response.status_code)
+    return response
+
+@routes.route("/metrics")
+def metrics():
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+@routes.route("/cache/stats")
+def cache_stats():
+    return jsonify(get_answer_cache().stats())
+
+@routes.route("/pool/stats")
+def pool_stats():
+    return jsonify({context.name: context.pool_stats() for context in get_database_registry().open_contexts()})
+
+@routes.route("/databases")
+def databases():
+    return jsonify({"databases": get_database_registry().describe(), **get_database_registry().stats()})
+
+@routes.route("/ready")
+def ready():
+    """
+    Readiness probe: 200 once the warm-up has built the clients, 503 before that.
+    """
+    status = startup.status()
+    return jsonify(status), 200 if status["ready"] else 503
+
+# The session cookie is signed with a random key, so it stays valid for the life of the process
+SECRET_KEY = os.urandom(24)
+
+def create_app(warm_up=WARM_UP_ENABLED):
+    """
+    Builds the Flask app. Nothing heavy happens here: the LLM client, database
+    connections and the agent are built on first use, or right away in a background
+    thread when warm_up is set, and /ready reports when that has finished.
+    """
+    flask_app = Flask(__name__)
+    flask_app.secret_key = SECRET_KEY
+    flask_app.register_blueprint(routes)
+    if warm_up:
+        startup.start()
+    return flask_app
+
+@built_once
+def get_app():
+    return create_app()
+
+def __getattr__(name):
+    # The module-level app of "flask run" and gunicorn app:app is built, and starts its
+    # warm-up, when they first read it; importing the module for its functions does not
+    if name == "app":
+        return get_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 if __name__ == "__main__":
-    app.run(debug=True)
+    get_app().run(debug=True)
@@ -0,0 +1,210 @@
+import json
+import asyncio
+import logging
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from quart import Quart, Response, request, jsonify, render_template, session, g
+
+import app as flask_app
+from agent_stream import StreamingAgentHandler, format_sse
+from app import (answer_question_async, batch_runner, check_if_null, conversation_key, get_answer_cache,
+                 get_conversations, get_database_registry, parse_batch_request, reset_conversations)
+from charts import CHART_FORMAT
+from db_pool import SQL_POOL_MAX_OVERFLOW, SQL_POOL_SIZE
+from telemetry import render_metrics, request_seconds
+from warm_up import WARM_UP_ENABLED
+
+# Async serving mode for the same routes as app.py, run with: hypercorn asgi_app:asgi_app
+# LLM calls are awaited, so a request waiting on Azure OpenAI does not hold a thread.
+asgi_app = Quart(__name__)
+asgi_app.secret_key = flask_app.SECRET_KEY
+
+
+@asgi_app.before_serving
+async def start_warm_up():
+    if WARM_UP_ENABLED:
+        flask_app.startup.start()
+
+
+@asgi_app.before_serving
+async def size_database_executor():
+    # LangChain runs the synchronous SQL tools in the default executor; one thread per
+    # pooled connection keeps database calls from queueing behind each other
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=SQL_POOL_SIZE + SQL_POOL_MAX_OVERFLOW, thread_name_prefix="sql")
+    )
+
+
+@asgi_app.before_request
+async def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@asgi_app.after_request
+async def observe_request(response):
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    request_seconds.observe(time.perf_counter() - g.request_started, route, response.status_code)
+    return response
+
+
+def current_conversation_id():
+    if 'conversation_id' not in session:
+        session['conversation_id'] = uuid.uuid4().hex
+    return session['conversation_id']
+
+
+@asgi_app.route("/")
+async def index():
+    return await render_template("index.html")
+
+
+@asgi_app.route("/ask", methods=["POST"])
+async def ask():
+    data = await request.get_json()
+    try:
+        database = get_database_registry().resolve(data.get("database"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        query = check_if_null(data.get("message"))
+        conversation_id = conversation_key(current_conversation_id(), database)
+        conversation_summary, conversation_history = await asyncio.to_thread(get_conversations().load, conversation_id)
+        payload, final_answer = await answer_question_async(query, conversation_history, conversation_summary,
+                                                            chart_format=data.get("chart_format", CHART_FORMAT),
+                                                            database=database)
+
+        # Append the question and response to conversation history, summarizing older turns off the loop
+        await asyncio.to_thread(get_conversations().append, conversation_id, [("user", query), ("ai", final_answer)])
+        return jsonify(payload)
+
+    except Exception as e:
+        logging.error("An error occurred: %s", e, exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+
+class LoopQueue:
+    """
+    Hands the events that agent callbacks put, from the event loop or from worker
+    threads, to an asyncio queue read by the streaming response.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+
+    def put(self, event):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+
+
+# Agent runs of streaming requests, referenced until done so a closed stream does not cancel them
+_stream_tasks = set()
+
+
+@asgi_app.route("/ask/stream", methods=["POST"])
+async def ask_stream():
+    """
+    Streams agent steps and the final answer tokens as Server-Sent Events, ending
+    with a "final" event that carries the same payload as /ask.
+    """
+    data = await request.get_json()
+    try:
+        database = get_database_registry().resolve(data.get("database"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    query = check_if_null(data.get("message"))
+    chart_format = data.get("chart_format", CHART_FORMAT)
+    conversation_id = conversation_key(current_conversation_id(), database)
+    conversation_summary, conversation_history = await asyncio.to_thread(get_conversations().load, conversation_id)
+
+    events = LoopQueue()
+
+    async def run_agent():
+        try:
+            payload, final_answer = await answer_question_async(query, conversation_history, conversation_summary,
+                                                                callbacks=[StreamingAgentHandler(events)],
+                                                                chart_format=chart_format, database=database)
+            events.put(("final", payload))
+            await asyncio.to_thread(get_conversations().append, conversation_id,
+                                    [("user", query), ("ai", final_answer)])
+        except Exception as e:
+            logging.error("An error occurred: %s", e, exc_info=True)
+            events.put(("error", {"error": str(e)}))
+        finally:
+            events.put(None)
+
+    task = asyncio.ensure_future(run_agent())
+    _stream_tasks.add(task)
+    task.add_done_callback(_stream_tasks.discard)
+
+    async def generate():
+        while True:
+            event = await events.queue.get()
+            if event is None:
+                break
+            yield format_sse(*event)
+
+    response = Response(generate(), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    # Agent runs can outlast Quart's default response timeout
+    response.timeout = None
+    return response
+
+
+@asgi_app.route("/ask/batch", methods=["POST"])
+async def ask_batch():
+    data = await request.get_json(silent=True)
+    try:
+        questions, concurrency = parse_batch_request(data)
+        lines = batch_runner.run(questions, concurrency=concurrency,
+                                 chart_format=data.get("chart_format", CHART_FORMAT),
+                                 database=get_database_registry().resolve(data.get("database")))
+        first_line = await asyncio.to_thread(next, lines)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    async def generate():
+        line = first_line
+        while line is not None:
+            yield json.dumps(line, default=str) + "\n"
+            # The batch runs its agents in worker threads, waiting for the next result off the loop
+            line = await asyncio.to_thread(next, lines, None)
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+
+@asgi_app.route("/reset", methods=["POST"])
+async def reset_conversation():
+    await asyncio.to_thread(reset_conversations, session.pop('conversation_id', None))
+    return jsonify({"message": "Conversation history has been reset."})
+
+
+@asgi_app.route("/metrics")
+async def metrics():
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+
+@asgi_app.route("/cache/stats")
+async def cache_stats():
+    return jsonify(await asyncio.to_thread(get_answer_cache().stats))
+
+
+@asgi_app.route("/pool/stats")
+async def pool_stats():
+    return jsonify({context.name: context.pool_stats() for context in get_database_registry().open_contexts()})
+
+
+@asgi_app.route("/databases")
+async def databases():
+    return jsonify({"databases": get_database_registry().describe(), **get_database_registry().stats()})
+
+
+@asgi_app.route("/ready")
+async def ready():
+    status = flask_app.startup.status()
+    return jsonify(status), 200 if status["ready"] else 503
+
+
+if __name__ == "__main__":
+    asgi_app.run()
@@ -0,0 +1,145 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from answer_cache import normalize_question
+from query_results import QueryMemo, current_query_memo
+
+# Questions of one batch answered at the same time
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '4'))
+BATCH_MAX_CONCURRENCY = int(os.getenv('BATCH_MAX_CONCURRENCY', '16'))
+BATCH_MAX_QUESTIONS = int(os.getenv('BATCH_MAX_QUESTIONS', '200'))
+# LLM calls per minute across all batches of this process, 0 disables the limit
+LLM_RATE_LIMIT_PER_MINUTE = float(os.getenv('LLM_RATE_LIMIT_PER_MINUTE', '120'))
+LLM_RATE_LIMIT_BURST = int(os.getenv('LLM_RATE_LIMIT_BURST', '10'))
+
+
+class TokenBucket:
+    """
+    Allows rate_per_minute acquisitions per minute on average and up to burst at once.
+    """
+
+    def __init__(self, rate_per_minute=LLM_RATE_LIMIT_PER_MINUTE, burst=LLM_RATE_LIMIT_BURST):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a token is available. Returns the seconds spent waiting.
+        """
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+class RateLimitHandler(BaseCallbackHandler):
+    """
+    Takes a token from the bucket before each LLM call. Synchronous callbacks run
+    on the calling thread before the request is sent, so the call waits for it.
+    """
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        waited = self.bucket.acquire()
+        if waited:
+            logging.debug("LLM call waited %.2fs for the rate limit", waited)
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.on_llm_start(serialized, [], **kwargs)
+
+
+def dedupe_questions(questions):
+    """
+    Returns the distinct questions, compared after normalization, and for each
+    input position the index of its distinct question.
+    """
+    unique, positions, first_index = [], [], {}
+    for question in questions:
+        key = normalize_question(question)
+        if key not in first_index:
+            first_index[key] = len(unique)
+            unique.append(question)
+        positions.append(first_index[key])
+    return unique, positions
+
+
+class BatchRunner:
+    """
+    Answers a list of standalone questions with a bounded number of agents running
+    at once. Repeated questions are answered once, every LLM call goes through the
+    shared token bucket, and SQL results are shared between the batch's questions.
+    """
+
+    def __init__(self, answer_question, bucket=None, max_questions=BATCH_MAX_QUESTIONS,
+                 max_concurrency=BATCH_MAX_CONCURRENCY):
+        self.answer_question = answer_question
+        self.bucket = bucket or TokenBucket()
+        self.max_questions = max_questions
+        self.max_concurrency = max_concurrency
+
+    def run(self, questions, concurrency=BATCH_CONCURRENCY, **answer_options):
+        """
+        Yields one result per input question as soon as it is answered, with its
+        index in the input, so callers can stream results in completion order.
+        """
+        if len(questions) > self.max_questions:
+            raise ValueError(f"A batch may hold at most {self.max_questions} questions")
+        unique, positions = dedupe_questions(questions)
+        indexes_by_unique = {}
+        for index, unique_index in enumerate(positions):
+            indexes_by_unique.setdefault(unique_index, []).append(index)
+
+        memo = QueryMemo()
+        rate_limit = RateLimitHandler(self.bucket)
+
+        def answer(question):
+            token = current_query_memo.set(memo)
+            try:
+                started_at = time.perf_counter()
+                payload, final_answer = self.answer_question(question, [], callbacks=[rate_limit], **answer_options)
+                return dict(payload, answer=final_answer, elapsed_ms=round((time.perf_counter() - started_at) * 1000, 1))
+            finally:
+                current_query_memo.reset(token)
+
+        workers = max(1, min(concurrency, self.max_concurrency, len(unique)))
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch")
+        try:
+            futures = {executor.submit(answer, question): unique_index for unique_index, question in enumerate(unique)}
+            for future in as_completed(futures):
+                unique_index = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logging.error("Batch question failed: %s", e, exc_info=True)
+                    result = {"error": str(e)}
+                first_index = indexes_by_unique[unique_index][0]
+                for index in indexes_by_unique[unique_index]:
+                    line = {"index": index, "question": questions[index], **result}
+                    if index != first_index:
+                        line["duplicate_of"] = first_index
+                    yield line
+        finally:
+            # A client that disconnects mid-batch leaves questions that no longer need answering
+            executor.shutdown(wait=False, cancel_futures=True)
+        logging.info("Batch of %d questions (%d distinct) shared %d query results",
+                     len(questions), len(unique), memo.hits)
@@ -0,0 +1,276 @@
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from fixture_db import create_fixture_database
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_TRANSCRIPTS = os.path.join(BENCHMARK_DIR, "benchmarks", "transcripts.jsonl")
+DEFAULT_RESULTS_DIR = os.path.join(BENCHMARK_DIR, ".cache", "benchmarks")
+
+# Metrics compared between runs, and whether a higher value is better
+COMPARED_METRICS = {
+    "p50_ms": False, "p95_ms": False, "mean_ms": False, "requests_per_s": True,
+    "llm_calls_per_request": False, "sql_statements_per_request": False, "prompt_tokens_per_request": False,
+    "max_rss_mb": False, "tracemalloc_peak_mb": False, "import_ms": False, "ready_ms": False,
+}
+
+# Run in a fresh interpreter by --startup: time to import app, then until the warm-up is done
+STARTUP_SCRIPT = """
+import json, sys, time
+started_at = time.perf_counter()
+import app
+app.app  # built on first access, as by "flask run" or gunicorn, which starts the warm-up
+imported_at = time.perf_counter()
+ready = app.startup.wait(float(sys.argv[1]))
+print(json.dumps({"import_s": imported_at - started_at, "ready_s": time.perf_counter() - started_at, "ready": ready}))
+"""
+
+
+def git_revision():
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], cwd=BENCHMARK_DIR, capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return ""
+    return {"commit": git("rev-parse", "--short", "HEAD") or "unknown",
+            "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def prepare_environment(args, work_dir):
+    """
+    Points the app at a generated SQLite database and the replay LLM. Has to run
+    before app is imported, since it reads its configuration at import time.
+    """
+    database_url = create_fixture_database(
+        f"sqlite:///{os.path.join(work_dir, 'fixture.db')}",
+        products=200 * args.scale, orders=2000 * args.scale, patients=500 * args.scale
+    )
+    os.environ.update(
+        SQL_DATABASE_URL=database_url,
+        SCHEMA_CACHE_DIR=os.path.join(work_dir, "schema"),
+        SCHEMA_REFRESH_INTERVAL="0",
+        ROUTER_TEMPLATES_URL="memory://",
+        AGENT_TRACES_URL="memory://",
+        AGENT_TRACES_ENABLED="true" if args.agent_traces else "false",
+        COALESCE_ENABLED="true" if args.coalesce else "false",
+        COALESCE_LOCK_DIR=os.path.join(work_dir, "inflight"),
+        ROUTER_ENABLED="true" if args.router else "false",
+        ANSWER_CACHE_URL="memory://",
+        LOG_LEVEL=os.environ.get("LOG_LEVEL", "WARNING"),
+        AGENT_VERBOSE="false",
+        OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "replay-key"),
+    )
+    if not args.answer_cache:
+        # An in-memory cache that keeps no entries, so every request runs the pipeline
+        os.environ["ANSWER_CACHE_MAX_ENTRIES"] = "0"
+    if not args.record:
+        os.environ.update(LLM_REPLAY_PATH=args.transcripts, LLM_REPLAY_LATENCY=str(args.llm_latency))
+    return database_url
+
+
+def record_transcripts(app, questions, path):
+    """
+    Runs each question against the configured live LLM and saves its completions.
+    """
+    from replay_llm import TranscriptRecorder
+
+    with open(path, "w", encoding="utf-8") as transcript_file:
+        for question in questions:
+            recorder = TranscriptRecorder()
+            app.answer_question(question, [], callbacks=[recorder])
+            transcript_file.write(json.dumps({"question": question, "completions": recorder.completions}) + "\n")
+            print(f"Recorded {len(recorder.completions)} completions for: {question}")
+
+
+def run_benchmark(app, questions, args):
+    """
+    Posts every question to /ask iterations times with a bounded number of requests
+    in flight and collects latency and per-request counts.
+    """
+
+    def ask(question):
+        # A fresh client per request keeps conversation histories apart
+        client = app.app.test_client()
+        started_at = time.perf_counter()
+        response = client.post("/ask", json={"message": question, "chart_format": args.chart_format})
+        latency = time.perf_counter() - started_at
+        payload = response.get_json(silent=True) or {}
+        return {
+            "ok": response.status_code == 200,
+            "latency": latency,
+            "sql_statements": len(payload.get("sql_statements", [])),
+            "prompt_tokens": payload.get("llm_usage", {}).get("prompt_tokens", 0),
+        }
+
+    workload = [question for _ in range(args.iterations) for question in questions]
+    for question in questions[:args.warmup]:
+        ask(question)
+
+    llm_calls_before = app.get_llm().call_count
+    started_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if args.tracemalloc:
+        tracemalloc.start()
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(ask, workload))
+    elapsed = time.perf_counter() - started_at
+    tracemalloc_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+    if args.tracemalloc:
+        tracemalloc.stop()
+
+    succeeded = [result for result in results if result["ok"]]
+    latencies = sorted(result["latency"] for result in succeeded)
+    count = len(succeeded) or 1
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss_scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "requests": len(results),
+        "failures": len(results) - len(succeeded),
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(len(succeeded) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(statistics.median(latencies) * 1000, 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2) if latencies else None,
+        "llm_calls_per_request": round((app.get_llm().call_count - llm_calls_before) / len(results), 2),
+        "sql_statements_per_request": round(sum(result["sql_statements"] for result in succeeded) / count, 2),
+        "prompt_tokens_per_request": round(sum(result["prompt_tokens"] for result in succeeded) / count, 1),
+        "max_rss_mb": round(max(started_rss, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss) / rss_scale, 1),
+        "tracemalloc_peak_mb": round(tracemalloc_peak / (1024 * 1024), 2) if tracemalloc_peak is not None else None,
+    }
+
+
+def slowest_imports(stderr, limit=10):
+    """
+    Returns the modules imported directly by app with the largest cumulative import
+    time, from the output of python -X importtime.
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # app itself is indented by one space, the modules it imports by three
+        if name.startswith("   ") and not name.startswith("    "):
+            imports.append((int(cumulative), name.strip()))
+    imports.sort(reverse=True)
+    return [{"module": name, "cumulative_ms": round(cumulative / 1000, 1)} for cumulative, name in imports[:limit]]
+
+
+def run_startup_benchmark(args):
+    """
+    Starts a fresh interpreter iterations times and measures how long importing app
+    takes and how long it takes until the warm-up thread reports ready.
+    """
+    runs = []
+    for _ in range(args.iterations):
+        completed = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT, "120"], cwd=BENCHMARK_DIR,
+                                   capture_output=True, text=True, check=True)
+        runs.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    # Without the warm-up thread, whose imports would interleave with the ones being measured
+    importtime = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=BENCHMARK_DIR,
+                                env=dict(os.environ, WARM_UP_ENABLED="false"), capture_output=True, text=True,
+                                check=True)
+    return {
+        "startup_runs": len(runs),
+        "import_ms": round(statistics.median(run["import_s"] for run in runs) * 1000, 1),
+        "ready_ms": round(statistics.median(run["ready_s"] for run in runs) * 1000, 1),
+        "ready": all(run["ready"] for run in runs),
+        "slowest_imports": slowest_imports(importtime.stderr),
+    }
+
+
+def compare(current, baseline):
+    """
+    Prints each metric of the current run next to a baseline run with the change.
+    """
+    print(f"\nCompared with {baseline['revision']['commit']}:")
+    for metric, higher_is_better in COMPARED_METRICS.items():
+        old, new = baseline["results"].get(metric), current["results"].get(metric)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old * 100 if old else 0.0
+        better = change > 0 if higher_is_better else change < 0
+        marker = "" if abs(change) < 1 else (" better" if better else " worse")
+        print(f"  {metric:28} {old:>10} -> {new:>10}  ({change:+.1f}%{marker})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /ask offline against a replay LLM and a SQLite fixture")
+    parser.add_argument("--transcripts", default=DEFAULT_TRANSCRIPTS, help="recorded transcripts (JSONL)")
+    parser.add_argument("--scale", type=int, default=1, help="multiplies the fixture row counts")
+    parser.add_argument("--iterations", type=int, default=5, help="passes over the transcript questions")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--warmup", type=int, default=3, help="questions asked before measuring")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds per replayed completion")
+    parser.add_argument("--chart-format", choices=["png", "spec"], default="png")
+    parser.add_argument("--answer-cache", action="store_true", help="keep the answer cache enabled")
+    parser.add_argument("--router", action="store_true", help="keep the SQL template router enabled")
+    parser.add_argument("--agent-traces", action="store_true", help="give the agent hints from earlier runs")
+    parser.add_argument("--coalesce", action="store_true", help="answer identical concurrent questions once")
+    parser.add_argument("--tracemalloc", action="store_true", help="measure the Python heap peak (slower)")
+    parser.add_argument("--output", help="result file, defaults to .cache/benchmarks/<commit>.json")
+    parser.add_argument("--compare", help="result file of an earlier run to compare with")
+    parser.add_argument("--startup", action="store_true",
+                        help="measure import and warm-up time in fresh interpreters instead of /ask")
+    parser.add_argument("--record", action="store_true",
+                        help="record the transcripts' questions against the live LLM instead of benchmarking")
+    args = parser.parse_args()
+
+    questions = [json.loads(line)["question"] for line in open(args.transcripts, encoding="utf-8") if line.strip()]
+    work_dir = tempfile.mkdtemp(prefix="benchmark-")
+    prepare_environment(args, work_dir)
+    if args.startup:
+        results = run_startup_benchmark(args)
+    else:
+        sys.path.insert(0, BENCHMARK_DIR)
+        import app
+
+        if args.record:
+            record_transcripts(app, questions, args.transcripts)
+            return
+
+        try:
+            results = run_benchmark(app, questions, args)
+        finally:
+            app.chart_renderer.shutdown()
+    report = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "record")},
+        "results": results,
+    }
+    report["config"]["transcripts"] = os.path.relpath(args.transcripts, BENCHMARK_DIR)
+    print(json.dumps(report, indent=2))
+
+    output = args.output or os.path.join(DEFAULT_RESULTS_DIR, f"{report['revision']['commit']}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"Saved {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline_file:
+            compare(report, json.load(baseline_file))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import os
+import json
+import base64
+import hashlib
+import logging
+import threading
+import multiprocessing
+from io import BytesIO
+from decimal import Decimal
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+CHART_WORKERS = int(os.getenv('CHART_WORKERS', '2'))
+CHART_RENDER_TIMEOUT = int(os.getenv('CHART_RENDER_TIMEOUT', '30'))
+# Workers are started fresh, forking a server that already runs threads can deadlock them
+CHART_START_METHOD = os.getenv('CHART_START_METHOD', 'spawn')
+CHART_CACHE_MAX_ENTRIES = int(os.getenv('CHART_CACHE_MAX_ENTRIES', '256'))
+# "png" renders on the server, "spec" returns the data for app.js to draw
+CHART_FORMAT = os.getenv('CHART_FORMAT', 'png')
+
+CHART_TITLES = {
+    "pie": "Query Result Visualization (Pie Chart)",
+    "bar": "Query Result Visualization (Bar Chart)",
+}
+
+
+def _json_value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (int, float)) or value is None:
+        return value
+    return str(value)
+
+
+def build_chart_spec(query, rows, x_label, y_label):
+    """
+    Returns the chart type, labels and values for the first two columns of the rows.
+    """
+    chart_type = "pie" if "pie" in query.lower() else "bar"
+    return {
+        "type": chart_type,
+        "title": CHART_TITLES[chart_type],
+        "x_label": str(x_label),
+        "y_label": str(y_label),
+        "labels": [str(_json_value(row[0])) for row in rows],
+        "values": [_json_value(row[1]) for row in rows],
+    }
+
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use("Agg")
+
+
+def render_chart_png(spec):
+    """
+    Renders a chart spec to PNG bytes with the object-oriented Figure API, which
+    keeps no global pyplot state between charts.
+    """
+    from matplotlib.figure import Figure
+
+    if spec["type"] == "pie":
+        figure = Figure(figsize=(8, 8))
+        axes = figure.subplots()
+        axes.pie(spec["values"], labels=spec["labels"], autopct='%1.1f%%', startangle=140)
+    else:
+        figure = Figure(figsize=(10, 6))
+        axes = figure.subplots()
+        axes.bar(spec["labels"], spec["values"])
+        axes.set_xlabel(spec["x_label"])
+        axes.set_ylabel(spec["y_label"])
+    axes.set_title(spec["title"])
+
+    img = BytesIO()
+    try:
+        figure.savefig(img, format="png")
+    finally:
+        figure.clear()
+    return img.getvalue()
+
+
+class ChartRenderer:
+    """
+    Renders charts in a process pool and caches the base64 PNG by a hash of the chart
+    data. A pool broken by a crashed worker is replaced with a new one.
+    """
+
+    def __init__(self, workers=CHART_WORKERS, max_entries=CHART_CACHE_MAX_ENTRIES, timeout=CHART_RENDER_TIMEOUT,
+                 start_method=CHART_START_METHOD):
+        self.workers = workers
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.start_method = start_method
+        self._executor = None
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                                     mp_context=multiprocessing.get_context(self.start_method))
+            return self._executor
+
+    def _discard_executor(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _render_png(self, spec):
+        for attempt in range(2):
+            executor = self._get_executor()
+            try:
+                return executor.submit(render_chart_png, spec).result(timeout=self.timeout)
+            except BrokenProcessPool:
+                logging.warning("Chart worker pool is broken, starting a new one")
+                self._discard_executor(executor)
+                if attempt:
+                    raise
+
+    def render(self, spec):
+        key = hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        png = self._render_png(spec)
+        img_base64 = base64.b64encode(png).decode()
+
+        with self._lock:
+            self._cache[key] = img_base64
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return img_base64
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+
+CONVERSATION_STORE_URL = os.getenv('CONVERSATION_STORE_URL', 'memory://')
+CONVERSATION_TTL = int(os.getenv('CONVERSATION_TTL', '86400'))
+CONVERSATION_MAX_SESSIONS = int(os.getenv('CONVERSATION_MAX_SESSIONS', '10000'))
+# Tokens of verbatim history sent with each prompt; older turns are folded into a summary
+CONVERSATION_TOKEN_BUDGET = int(os.getenv('CONVERSATION_TOKEN_BUDGET', '1500'))
+CONVERSATION_SUMMARY_TOKENS = int(os.getenv('CONVERSATION_SUMMARY_TOKENS', '300'))
+
+_encoding = None
+
+
+def count_tokens(text):
+    """
+    Counts tokens with tiktoken when it is installed, otherwise estimates four
+    characters per token.
+    """
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text))
+    return len(text) // 4 + 1
+
+
+def truncate_to_tokens(text, max_tokens):
+    if count_tokens(text) <= max_tokens:
+        return text
+    if _encoding:
+        return _encoding.decode(_encoding.encode(text)[:max_tokens])
+    return text[:max_tokens * 4]
+
+
+class InMemoryConversationStore:
+    """
+    Process-local conversation store, evicting the least recently used conversations
+    and those idle for longer than the TTL.
+    """
+
+    def __init__(self, max_sessions=CONVERSATION_MAX_SESSIONS, ttl=CONVERSATION_TTL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._conversations = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, conversation_id):
+        with self._lock:
+            entry = self._conversations.get(conversation_id)
+            if entry is None:
+                return None
+            accessed_at, conversation = entry
+            if accessed_at + self.ttl < time.time():
+                del self._conversations[conversation_id]
+                return None
+            self._conversations[conversation_id] = (time.time(), conversation)
+            self._conversations.move_to_end(conversation_id)
+            return conversation
+
+    def set(self, conversation_id, conversation):
+        with self._lock:
+            self._conversations[conversation_id] = (time.time(), conversation)
+            self._conversations.move_to_end(conversation_id)
+            while len(self._conversations) > self.max_sessions:
+                self._conversations.popitem(last=False)
+
+    def delete(self, conversation_id):
+        with self._lock:
+            self._conversations.pop(conversation_id, None)
+
+
+class SQLiteConversationStore:
+    """
+    Conversation store shared by all workers on one host.
+    """
+
+    def __init__(self, path, max_sessions=CONVERSATION_MAX_SESSIONS, ttl=CONVERSATION_TTL):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        with self._connect() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS conversations '
+                '(conversation_id TEXT PRIMARY KEY, conversation TEXT, accessed_at REAL)'
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def get(self, conversation_id):
+        now = time.time()
+        with self._connect() as connection:
+            row = connection.execute(
+                'SELECT conversation FROM conversations WHERE conversation_id = ? AND accessed_at >= ?',
+                (conversation_id, now - self.ttl)
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute('UPDATE conversations SET accessed_at = ? WHERE conversation_id = ?', (now, conversation_id))
+            return json.loads(row[0])
+
+    def set(self, conversation_id, conversation):
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO conversations (conversation_id, conversation, accessed_at) VALUES (?, ?, ?)',
+                (conversation_id, json.dumps(conversation), now)
+            )
+            connection.execute('DELETE FROM conversations WHERE accessed_at < ?', (now - self.ttl,))
+            connection.execute(
+                'DELETE FROM conversations WHERE conversation_id NOT IN '
+                '(SELECT conversation_id FROM conversations ORDER BY accessed_at DESC LIMIT ?)',
+                (self.max_sessions,)
+            )
+
+    def delete(self, conversation_id):
+        with self._connect() as connection:
+            connection.execute('DELETE FROM conversations WHERE conversation_id = ?', (conversation_id,))
+
+
+def conversation_store_from_url(url):
+    """
+    Picks a store from a URL: memory:// or sqlite:///path/to/file.db.
+    """
+    if url.startswith('sqlite:///'):
+        return SQLiteConversationStore(url[len('sqlite:///'):])
+    return InMemoryConversationStore()
+
+
+class ConversationMemory:
+    """
+    Keeps the recent turns of each conversation verbatim within a token budget and
+    folds older turns into a rolling summary, so the history part of the prompt stays
+    the same size however long the conversation runs.
+    """
+
+    def __init__(self, store, summarize, token_budget=CONVERSATION_TOKEN_BUDGET,
+                 summary_tokens=CONVERSATION_SUMMARY_TOKENS):
+        self.store = store
+        self.summarize = summarize
+        self.token_budget = token_budget
+        self.summary_tokens = summary_tokens
+        # Striped locks serialize updates to the same conversation without a lock per id
+        self._locks = [threading.Lock() for _ in range(64)]
+
+    def _lock_for(self, conversation_id):
+        return self._locks[hash(conversation_id) % len(self._locks)]
+
+    def load(self, conversation_id):
+        """
+        Returns the summary of the older turns and the recent turns as (role, content) tuples.
+        """
+        conversation = self.store.get(conversation_id) if conversation_id else None
+        if conversation is None:
+            return "", []
+        return conversation["summary"], [tuple(turn) for turn in conversation["turns"]]
+
+    def append(self, conversation_id, new_turns):
+        with self._lock_for(conversation_id):
+            summary, turns = self.load(conversation_id)
+            turns = turns + list(new_turns)
+            summary, turns = self._compact(summary, turns)
+            self.store.set(conversation_id, {"summary": summary, "turns": turns})
+
+    def _compact(self, summary, turns):
+        """
+        Once the turns exceed the budget, the oldest ones are summarized until the rest
+        fit in half of it, so a summary is not produced on every turn.
+        """
+        turn_tokens = [count_tokens(content) for _, content in turns]
+        if sum(turn_tokens) <= self.token_budget:
+            return summary, turns
+
+        folded = []
+        while turns and (sum(turn_tokens) > self.token_budget // 2 or len(folded) % 2):
+            folded.append(turns.pop(0))
+            turn_tokens.pop(0)
+        try:
+            summary = self.summarize(summary, folded, self.summary_tokens)
+        except Exception as e:
+            # Fall back to keeping the previous summary rather than failing the request
+            logging.warning("Conversation summarization failed: %s", e)
+        return truncate_to_tokens(summary, self.summary_tokens), turns
+
+    def reset(self, conversation_id):
+        if conversation_id:
+            self.store.delete(conversation_id)
@@ -0,0 +1,325 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine
+
+from db_pool import install_pool_metrics, pool_options, warm_up_pool
+from materialized_results import MATERIALIZE_ENABLED, MaterializedResults
+from query_governor import install_query_governor
+from query_results import CapturingSQLDatabase
+from replica_routing import SQL_REPLICA_URL, ReplicaRouter
+from schema_catalog import SchemaCatalog
+from schema_context import SCHEMA_CONTEXT_ENABLED, SchemaIndex
+from sql_trace import install_statement_trace
+from telemetry import AGENT_VERBOSE
+
+# Named databases served by this process as a JSON object, e.g. {"contoso": "mssql+pyodbc://...", "fabrikam": "..."}.
+# A value may also be {"url": ..., "replica_url": ...} to read from a replica. Without it the process serves a
+# single database named "default" from SQL_DATABASE_URL or SQL_SERVER/SQL_DB, and SQL_REPLICA_URL.
+SQL_DATABASES = os.getenv('SQL_DATABASES')
+# Database used by requests that do not name one, defaults to the first of SQL_DATABASES
+SQL_DEFAULT_DATABASE = os.getenv('SQL_DEFAULT_DATABASE')
+# Most databases kept open at once, the least recently used idle one is closed beyond that
+DATABASE_REGISTRY_MAX_OPEN = int(os.getenv('DATABASE_REGISTRY_MAX_OPEN', '8'))
+# Seconds a database may go unused before it is closed, 0 keeps databases open until evicted
+DATABASE_IDLE_TIMEOUT = int(os.getenv('DATABASE_IDLE_TIMEOUT', '1800'))
+
+
+def database_urls_from_env(default_url):
+    """
+    Returns the configured databases by name, each as {"url": ..., "replica_url": ...},
+    and the name of the default database.
+    """
+    if not SQL_DATABASES:
+        return {"default": {"url": default_url, "replica_url": SQL_REPLICA_URL}}, SQL_DEFAULT_DATABASE or "default"
+    urls = json.loads(SQL_DATABASES)
+    if not isinstance(urls, dict) or not urls:
+        raise ValueError("SQL_DATABASES must be a non-empty JSON object of database names to URLs")
+    default_name = SQL_DEFAULT_DATABASE or next(iter(urls))
+    if default_name not in urls:
+        raise ValueError(f"SQL_DEFAULT_DATABASE {default_name!r} is not in SQL_DATABASES")
+    return {name: value if isinstance(value, dict) else {"url": value} for name, value in urls.items()}, default_name
+
+
+class DatabaseContext:
+    """
+    Everything the app keeps per database: the engine with its pool and listeners,
+    an optional read replica engine, the schema catalog and index, the store of
+    materialized aggregates, the SQLDatabase, and the SQL agent, which is only
+    built when the first question for this database needs it.
+    """
+
+    def __init__(self, name, llm, url, replica_url=None):
+        self.name = name
+        self.llm = llm
+        self.engine = self._create_engine(url)
+        self.pool_metrics = install_pool_metrics(self.engine)
+        # The agent's read-only queries go to the replica, the catalog and everything else to the primary
+        self.replica_engine = self._create_engine(replica_url) if replica_url else None
+        self.replica_router = ReplicaRouter(self.engine, self.replica_engine) if replica_url else None
+
+        # Tables are reflected on demand and cached on disk, per engine
+        self.schema_catalog = SchemaCatalog(self.engine)
+        self.schema_index = SchemaIndex(self.engine, self.schema_catalog) if SCHEMA_CONTEXT_ENABLED else None
+        if self.schema_index is not None:
+            self.schema_index.start_background_build()
+        self.materialized_results = MaterializedResults(
+            self.schema_catalog.cache_path("materialized"), lambda: self.schema_catalog.fingerprint
+        ) if MATERIALIZE_ENABLED else None
+        self.db = CapturingSQLDatabase(self.engine, schema_catalog=self.schema_catalog,
+                                       schema_index=self.schema_index, replica_router=self.replica_router,
+                                       materialized_results=self.materialized_results)
+        self.schema_catalog.start_background_refresh(on_change=self.db.forget_tables)
+
+        self._agent = None
+        self._agent_lock = threading.Lock()
+        self.leases = 0
+        self.last_used = time.monotonic()
+
+    @staticmethod
+    def _create_engine(url):
+        engine = create_engine(url, **pool_options())
+        # Capture the SQL statements of each request with SQLAlchemy event listeners
+        install_statement_trace(engine)
+        # Cancel agent queries that run longer than the governor timeout
+        install_query_governor(engine)
+        warm_up_pool(engine)
+        return engine
+
+    @property
+    def agent(self):
+        if self._agent is None:
+            with self._agent_lock:
+                if self._agent is None:
+                    # The agent stack is slow to import and only needed once a question is asked
+                    from langchain.agents import AgentType
+                    from langchain_community.agent_toolkits.sql.base import create_sql_agent
+                    from langchain_community.agent_toolkits.sql.toolkit import SQLDatabaseToolkit
+
+                    self._agent = create_sql_agent(
+                        llm=self.llm,
+                        toolkit=SQLDatabaseToolkit(db=self.db, llm=self.llm),
+                        agent_type=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
+                        handle_parsing_errors=True,
+                        verbose=AGENT_VERBOSE
+                    )
+        return self._agent
+
+    @property
+    def schema_version(self):
+        # Cached answers and learned templates of one database never match another's
+        return f"{self.name}:{self.schema_catalog.fingerprint}"
+
+    def schema_context_for(self, question):
+        if self.schema_index is None:
+            return None
+        return self.schema_index.context_for(question)
+
+    def pool_stats(self):
+        return self.pool_metrics.snapshot(self.engine.pool)
+
+    def replica_stats(self):
+        return self.replica_router.stats() if self.replica_router is not None else {}
+
+    def materialized_stats(self):
+        return self.materialized_results.stats() if self.materialized_results is not None else {}
+
+    def close(self):
+        self.schema_catalog.stop_background_refresh()
+        self.engine.dispose()
+        if self.replica_engine is not None:
+            self.replica_engine.dispose()
+
+
+class DatabaseRegistry:
+    """
+    Opens named databases on first use and keeps at most max_open of them, closing
+    the least recently used one beyond that and any left idle for idle_timeout
+    seconds. A database is never closed while a request holds a lease on it, and
+    the default database is never closed for being idle.
+    """
+
+    def __init__(self, urls, default_name, open_database, max_open=DATABASE_REGISTRY_MAX_OPEN,
+                 idle_timeout=DATABASE_IDLE_TIMEOUT):
+        self.urls = dict(urls)
+        self.default_name = default_name
+        self.open_database = open_database
+        self.max_open = max(1, max_open)
+        self.idle_timeout = idle_timeout
+        self.opens = 0
+        self.evictions = 0
+        self._open = OrderedDict()
+        self._opening = {}
+        self._lock = threading.Lock()
+        self._eviction_thread = None
+
+    def names(self):
+        return list(self.urls)
+
+    def resolve(self, name=None):
+        """
+        Returns the name of the database a request targets, or raises ValueError.
+        """
+        name = name or self.default_name
+        if name not in self.urls:
+            raise ValueError(f"Unknown database: {name}")
+        return name
+
+    def _take(self, name):
+        # Caller holds self._lock
+        context = self._open.get(name)
+        if context is not None:
+            self._open.move_to_end(name)
+            context.leases += 1
+            context.last_used = time.monotonic()
+        return context
+
+    def acquire(self, name=None):
+        """
+        Returns the open database with a lease on it, opening it if needed. Every
+        acquire must be paired with release().
+        """
+        name = self.resolve(name)
+        with self._lock:
+            context = self._take(name)
+            if context is not None:
+                return context
+            opening = self._opening.setdefault(name, threading.Lock())
+        # Opening connects and reads the catalog, so only requests for this database wait on it
+        with opening:
+            with self._lock:
+                context = self._take(name)
+            if context is not None:
+                return context
+            context = self.open_database(name, **self.urls[name])
+            context.leases = 1
+            with self._lock:
+                self._opening.pop(name, None)
+                self._open[name] = context
+                self.opens += 1
+                evicted = self._pop_least_recently_used()
+        self._close(evicted, "the registry is full")
+        return context
+
+    def release(self, context):
+        with self._lock:
+            context.leases -= 1
+            context.last_used = time.monotonic()
+
+    @contextmanager
+    def lease(self, name=None):
+        context = self.acquire(name)
+        try:
+            yield context
+        finally:
+            self.release(context)
+
+    def _pop_least_recently_used(self):
+        # Caller holds self._lock; databases in use are skipped, so the bound may be exceeded briefly
+        evicted = []
+        for name in list(self._open):
+            if len(self._open) <= self.max_open:
+                break
+            if self._open[name].leases == 0:
+                evicted.append(self._open.pop(name))
+        return evicted
+
+    def evict_idle(self):
+        """
+        Closes databases that have not been used for idle_timeout seconds.
+        """
+        if self.idle_timeout <= 0:
+            return []
+        deadline = time.monotonic() - self.idle_timeout
+        with self._lock:
+            evicted = [context for name, context in self._open.items()
+                       if name != self.default_name and context.leases == 0 and context.last_used < deadline]
+            for context in evicted:
+                del self._open[context.name]
+        self._close(evicted, "it was idle")
+        return [context.name for context in evicted]
+
+    def _close(self, contexts, reason):
+        for context in contexts:
+            self.evictions += 1
+            logging.info("Closing database %s because %s", context.name, reason)
+            try:
+                context.close()
+            except Exception as e:
+                logging.warning("Could not close database %s: %s", context.name, e)
+
+    def start_idle_eviction(self):
+        """
+        Starts a daemon thread that closes idle databases.
+        """
+        if self.idle_timeout <= 0 or self._eviction_thread is not None:
+            return
+
+        def eviction_loop():
+            while True:
+                time.sleep(min(60, self.idle_timeout))
+                try:
+                    self.evict_idle()
+                except Exception as e:
+                    logging.warning("Idle database eviction failed: %s", e)
+
+        self._eviction_thread = threading.Thread(target=eviction_loop, name="database-eviction", daemon=True)
+        self._eviction_thread.start()
+
+    def open_contexts(self):
+        with self._lock:
+            return list(self._open.values())
+
+    def stats(self):
+        with self._lock:
+            return {
+                "configured": len(self.urls),
+                "open": len(self._open),
+                "in_use": sum(1 for context in self._open.values() if context.leases),
+                "opens": self.opens,
+                "evictions": self.evictions
+            }
+
+    def describe(self):
+        """
+        Returns the configured databases, whether each is open and its last use.
+        """
+        with self._lock:
+            open_contexts = dict(self._open)
+        now = time.monotonic()
+        return [{
+            "name": name,
+            "default": name == self.default_name,
+            "replica": bool(self.urls[name].get("replica_url")),
+            "open": name in open_contexts,
+            "in_use": open_contexts[name].leases if name in open_contexts else 0,
+            "idle_s": round(now - open_contexts[name].last_used, 1) if name in open_contexts else None,
+            "reads": open_contexts[name].replica_stats() if name in open_contexts else {},
+            "materialized": open_contexts[name].materialized_stats() if name in open_contexts else {}
+        } for name in self.urls]
+
+    def totals(self, collect):
+        """
+        Returns the numeric statistics of collect(context) summed over the open databases.
+        """
+        totals = {}
+        for context in self.open_contexts():
+            for key, value in collect(context).items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                totals[key] = max(totals.get(key, 0), value) if key.startswith("max_") else totals.get(key, 0) + value
+        return totals
+
+    def pool_totals(self):
+        """
+        Returns the connection pool statistics summed over the open databases.
+        """
+        totals = self.totals(DatabaseContext.pool_stats)
+        if totals.get("checkouts"):
+            totals["avg_wait_ms"] = round(totals["total_wait_ms"] / totals["checkouts"], 2)
+        return totals
@@ -0,0 +1,151 @@
+import os
+import time
+import logging
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+SQL_POOL_SIZE = int(os.getenv('SQL_POOL_SIZE', '5'))
+SQL_POOL_MAX_OVERFLOW = int(os.getenv('SQL_POOL_MAX_OVERFLOW', '10'))
+SQL_POOL_TIMEOUT = int(os.getenv('SQL_POOL_TIMEOUT', '30'))
+# Azure SQL closes idle connections after 30 minutes, recycle before that
+SQL_POOL_RECYCLE = int(os.getenv('SQL_POOL_RECYCLE', '1800'))
+SQL_POOL_PRE_PING = os.getenv('SQL_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+# Number of connections opened in the background right after startup
+SQL_POOL_WARM_CONNECTIONS = int(os.getenv('SQL_POOL_WARM_CONNECTIONS', '2'))
+SQL_CONNECT_TIMEOUT = int(os.getenv('SQL_CONNECT_TIMEOUT', '30'))
+
+
+class PoolMetrics:
+    """
+    Counters for checkouts, time spent waiting for a free connection and overflow
+    connections, used to size the pool per worker.
+    """
+
+    def __init__(self):
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.overflow_events = 0
+        self.timeouts = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+        self._lock = threading.Lock()
+
+    def record_wait(self, wait_ms, timed_out=False):
+        with self._lock:
+            self.total_wait_ms += wait_ms
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+            if timed_out:
+                self.timeouts += 1
+
+    def increment(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def snapshot(self, pool):
+        with self._lock:
+            return {
+                "pool_size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "checked_in": pool.checkedin(),
+                "overflow": pool.overflow(),
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "overflow_events": self.overflow_events,
+                "timeouts": self.timeouts,
+                "total_wait_ms": round(self.total_wait_ms, 2),
+                "avg_wait_ms": round(self.total_wait_ms / self.checkouts, 2) if self.checkouts else 0.0,
+                "max_wait_ms": round(self.max_wait_ms, 2)
+            }
+
+
+class MetricsQueuePool(QueuePool):
+    """
+    QueuePool that measures how long callers wait for a connection.
+    """
+
+    metrics = None
+
+    def _do_get(self):
+        if self.metrics is None:
+            return super()._do_get()
+        started_at = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.metrics.record_wait((time.perf_counter() - started_at) * 1000, timed_out=True)
+            raise
+        self.metrics.record_wait((time.perf_counter() - started_at) * 1000)
+        return connection
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+def pool_options():
+    """
+    Returns create_engine keyword arguments for the pool, read from the environment.
+    """
+    return {
+        "poolclass": MetricsQueuePool,
+        "pool_size": SQL_POOL_SIZE,
+        "max_overflow": SQL_POOL_MAX_OVERFLOW,
+        "pool_timeout": SQL_POOL_TIMEOUT,
+        "pool_recycle": SQL_POOL_RECYCLE,
+        "pool_pre_ping": SQL_POOL_PRE_PING
+    }
+
+
+def install_pool_metrics(engine):
+    """
+    Attaches a PoolMetrics instance to the engine's pool and returns it.
+    """
+    metrics = PoolMetrics()
+    engine.pool.metrics = metrics
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        metrics.increment("connects")
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        metrics.increment("checkouts")
+        if engine.pool.overflow() > 0:
+            metrics.increment("overflow_events")
+
+    @event.listens_for(engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        metrics.increment("checkins")
+
+    return metrics
+
+
+def warm_up_pool(engine, connections=SQL_POOL_WARM_CONNECTIONS):
+    """
+    Opens connections in a background thread and returns them to the pool, so the
+    first requests do not pay for the TLS handshake to the server.
+    """
+    if connections <= 0:
+        return None
+
+    def warm_up():
+        opened = []
+        try:
+            for _ in range(min(connections, engine.pool.size())):
+                opened.append(engine.connect())
+        except Exception as e:
+            logging.warning("Connection pool warm-up failed: %s", e)
+        finally:
+            for connection in opened:
+                connection.close()
+        logging.info("Connection pool warmed up with %d connections", len(opened))
+
+    thread = threading.Thread(target=warm_up, name="pool-warm-up", daemon=True)
+    thread.start()
+    return thread
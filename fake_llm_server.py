@@ -0,0 +1,65 @@
+import os
+import json
+import time
+import asyncio
+
+from quart import Quart, Response, request, jsonify
+
+# Seconds each completion waits before answering, standing in for Azure OpenAI latency
+FAKE_LLM_LATENCY = float(os.getenv('FAKE_LLM_LATENCY', '0.5'))
+
+FAKE_SQL = (
+    "SELECT c.CategoryName, COUNT(p.ProductID) AS ProductCount FROM Categories c "
+    "JOIN Products p ON p.CategoryID = c.CategoryID GROUP BY c.CategoryName"
+)
+
+app = Quart(__name__)
+
+
+def fake_completion(prompt):
+    """
+    Plays a two-step ReAct conversation: query the database first, then answer once
+    the observation of that query is part of the prompt.
+    """
+    if f"Action Input: {FAKE_SQL}" in prompt:
+        return "Thought: I now know the final answer\nFinal Answer: Products are spread over 8 categories."
+    return f"Thought: I should count the products per category.\nAction: sql_db_query\nAction Input: {FAKE_SQL}"
+
+
+@app.route("/openai/deployments/<deployment>/chat/completions", methods=["POST"])
+async def chat_completions(deployment):
+    body = await request.get_json()
+    prompt = "\n".join(str(message.get("content", "")) for message in body.get("messages", []))
+    content = fake_completion(prompt)
+    await asyncio.sleep(FAKE_LLM_LATENCY)
+    created = int(time.time())
+
+    if not body.get("stream"):
+        return jsonify({
+            "id": "fake-completion",
+            "object": "chat.completion",
+            "created": created,
+            "model": deployment,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                      "total_tokens": (len(prompt) + len(content)) // 4}
+        })
+
+    async def stream_chunks():
+        for index, word in enumerate(content.split(" ")):
+            delta = {"content": word if index == 0 else " " + word}
+            if index == 0:
+                delta["role"] = "assistant"
+            chunk = {"id": "fake-completion", "object": "chat.completion.chunk", "created": created,
+                     "model": deployment, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+            yield f"data: {json.dumps(chunk)}\n\n"
+        chunk = {"id": "fake-completion", "object": "chat.completion.chunk", "created": created,
+                 "model": deployment, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        yield f"data: {json.dumps(chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return Response(stream_chunks(), mimetype="text/event-stream")
+
+
+if __name__ == "__main__":
+    app.run(port=int(os.getenv('FAKE_LLM_PORT', '8001')))
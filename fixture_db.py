@@ -0,0 +1,76 @@
+import random
+import argparse
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine, text
+
+CATEGORY_NAMES = ["Beverages", "Condiments", "Confections", "Dairy Products", "Grains/Cereals",
+                  "Meat/Poultry", "Produce", "Seafood"]
+FIRST_NAMES = ["Amina", "Brian", "Chloe", "David", "Esther", "Felix", "Grace", "Hassan", "Irene", "James"]
+LAST_NAMES = ["Achieng", "Brown", "Chebet", "Davis", "Evans", "Fischer", "Garcia", "Hughes", "Ibrahim", "Jones"]
+CITIES = ["Nairobi", "Mombasa", "Kisumu", "Nakuru", "Eldoret"]
+DIAGNOSES = ["Hypertension", "Diabetes", "Asthma", "Malaria", "Influenza", "Migraine"]
+
+
+def create_fixture_database(url, products=200, orders=2000, patients=500, seed=42):
+    """
+    Creates a local database with Categories, Products, Orders and Patients tables
+    filled with deterministic data, for load tests and benchmarks that must not
+    touch Azure SQL.
+    """
+    rng = random.Random(seed)
+    engine = create_engine(url)
+    with engine.begin() as connection:
+        for table_name in ("Patients", "Orders", "Products", "Categories"):
+            connection.execute(text(f"DROP TABLE IF EXISTS {table_name}"))
+        connection.execute(text(
+            "CREATE TABLE Categories (CategoryID INTEGER PRIMARY KEY, CategoryName VARCHAR(50) NOT NULL)"
+        ))
+        connection.execute(text(
+            "CREATE TABLE Products (ProductID INTEGER PRIMARY KEY, ProductName VARCHAR(100) NOT NULL, "
+            "CategoryID INTEGER REFERENCES Categories(CategoryID), UnitPrice NUMERIC(10, 2))"
+        ))
+        connection.execute(text(
+            "CREATE TABLE Orders (OrderID INTEGER PRIMARY KEY, ProductID INTEGER REFERENCES Products(ProductID), "
+            "Quantity INTEGER, OrderDate DATE)"
+        ))
+        connection.execute(text(
+            "CREATE TABLE Patients (PatientID INTEGER PRIMARY KEY, FirstName VARCHAR(50), LastName VARCHAR(50), "
+            "Gender CHAR(1), BirthDate DATE, City VARCHAR(50), AdmissionDate DATE, Diagnosis VARCHAR(100))"
+        ))
+        connection.execute(
+            text("INSERT INTO Categories (CategoryID, CategoryName) VALUES (:id, :name)"),
+            [{"id": index + 1, "name": name} for index, name in enumerate(CATEGORY_NAMES)]
+        )
+        connection.execute(
+            text("INSERT INTO Products (ProductID, ProductName, CategoryID, UnitPrice) VALUES (:id, :name, :category, :price)"),
+            [{"id": product_id, "name": f"Product {product_id}", "category": rng.randint(1, len(CATEGORY_NAMES)),
+              "price": round(rng.uniform(1, 100), 2)} for product_id in range(1, products + 1)]
+        )
+        first_day = date(2024, 1, 1)
+        connection.execute(
+            text("INSERT INTO Orders (OrderID, ProductID, Quantity, OrderDate) VALUES (:id, :product, :quantity, :day)"),
+            [{"id": order_id, "product": rng.randint(1, products), "quantity": rng.randint(1, 20),
+              "day": first_day + timedelta(days=rng.randint(0, 364))} for order_id in range(1, orders + 1)]
+        )
+        connection.execute(
+            text("INSERT INTO Patients (PatientID, FirstName, LastName, Gender, BirthDate, City, AdmissionDate, Diagnosis) "
+                 "VALUES (:id, :first, :last, :gender, :birth, :city, :admitted, :diagnosis)"),
+            [{"id": patient_id, "first": rng.choice(FIRST_NAMES), "last": rng.choice(LAST_NAMES),
+              "gender": rng.choice("FM"), "birth": date(1940, 1, 1) + timedelta(days=rng.randint(0, 365 * 65)),
+              "city": rng.choice(CITIES), "admitted": first_day + timedelta(days=rng.randint(0, 364)),
+              "diagnosis": rng.choice(DIAGNOSES)} for patient_id in range(1, patients + 1)]
+        )
+    engine.dispose()
+    return url
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create a local fixture database")
+    parser.add_argument("url", nargs="?", default="sqlite:///fixture.db")
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--patients", type=int, default=500)
+    args = parser.parse_args()
+    print("Created", create_fixture_database(args.url, products=args.products, orders=args.orders,
+                                             patients=args.patients))
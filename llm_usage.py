@@ -0,0 +1,78 @@
+import time
+import threading
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from conversation_store import count_tokens
+from telemetry import llm_tokens, record_span
+
+
+class LLMUsageHandler(BaseCallbackHandler):
+    """
+    Counts the LLM calls of one run with their prompt tokens and latency, so the
+    effect of prompt changes such as the compact schema context can be measured.
+    LLM calls and agent tool steps are also recorded as telemetry spans.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self._started = {}
+        self._lock = threading.Lock()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        prompt_tokens = sum(count_tokens(prompt) for prompt in prompts)
+        with self._lock:
+            self._started[run_id] = (time.time(), time.perf_counter(), prompt_tokens)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        prompts = [str(message.content) for batch in messages for message in batch]
+        self.on_llm_start(serialized, prompts, run_id=run_id, **kwargs)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self._lock:
+            started = self._started.pop(run_id, None)
+        if started is None:
+            return
+        started_at, started_counter, prompt_tokens = started
+        duration_s = time.perf_counter() - started_counter
+        completion_tokens = sum(count_tokens(generation.text) for generations in response.generations
+                                for generation in generations)
+        with self._lock:
+            self.calls.append({
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "duration_ms": round(duration_s * 1000, 1)
+            })
+        llm_tokens.inc(prompt_tokens, "prompt")
+        llm_tokens.inc(completion_tokens, "completion")
+        record_span("llm", "chat", duration_s, started_at,
+                    prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            self._started.pop(run_id, None)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        with self._lock:
+            self._started[run_id] = (time.time(), time.perf_counter(), serialized.get("name", "tool"))
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        with self._lock:
+            started = self._started.pop(run_id, None)
+        if started is not None:
+            started_at, started_counter, tool_name = started
+            record_span("agent_step", tool_name, time.perf_counter() - started_counter, started_at)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self.on_tool_end(None, run_id=run_id, **kwargs)
+
+    def summary(self):
+        with self._lock:
+            calls = list(self.calls)
+        return {
+            "calls": len(calls),
+            "prompt_tokens": sum(call["prompt_tokens"] for call in calls),
+            "completion_tokens": sum(call["completion_tokens"] for call in calls),
+            "max_prompt_tokens": max((call["prompt_tokens"] for call in calls), default=0),
+            "llm_ms": round(sum(call["duration_ms"] for call in calls), 1)
+        }
@@ -0,0 +1,134 @@
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+import httpx
+
+from fixture_db import create_fixture_database
+
+# Commands that serve the app on a port, for each serving mode
+SERVERS = {
+    "flask": [sys.executable, "-m", "flask", "--app", "app", "run", "--with-threads", "--port", "{port}"],
+    "asgi": [sys.executable, "-m", "hypercorn", "asgi_app:asgi_app", "--bind", "127.0.0.1:{port}"],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_process(command, port, env):
+    return subprocess.Popen([part.format(port=port) for part in command], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+def wait_until_ready(url, timeout=60, method="GET"):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            httpx.request(method, url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout} seconds")
+
+
+async def run_load(base_url, total_requests, concurrency):
+    """
+    Sends total_requests distinct questions with at most concurrency in flight and
+    returns the latency of each successful request and the number of failures.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+
+    async def ask(index):
+        nonlocal failures
+        async with semaphore:
+            # A fresh client per question keeps conversation histories apart
+            async with httpx.AsyncClient(base_url=base_url, timeout=300) as client:
+                started_at = time.perf_counter()
+                try:
+                    # Distinct questions so the answer cache does not serve them
+                    response = await client.post("/ask", json={"message": f"How many products per category? #{index}"})
+                    response.raise_for_status()
+                    latencies.append(time.perf_counter() - started_at)
+                except httpx.HTTPError:
+                    failures += 1
+
+    await asyncio.gather(*(ask(index) for index in range(total_requests)))
+    return latencies, failures
+
+
+def benchmark_server(mode, args, env):
+    port = free_port()
+    server = start_process(SERVERS[mode], port, env)
+    try:
+        wait_until_ready(f"http://127.0.0.1:{port}/")
+        started_at = time.perf_counter()
+        latencies, failures = asyncio.run(run_load(f"http://127.0.0.1:{port}", args.requests, args.concurrency))
+        elapsed = time.perf_counter() - started_at
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies.sort()
+    return {
+        "mode": mode,
+        "requests": args.requests,
+        "failures": failures,
+        "elapsed_s": round(elapsed, 2),
+        "requests_per_s": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(statistics.median(latencies) * 1000, 1) if latencies else None,
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1) if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Flask and ASGI serving modes against a fake LLM and SQLite")
+    parser.add_argument("--mode", choices=["flask", "asgi", "both"], default="both")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds per fake LLM completion")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="loadtest-")
+    database_url = create_fixture_database(f"sqlite:///{os.path.join(work_dir, 'fixture.db')}")
+
+    llm_port = free_port()
+    env = dict(os.environ,
+               FAKE_LLM_LATENCY=str(args.llm_latency),
+               SQL_DATABASE_URL=database_url,
+               AZURE_ENDPOINT=f"http://127.0.0.1:{llm_port}/",
+               OPENAI_API_KEY="fake-key",
+               SCHEMA_CACHE_DIR=os.path.join(work_dir, "schema"),
+               SCHEMA_REFRESH_INTERVAL="0",
+               # Every request goes through the agent, and nothing is written to the repo's .cache
+               ROUTER_ENABLED="false",
+               ROUTER_TEMPLATES_URL="memory://",
+               AGENT_TRACES_ENABLED="false",
+               AGENT_TRACES_URL="memory://",
+               COALESCE_LOCK_DIR=os.path.join(work_dir, "inflight"))
+    llm_server = start_process([sys.executable, "-m", "hypercorn", "fake_llm_server:app", "--bind", "127.0.0.1:{port}"],
+                               llm_port, env)
+    try:
+        wait_until_ready(f"http://127.0.0.1:{llm_port}/openai/deployments/fake/chat/completions", method="OPTIONS")
+        modes = ["flask", "asgi"] if args.mode == "both" else [args.mode]
+        for mode in modes:
+            print(benchmark_server(mode, args, env))
+    finally:
+        llm_server.terminate()
+        llm_server.wait()
+
+
+if __name__ == "__main__":
+    main()
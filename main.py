@@ -1,6 +1,6 @@
 import os
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, MetaData
+from sqlalchemy import create_engine
 from langchain_openai import AzureChatOpenAI
 from langchain.prompts.chat import ChatPromptTemplate
 from langchain_community.agent_toolkits.sql.base import create_sql_agent
@@ -52,10 +52,6 @@ odbc_str = (
 
 db_engine = create_engine(odbc_str)
 
-# Reflect the tables in the database
-metadata = MetaData()
-metadata.reflect(bind=db_engine)
-
 # Get the table names
 # table_names = metadata.tables.keys()
 # print("Tables in the database:")
@@ -73,7 +69,7 @@ llm = AzureChatOpenAI(
 )
 
 # Initialize SQL Database and Toolkit
-db = SQLDatabase(db_engine)
+db = SQLDatabase(db_engine, lazy_table_reflection=True)  # Reflect only the tables the agent asks about
 sql_toolkit = SQLDatabaseToolkit(db=db, llm=llm)
 
 # Define the conversation prompt
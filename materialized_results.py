@@ -0,0 +1,180 @@
+import os
+import re
+import time
+import pickle
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from replica_routing import is_read_only
+
+# Repeated aggregate query results are kept in local columnar files and served from there
+MATERIALIZE_ENABLED = os.getenv('MATERIALIZE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Seconds a materialized result is served before the query runs against the database again
+MATERIALIZE_TTL = int(os.getenv('MATERIALIZE_TTL', '900'))
+# Runs of the same statement within the TTL before its result is materialized
+MATERIALIZE_MIN_RUNS = int(os.getenv('MATERIALIZE_MIN_RUNS', '2'))
+# Larger results are not aggregates worth keeping
+MATERIALIZE_MAX_ROWS = int(os.getenv('MATERIALIZE_MAX_ROWS', '1000'))
+# Most statements whose runs are counted, the oldest are forgotten beyond that
+MATERIALIZE_TRACKED_STATEMENTS = int(os.getenv('MATERIALIZE_TRACKED_STATEMENTS', '2048'))
+
+_aggregate_pattern = re.compile(r'\bGROUP\s+BY\b|\b(COUNT|SUM|AVG|MIN|MAX)\s*\(', re.IGNORECASE)
+# Results that depend on the clock or on randomness are not repeatable
+_volatile_pattern = re.compile(
+    r'\b(GETDATE|GETUTCDATE|SYSDATETIME|SYSUTCDATETIME|SYSDATETIMEOFFSET|CURRENT_TIMESTAMP|CURRENT_DATE|'
+    r'CURRENT_TIME|LOCALTIME|LOCALTIMESTAMP|NOW|RAND|RANDOM|NEWID|NEWSEQUENTIALID|CRYPT_GEN_RANDOM)\b|'
+    r"\bDATE\s*\(\s*'now'", re.IGNORECASE
+)
+_whitespace_pattern = re.compile(r'\s+')
+
+
+def is_materializable(statement):
+    """
+    Returns True for a read-only aggregate query whose result only changes with the data.
+    """
+    return (is_read_only(statement) and _aggregate_pattern.search(statement) is not None
+            and _volatile_pattern.search(statement) is None)
+
+
+def _parquet():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        return None
+    return pyarrow
+
+
+class MaterializedResults:
+    """
+    Local store of the results of aggregate queries that are asked repeatedly, as
+    dashboard-style questions are. A statement's result is written once it has run
+    min_runs times and served from disk until it is ttl seconds old, after which the
+    next run refreshes it. Files are Parquet when pyarrow is installed and pickled
+    column lists otherwise; their names include the schema version, so a schema
+    change never serves an old result.
+    """
+
+    def __init__(self, directory, schema_version, ttl=MATERIALIZE_TTL, min_runs=MATERIALIZE_MIN_RUNS,
+                 max_rows=MATERIALIZE_MAX_ROWS, tracked_statements=MATERIALIZE_TRACKED_STATEMENTS):
+        self.directory = directory
+        self.schema_version = schema_version
+        self.ttl = ttl
+        self.min_runs = min_runs
+        self.max_rows = max_rows
+        self.tracked_statements = tracked_statements
+        self.pyarrow = _parquet()
+        self.extension = ".parquet" if self.pyarrow is not None else ".pickle"
+        self._runs = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _key(self, statement):
+        normalized = _whitespace_pattern.sub(" ", statement.strip().rstrip(";")).lower()
+        return hashlib.sha256(f"{self.schema_version()}\n{normalized}".encode()).hexdigest()[:32]
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.extension)
+
+    def _count_run(self, key):
+        now = time.time()
+        with self._lock:
+            runs = [run for run in self._runs.pop(key, []) if run > now - self.ttl] + [now]
+            self._runs[key] = runs
+            while len(self._runs) > self.tracked_statements:
+                self._runs.popitem(last=False)
+            return len(runs)
+
+    def get(self, statement):
+        """
+        Returns the materialized records of a statement, or None when there is no fresh file.
+        """
+        path = self._path(self._key(statement))
+        try:
+            if os.path.getmtime(path) + self.ttl < time.time():
+                return None
+            return self._read(path)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning("Could not read materialized result %s: %s", path, e)
+            return None
+
+    def run(self, statement, execute):
+        """
+        Returns (records, materialized), reading the stored result when there is a
+        fresh one and otherwise running execute() and storing its result once the
+        statement has been seen often enough.
+        """
+        if not is_materializable(statement):
+            return execute(), False
+        records = self.get(statement)
+        if records is not None:
+            with self._lock:
+                self.hits += 1
+            return records, True
+        with self._lock:
+            self.misses += 1
+        records = execute()
+        key = self._key(statement)
+        if self._count_run(key) >= self.min_runs and 0 < len(records) <= self.max_rows:
+            self._write(self._path(key), records)
+        return records, False
+
+    def _read(self, path):
+        if self.extension == ".parquet":
+            return self.pyarrow.parquet.read_table(path).to_pylist()
+        with open(path, "rb") as result_file:
+            columns, data = pickle.load(result_file)
+        return [dict(zip(columns, row)) for row in zip(*data)]
+
+    def _write(self, path, records):
+        columns = list(records[0].keys())
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            if self.extension == ".parquet":
+                table = self.pyarrow.Table.from_pylist(records)
+                self.pyarrow.parquet.write_table(table, temp_path)
+            else:
+                with open(temp_path, "wb") as result_file:
+                    pickle.dump((columns, [[record[column] for record in records] for column in columns]),
+                                result_file)
+            os.replace(temp_path, path)
+        except Exception as e:
+            # Types the columnar format cannot hold leave the statement to the database
+            logging.warning("Could not materialize result: %s", e)
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            self.writes += 1
+        self.prune()
+
+    def prune(self):
+        """
+        Deletes files older than the TTL.
+        """
+        deadline = time.time() - self.ttl
+        for file_name in os.listdir(self.directory):
+            path = os.path.join(self.directory, file_name)
+            try:
+                if os.path.getmtime(path) < deadline:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "tracked_statements": len(self._runs)
+            }
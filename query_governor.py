@@ -0,0 +1,159 @@
+import os
+import re
+import logging
+import threading
+
+from sqlalchemy import event, text
+
+from schema_catalog import CatalogSQLDatabase
+from sql_trace import current_statement_trace
+
+# Most rows the agent's queries may return, enforced by rewriting and by the fetch
+GOVERNOR_MAX_ROWS = int(os.getenv('GOVERNOR_MAX_ROWS', '5000'))
+# Seconds a statement may run before it is cancelled, 0 disables the timeout
+GOVERNOR_STATEMENT_TIMEOUT = float(os.getenv('GOVERNOR_STATEMENT_TIMEOUT', '30'))
+
+_select_pattern = re.compile(r'^\s*SELECT\s+(DISTINCT\s+)?', re.IGNORECASE)
+_top_pattern = re.compile(r'^\s*SELECT\s+(DISTINCT\s+)?TOP\b', re.IGNORECASE)
+_limit_pattern = re.compile(r'\bLIMIT\s+\d+|\bFETCH\s+(FIRST|NEXT)\b', re.IGNORECASE)
+# Literals, quoted names and comments are skipped, parentheses tracked, to find set operators outside subqueries
+_set_operator_pattern = re.compile(
+    r"'(?:[^']|'')*'|\[[^\]]*\]|\"[^\"]*\"|--[^\n]*|/\*.*?\*/|[()]|\b(?:UNION|EXCEPT|INTERSECT)\b",
+    re.IGNORECASE | re.DOTALL
+)
+
+
+def _has_top_level_set_operator(statement):
+    """
+    Tells whether a statement combines SELECTs with UNION, EXCEPT or INTERSECT
+    outside of parentheses.
+    """
+    depth = 0
+    for match in _set_operator_pattern.finditer(statement):
+        token = match.group()
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+        elif depth == 0 and token[0].isalpha():
+            return True
+    return False
+
+
+def limit_statement(statement, dialect, max_rows=GOVERNOR_MAX_ROWS):
+    """
+    Adds TOP (SQL Server) or LIMIT (other dialects) to a plain SELECT without a row
+    limit. Returns the statement and whether it was rewritten. Statements that cannot
+    be rewritten safely, such as CTEs, are left to the fetch ceiling. On SQL Server
+    that includes UNION, EXCEPT and INTERSECT, where TOP would only limit the first
+    SELECT; LIMIT after a compound SELECT limits all of it.
+    """
+    match = _select_pattern.match(statement)
+    if match is None or _top_pattern.match(statement) or _limit_pattern.search(statement):
+        return statement, False
+    if dialect == "mssql":
+        if re.search(r'\bOFFSET\b', statement, re.IGNORECASE) or _has_top_level_set_operator(statement):
+            return statement, False
+        return f"{statement[:match.end()]}TOP ({max_rows}) {statement[match.end():]}", True
+    return f"{statement.rstrip().rstrip(';')} LIMIT {max_rows}", True
+
+
+def _cancel_statement(cursor, dbapi_connection):
+    # pyodbc cursors support cancel(), sqlite3 connections interrupt()
+    cancel = getattr(cursor, "cancel", None) or getattr(dbapi_connection, "interrupt", None)
+    if cancel is not None:
+        cancel()
+
+
+def install_query_governor(engine):
+    """
+    Cancels statements executed with the governor_timeout execution option once the
+    timeout has passed.
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_timeout(conn, cursor, statement, parameters, context, executemany):
+        timeout = context.execution_options.get("governor_timeout") if context is not None else None
+        if not timeout:
+            return
+        decision = context.execution_options.get("governor_decision")
+        dbapi_connection = conn.connection.dbapi_connection
+
+        def cancel():
+            logging.warning("Cancelling statement after %s seconds: %s", timeout, statement)
+            if decision is not None:
+                decision["timed_out"] = True
+            _cancel_statement(cursor, dbapi_connection)
+
+        timer = threading.Timer(timeout, cancel)
+        timer.daemon = True
+        conn.info["governor_timer"] = timer
+        timer.start()
+
+    def stop_timeout(conn):
+        timer = conn.info.pop("governor_timer", None)
+        if timer is not None:
+            timer.cancel()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        stop_timeout(conn)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        if exception_context.connection is not None:
+            stop_timeout(exception_context.connection)
+
+
+class GovernedSQLDatabase(CatalogSQLDatabase):
+    """
+    SQLDatabase that runs the agent's queries under the governor: row-limit rewriting,
+    a statement timeout and a streaming fetch that stops at the row ceiling. Each
+    decision is recorded in the statement trace of the current request. With a
+    ReplicaRouter, read-only queries run on the replica.
+    """
+
+    def __init__(self, engine, max_rows=GOVERNOR_MAX_ROWS, statement_timeout=GOVERNOR_STATEMENT_TIMEOUT,
+                 replica_router=None, **kwargs):
+        self._max_rows = max_rows
+        self._statement_timeout = statement_timeout
+        self._replica_router = replica_router
+        super().__init__(engine, **kwargs)
+
+    def _execute(self, command, fetch="all", *, parameters=None, execution_options=None):
+        if not isinstance(command, str) or fetch != "all" or self._schema is not None:
+            return super()._execute(command, fetch, parameters=parameters, execution_options=execution_options)
+
+        # One row over the ceiling, so the fetch can tell whether rows were cut off
+        statement, rewritten = limit_statement(command, self.dialect, self._max_rows + 1)
+        decision = {
+            "statement": command,
+            "executed_statement": statement,
+            "rewritten": rewritten,
+            "row_limit": self._max_rows,
+            "timeout_s": self._statement_timeout,
+            "truncated": False,
+            "timed_out": False
+        }
+        trace = current_statement_trace.get()
+        if trace is not None:
+            trace.record_decision(decision)
+
+        options = dict(execution_options or {}, stream_results=True,
+                       governor_timeout=self._statement_timeout, governor_decision=decision)
+
+        def fetch_governed(connection):
+            result = connection.execute(text(statement), parameters or {}, execution_options=options)
+            if not result.returns_rows:
+                return []
+            rows = result.fetchmany(self._max_rows + 1)
+            if len(rows) > self._max_rows:
+                decision["truncated"] = True
+                rows = rows[:self._max_rows]
+            result.close()
+            return [row._asdict() for row in rows]
+
+        if self._replica_router is not None:
+            return self._replica_router.run(statement, fetch_governed)
+        with self._engine.begin() as connection:
+            return fetch_governed(connection)
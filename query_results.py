@@ -0,0 +1,168 @@
+import os
+import pickle
+import tempfile
+import threading
+from contextvars import ContextVar
+
+from query_governor import GovernedSQLDatabase
+from sql_trace import current_statement_trace
+
+RESULT_BUFFER_MAX_ROWS = int(os.getenv('RESULT_BUFFER_MAX_ROWS', '10000'))
+RESULT_BUFFER_SPILL_ROWS = int(os.getenv('RESULT_BUFFER_SPILL_ROWS', '1000'))
+
+# Result buffer of the request currently being served
+current_result_buffer = ContextVar('current_result_buffer', default=None)
+# Results shared by the questions of one batch
+current_query_memo = ContextVar('current_query_memo', default=None)
+
+
+class CapturedResult:
+    """
+    Rows returned by one statement of the agent. Results larger than the spill
+    threshold are pickled to a temporary file instead of being held in memory.
+    """
+
+    def __init__(self, statement, columns, rows, truncated, spill_rows=RESULT_BUFFER_SPILL_ROWS):
+        self.statement = statement
+        self.columns = columns
+        self.row_count = len(rows)
+        self.truncated = truncated
+        self._rows = None
+        self._spill_file = None
+        if len(rows) > spill_rows:
+            self._spill_file = tempfile.TemporaryFile()
+            pickle.dump(rows, self._spill_file)
+        else:
+            self._rows = rows
+
+    def keys(self):
+        return self.columns
+
+    def fetchall(self):
+        if self._spill_file is None:
+            return self._rows
+        self._spill_file.seek(0)
+        return pickle.load(self._spill_file)
+
+    def close(self):
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+
+
+class ResultBuffer:
+    """
+    Holds the rows of the last query the agent ran during a request, capped at
+    max_rows, so the chart path does not have to run the query again. A query that
+    returns no rows replaces the previous result with an empty one.
+    """
+
+    def __init__(self, max_rows=RESULT_BUFFER_MAX_ROWS, spill_rows=RESULT_BUFFER_SPILL_ROWS):
+        self.max_rows = max_rows
+        self.spill_rows = spill_rows
+        self.last_result = None
+
+    def capture(self, statement, records):
+        columns = list(records[0].keys()) if records else []
+        truncated = len(records) > self.max_rows
+        rows = [tuple(record.values()) for record in records[:self.max_rows]]
+        self.close()
+        self.last_result = CapturedResult(statement, columns, rows, truncated, spill_rows=self.spill_rows)
+
+    def close(self):
+        if self.last_result is not None:
+            self.last_result.close()
+
+
+class QueryMemo:
+    """
+    Rows of the statements run while answering a batch of questions, so a statement
+    issued by several agents of the batch runs once. Concurrent callers of the same
+    statement wait for the first one instead of running it again.
+    """
+
+    def __init__(self):
+        self._results = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+
+    def run(self, statement, execute):
+        """
+        Returns (records, shared), running execute() only for the first caller.
+        """
+        with self._lock:
+            entry = self._results.get(statement)
+            owner = entry is None
+            if owner:
+                entry = self._results[statement] = {"done": threading.Event(), "records": None}
+            else:
+                self.hits += 1
+        if not owner:
+            entry["done"].wait()
+            if entry["records"] is not None:
+                return entry["records"], True
+            # The first run failed, so this caller runs the statement itself
+            return execute(), False
+        try:
+            entry["records"] = execute()
+        except Exception:
+            with self._lock:
+                self._results.pop(statement, None)
+            raise
+        finally:
+            entry["done"].set()
+        return entry["records"], False
+
+
+class CapturingSQLDatabase(GovernedSQLDatabase):
+    """
+    SQLDatabase that hands the rows fetched by the agent's sql_db_query tool to
+    the result buffer and statement trace of the current request. Inside a batch,
+    results come from the batch's QueryMemo, and repeated aggregates from the
+    MaterializedResults store when one is given.
+    """
+
+    def __init__(self, engine, materialized_results=None, **kwargs):
+        self._materialized_results = materialized_results
+        super().__init__(engine, **kwargs)
+
+    def _execute(self, command, *args, **kwargs):
+        shareable = self._is_shareable(command, *args, **kwargs)
+        memo = current_query_memo.get()
+        if memo is not None and shareable:
+            records, shared = memo.run(command, lambda: self._execute_shareable(command, *args, **kwargs))
+            trace = current_statement_trace.get()
+            if shared and trace is not None:
+                trace.record(command, 0.0, len(records), shared=True)
+            # Each question gets its own list, the rows themselves are shared read-only
+            records = list(records)
+        elif shareable:
+            records = self._execute_shareable(command, *args, **kwargs)
+        else:
+            records = super()._execute(command, *args, **kwargs)
+        if not isinstance(records, list):
+            # fetch="cursor" hands back the live Result, which is left to the caller
+            return records
+        buffer = current_result_buffer.get()
+        if buffer is not None and isinstance(command, str):
+            buffer.capture(command, records)
+        trace = current_statement_trace.get()
+        if trace is not None and isinstance(command, str):
+            trace.set_last_row_count(len(records))
+        return records
+
+    def _execute_shareable(self, command, *args, **kwargs):
+        if self._materialized_results is None:
+            return super()._execute(command, *args, **kwargs)
+        records, materialized = self._materialized_results.run(
+            command, lambda: super(CapturingSQLDatabase, self)._execute(command, *args, **kwargs))
+        trace = current_statement_trace.get()
+        if materialized and trace is not None:
+            trace.record(command, 0.0, len(records), source="materialized")
+        return records
+
+    @staticmethod
+    def _is_shareable(command, fetch="all", *, parameters=None, execution_options=None):
+        # Only plain reads can be handed to another question of the batch
+        return (isinstance(command, str) and fetch == "all" and not parameters and not execution_options
+                and command.lstrip().upper().startswith(("SELECT", "WITH")))
@@ -0,0 +1,209 @@
+import os
+import re
+import json
+import math
+import time
+import sqlite3
+import threading
+from collections import Counter
+
+from answer_cache import normalize_question
+
+ROUTER_TEMPLATES_URL = os.getenv('ROUTER_TEMPLATES_URL', 'sqlite:///.cache/templates.db')
+# Cosine similarity a question needs with a learned question to skip the agent
+ROUTER_MIN_SIMILARITY = float(os.getenv('ROUTER_MIN_SIMILARITY', '0.85'))
+ROUTER_ENABLED = os.getenv('ROUTER_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+# Words that may differ between a question and its template without changing the SQL
+STOPWORDS = {"a", "an", "the", "me", "show", "list", "give", "what", "are", "is", "of", "please", "can", "you",
+             "tell", "find", "get", "all", "which", "display", "i", "want", "to", "see"}
+
+# Quotes inside words are apostrophes: "aren't" is a negation, not the start of a string
+_parameter_pattern = re.compile(r"(?<!\w)'([^']*)'(?!\w)|\"([^\"]*)\"|\b(\d+(?:\.\d+)?)\b")
+# Words, comparison operators and signs; "> 10" and "< 10" must not share a template
+_token_pattern = re.compile(r"<>|[<>!=]=|[<>=+\-%]|\w+(?:'\w+)?")
+# Tokens of a SQL statement: string literals, quoted identifiers, numbers, words and single symbols
+_sql_token_pattern = re.compile(r"'(?:[^']|'')*'|\[[^\]]*\]|\"[^\"]*\"|\d+(?:\.\d+)?|\w+|\S")
+# Version of the template format; templates stored by an older version are learned again
+_TEMPLATE_VERSION = 2
+
+
+def extract_parameters(question):
+    """
+    Returns the literal values of a question (numbers and quoted strings) in order.
+    """
+    parameters = []
+    for match in _parameter_pattern.finditer(question):
+        single_quoted, double_quoted, number = match.groups()
+        if number is not None:
+            parameters.append(number)
+        else:
+            parameters.append(single_quoted if single_quoted is not None else double_quoted)
+    return parameters
+
+
+def question_tokens(question):
+    """
+    Tokenizes a question with its literal values replaced by placeholders, so "top 5
+    products" and "top 10 products" share a template. Comparison operators, signs
+    and negations are tokens of their own.
+    """
+    text = _parameter_pattern.sub(' param ', question)
+    return _token_pattern.findall(normalize_question(text))
+
+
+def content_tokens(tokens):
+    return set(tokens) - STOPWORDS
+
+
+def _sql_literal(value):
+    if re.fullmatch(r'\d+(?:\.\d+)?', value):
+        return value
+    return "'" + value.replace("'", "''") + "'"
+
+
+def make_template(question, sql):
+    """
+    Turns the SQL of a successful run into a template by replacing each of the
+    question's literal values with a {pN} placeholder. Returns (template, slots), or
+    None when a value is not exactly one whole SQL token, e.g. "top 3" answered with
+    TOP 5, or 2023 found only inside '2023-01-01', since filling such a template
+    would keep the old value.
+    """
+    parameters = extract_parameters(question)
+    if len(set(parameters)) != len(parameters):
+        return None
+    tokens = list(_sql_token_pattern.finditer(sql))
+    positions = {}
+    for index, value in enumerate(parameters):
+        found = [token for token in tokens if token.group() == _sql_literal(value)]
+        if len(found) != 1:
+            return None
+        positions[found[0].start()] = (found[0].end(), index)
+    template, end = [], 0
+    for start in sorted(positions):
+        template.append(sql[end:start].replace('{', '{{').replace('}', '}}'))
+        end, index = positions[start]
+        template.append(f'{{p{index}}}')
+    template.append(sql[end:].replace('{', '{{').replace('}', '}}'))
+    return ''.join(template), len(parameters)
+
+
+def fill_template(template, parameters):
+    return template.format(**{f"p{index}": _sql_literal(value) for index, value in enumerate(parameters)})
+
+
+class TemplateLibrary:
+    """
+    Parameterized SQL learned from successful agent runs, searched by TF-IDF cosine
+    similarity over the content words of questions. Templates are kept in a local
+    SQLite file.
+    """
+
+    def __init__(self, path=None, min_similarity=ROUTER_MIN_SIMILARITY):
+        self.path = path
+        self.min_similarity = min_similarity
+        self._templates = {}
+        self._document_frequency = Counter()
+        self._lock = threading.Lock()
+        if path:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with self._connect() as connection:
+                connection.execute(
+                    'CREATE TABLE IF NOT EXISTS templates (key TEXT PRIMARY KEY, template TEXT)'
+                )
+                for (template,) in connection.execute('SELECT template FROM templates'):
+                    template = json.loads(template)
+                    if template.get("version") != _TEMPLATE_VERSION:
+                        continue
+                    # Templates stored by an older tokenizer are tokenized again
+                    template["tokens"] = question_tokens(template["question"])
+                    self._add(template)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def _add(self, template):
+        previous = self._templates.get(template["key"])
+        if previous is not None:
+            self._document_frequency.subtract(set(previous["tokens"]))
+        self._templates[template["key"]] = template
+        self._document_frequency.update(set(template["tokens"]))
+
+    def _vector(self, tokens):
+        total = len(self._templates) + 1
+        counts = Counter(token for token in tokens if token not in STOPWORDS)
+        return {token: count * math.log(total / (1 + self._document_frequency[token])) + count
+                for token, count in counts.items()}
+
+    @staticmethod
+    def _cosine(left, right):
+        dot = sum(weight * right.get(token, 0.0) for token, weight in left.items())
+        norm = math.sqrt(sum(w * w for w in left.values())) * math.sqrt(sum(w * w for w in right.values()))
+        return dot / norm if norm else 0.0
+
+    def learn(self, question, sql, schema_version):
+        """
+        Stores the SQL of a successful agent run as a template for similar questions
+        and returns it, or returns None when the SQL cannot be parameterized.
+        """
+        if not sql.lstrip().upper().startswith(("SELECT", "WITH")):
+            return None
+        made = make_template(question, sql)
+        if made is None:
+            return None
+        template_sql, slots = made
+        tokens = question_tokens(question)
+        template = {
+            "version": _TEMPLATE_VERSION,
+            "key": " ".join(tokens),
+            "question": question,
+            "tokens": tokens,
+            "sql": template_sql,
+            "slots": slots,
+            "schema_version": schema_version,
+            "learned_at": time.time()
+        }
+        with self._lock:
+            self._add(template)
+        if self.path:
+            with self._connect() as connection:
+                connection.execute('INSERT OR REPLACE INTO templates (key, template) VALUES (?, ?)',
+                                   (template["key"], json.dumps(template)))
+        return template
+
+    def match(self, question, schema_version):
+        """
+        Returns (template, sql) for the most similar learned question above the
+        similarity threshold whose parameters line up with this question, or None.
+        """
+        tokens = question_tokens(question)
+        parameters = extract_parameters(question)
+        with self._lock:
+            query_vector = self._vector(tokens)
+            best_score, best_template = 0.0, None
+            question_content = content_tokens(tokens)
+            for template in self._templates.values():
+                if template["schema_version"] != schema_version or template["slots"] != len(parameters):
+                    continue
+                # A word only one side has may be a filter, operator or negation the other lacks
+                if question_content != content_tokens(template["tokens"]):
+                    continue
+                score = self._cosine(query_vector, self._vector(template["tokens"]))
+                if score > best_score:
+                    best_score, best_template = score, template
+        if best_template is None or best_score < self.min_similarity:
+            return None
+        return dict(best_template, similarity=round(best_score, 3)), fill_template(best_template["sql"], parameters)
+
+    def __len__(self):
+        return len(self._templates)
+
+
+def template_library_from_url(url):
+    """
+    Picks the template storage from a URL: memory:// or sqlite:///path/to/file.db.
+    """
+    if url.startswith('sqlite:///'):
+        return TemplateLibrary(url[len('sqlite:///'):])
+    return TemplateLibrary()
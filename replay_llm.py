@@ -0,0 +1,89 @@
+import os
+import json
+import time
+import threading
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+# Recorded agent transcripts replayed instead of calling Azure OpenAI, for offline benchmarks
+LLM_REPLAY_PATH = os.getenv('LLM_REPLAY_PATH')
+# Seconds each replayed completion waits, standing in for Azure OpenAI latency
+LLM_REPLAY_LATENCY = float(os.getenv('LLM_REPLAY_LATENCY', '0'))
+
+FINAL_ANSWER_MARKER = "Final Answer:"
+UNKNOWN_QUESTION_ANSWER = "Thought: I now know the final answer\nFinal Answer: I could not find that in the database."
+
+_call_count_lock = threading.Lock()
+
+
+def load_transcripts(path):
+    """
+    Reads recorded transcripts, one JSON object per line with the question and the
+    completions the LLM returned for it, in order.
+    """
+    with open(path, encoding="utf-8") as transcript_file:
+        return [json.loads(line) for line in transcript_file if line.strip()]
+
+
+class ReplayChatModel(BaseChatModel):
+    """
+    Chat model that answers from recorded agent transcripts. The transcript is found
+    by the question in the prompt and the step by the number of observations after
+    it, so a run issues the same LLM calls and SQL as the recorded one.
+    """
+
+    transcripts: list
+    latency: float = 0.0
+    streaming: bool = True
+    call_count: int = 0
+
+    @classmethod
+    def from_file(cls, path, latency=LLM_REPLAY_LATENCY):
+        return cls(transcripts=load_transcripts(path), latency=latency)
+
+    @property
+    def _llm_type(self):
+        return "replay"
+
+    def completion_for(self, prompt):
+        matches = [transcript for transcript in self.transcripts if transcript["question"] in prompt]
+        if not matches:
+            return UNKNOWN_QUESTION_ANSWER
+        # Earlier questions can appear in the prompt as hints, the one asked comes last
+        transcript = max(matches, key=lambda candidate: (prompt.rfind(candidate["question"]) + len(candidate["question"]),
+                                                         len(candidate["question"])))
+        completions = transcript["completions"]
+        if "Action Input:" not in prompt:
+            # Not an agent step, such as the summary of a templated query: answer directly
+            final = completions[-1]
+            return final.split(FINAL_ANSWER_MARKER, 1)[-1].strip()
+        step = prompt.rsplit(transcript["question"], 1)[1].count("Observation:")
+        return completions[min(step, len(completions) - 1)]
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        with _call_count_lock:
+            self.call_count += 1
+        content = self.completion_for("\n".join(str(message.content) for message in messages))
+        if self.latency:
+            time.sleep(self.latency)
+        if self.streaming and run_manager is not None:
+            for index, word in enumerate(content.split(" ")):
+                run_manager.on_llm_new_token(word if index == 0 else " " + word)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+
+class TranscriptRecorder(BaseCallbackHandler):
+    """
+    Collects the completions of a live run, to be saved as a transcript for replay.
+    """
+
+    def __init__(self):
+        self.completions = []
+
+    def on_llm_end(self, response, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                self.completions.append(generation.text)
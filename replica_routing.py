@@ -0,0 +1,100 @@
+import os
+import re
+import time
+import logging
+import threading
+
+from sqlalchemy.exc import DBAPIError, TimeoutError as PoolTimeoutError
+
+# Read replica of the default database, e.g. an Azure SQL geo-replica or ApplicationIntent=ReadOnly connection
+SQL_REPLICA_URL = os.getenv('SQL_REPLICA_URL')
+# Seconds reads stay on the primary after the replica failed
+REPLICA_RETRY_AFTER = int(os.getenv('REPLICA_RETRY_AFTER', '30'))
+
+_read_pattern = re.compile(r'^\s*(SELECT|WITH)\b', re.IGNORECASE)
+# Anything that could write, lock or call out of a SELECT keeps the statement on the primary
+_write_pattern = re.compile(
+    r'\b(INSERT|UPDATE|DELETE|MERGE|INTO|EXEC|EXECUTE|CREATE|ALTER|DROP|TRUNCATE|GRANT|REVOKE|FOR\s+UPDATE)\b',
+    re.IGNORECASE
+)
+
+
+def is_read_only(statement):
+    """
+    Returns True for a plain SELECT or WITH ... SELECT that does not write.
+    """
+    return (isinstance(statement, str) and _read_pattern.match(statement) is not None
+            and _write_pattern.search(statement) is None)
+
+
+class ReplicaRouter:
+    """
+    Sends read-only statements to a replica engine and everything else to the
+    primary. When the replica cannot be reached, or drops the connection while a
+    statement runs, the statement is run on the primary and reads stay there for
+    retry_after seconds. Errors in the statement itself are raised as they are.
+    """
+
+    def __init__(self, primary, replica, retry_after=REPLICA_RETRY_AFTER):
+        self.primary = primary
+        self.replica = replica
+        self.retry_after = retry_after
+        self.replica_reads = 0
+        self.primary_reads = 0
+        self.fallbacks = 0
+        self._replica_down_until = 0.0
+        self._lock = threading.Lock()
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _replica_failed(self, error):
+        logging.warning("Read replica unavailable, reading from the primary for %ss: %s", self.retry_after, error)
+        with self._lock:
+            self.fallbacks += 1
+            self._replica_down_until = time.monotonic() + self.retry_after
+
+    @property
+    def replica_available(self):
+        return time.monotonic() >= self._replica_down_until
+
+    def run(self, statement, work):
+        """
+        Calls work(connection) inside a transaction on the engine the statement is
+        routed to and returns its result.
+        """
+        if not is_read_only(statement) or not self.replica_available:
+            return self._run_on_primary(statement, work)
+        try:
+            connection = self.replica.connect()
+        except (DBAPIError, PoolTimeoutError) as e:
+            self._replica_failed(e)
+            return self._run_on_primary(statement, work)
+        try:
+            with connection.begin():
+                result = work(connection)
+        except DBAPIError as e:
+            if not e.connection_invalidated:
+                raise
+            self._replica_failed(e)
+            return self._run_on_primary(statement, work)
+        finally:
+            connection.close()
+        self._count("replica_reads")
+        return result
+
+    def _run_on_primary(self, statement, work):
+        if is_read_only(statement):
+            self._count("primary_reads")
+        with self.primary.begin() as connection:
+            return work(connection)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "replica_reads": self.replica_reads,
+                "primary_reads": self.primary_reads,
+                "fallbacks": self.fallbacks,
+                "replica_available": self.replica_available
+            }
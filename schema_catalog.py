@@ -0,0 +1,209 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+
+from sqlalchemy import inspect, text
+from langchain_community.utilities import SQLDatabase
+
+SCHEMA_CACHE_DIR = os.getenv('SCHEMA_CACHE_DIR', os.path.join('.cache', 'schema'))
+# Seconds between background checks for changed tables, 0 disables the refresh thread
+SCHEMA_REFRESH_INTERVAL = int(os.getenv('SCHEMA_REFRESH_INTERVAL', '300'))
+# Cached sample rows are re-read after this many seconds even if the table did not change
+SCHEMA_CACHE_MAX_AGE = int(os.getenv('SCHEMA_CACHE_MAX_AGE', '86400'))
+
+
+def is_user_table(table_name):
+    return not table_name.lower().startswith("sys")
+
+
+class SchemaCatalog:
+    """
+    Reflects tables on demand and keeps their CREATE TABLE text and sample rows in
+    memory and in an on-disk cache. Each cached table carries a version (its last
+    modification date on SQL Server), so a changed table is re-read while the
+    others are served from the cache.
+    """
+
+    def __init__(self, engine, cache_dir=SCHEMA_CACHE_DIR, max_age=SCHEMA_CACHE_MAX_AGE):
+        self.engine = engine
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self._table_info = {}
+        self._lock = threading.Lock()
+        self._refresh_thread = None
+        self._stop_refresh = threading.Event()
+        engine_id = hashlib.sha256(engine.url.render_as_string(hide_password=True).encode()).hexdigest()[:12]
+        self._engine_cache_dir = os.path.join(cache_dir, engine_id)
+        os.makedirs(self._engine_cache_dir, exist_ok=True)
+        self.versions = self._load_versions()
+        self.fingerprint = self._fingerprint(self.versions)
+
+    def _load_versions(self):
+        """
+        Returns a mapping of table name to a version string, using a single catalog query.
+        """
+        dialect = self.engine.dialect.name
+        with self.engine.connect() as connection:
+            if dialect == "mssql":
+                rows = connection.execute(text(
+                    "SELECT name, CONVERT(varchar(33), modify_date, 126) FROM sys.tables"
+                )).fetchall()
+                return {name: version for name, version in rows if is_user_table(name)}
+            if dialect == "sqlite":
+                rows = connection.execute(text(
+                    "SELECT name, sql FROM sqlite_master WHERE type = 'table'"
+                )).fetchall()
+                return {name: hashlib.sha256((sql or "").encode()).hexdigest()[:16]
+                        for name, sql in rows if is_user_table(name)}
+        # Other dialects have no cheap modification marker, tables only expire by age
+        return {name: "" for name in inspect(self.engine).get_table_names() if is_user_table(name)}
+
+    @staticmethod
+    def _fingerprint(versions):
+        digest = hashlib.sha256(json.dumps(sorted(versions.items())).encode())
+        return digest.hexdigest()[:16]
+
+    def _cache_path(self, table_name):
+        file_name = hashlib.sha256(table_name.encode()).hexdigest()[:24] + ".json"
+        return os.path.join(self._engine_cache_dir, file_name)
+
+    def cache_path(self, file_name):
+        """
+        Returns the path of a file kept in this engine's cache directory.
+        """
+        return os.path.join(self._engine_cache_dir, file_name)
+
+    def table_names(self):
+        return sorted(self.versions)
+
+    def get_table_info(self, table_name, render):
+        """
+        Returns the cached CREATE TABLE text and sample rows of a table, calling
+        render(table_name) to reflect it when there is no fresh cache entry.
+        """
+        version = self.versions.get(table_name)
+        with self._lock:
+            entry = self._table_info.get(table_name)
+        if entry is None:
+            entry = self._read_cache_file(table_name)
+        if entry is None or entry["version"] != version or entry["cached_at"] + self.max_age < time.time():
+            entry = {"version": version, "cached_at": time.time(), "table_info": render(table_name)}
+            self._write_cache_file(table_name, entry)
+        with self._lock:
+            self._table_info[table_name] = entry
+        return entry["table_info"]
+
+    def _read_cache_file(self, table_name):
+        try:
+            with open(self._cache_path(table_name), encoding="utf-8") as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+
+    def _write_cache_file(self, table_name, entry):
+        path = self._cache_path(table_name)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as cache_file:
+                json.dump(entry, cache_file)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logging.warning("Could not write schema cache for %s: %s", table_name, e)
+
+    def refresh(self):
+        """
+        Re-reads table versions and drops cached tables that changed or disappeared.
+        Returns the names of the dropped tables.
+        """
+        versions = self._load_versions()
+        with self._lock:
+            changed = [name for name, entry in self._table_info.items() if versions.get(name) != entry["version"]]
+            for name in changed:
+                del self._table_info[name]
+        self.versions = versions
+        self.fingerprint = self._fingerprint(versions)
+        return changed
+
+    def start_background_refresh(self, interval=SCHEMA_REFRESH_INTERVAL, on_change=None):
+        """
+        Starts a daemon thread that calls refresh() every interval seconds and passes
+        changed table names to on_change.
+        """
+        if interval <= 0 or self._refresh_thread is not None:
+            return
+
+        def refresh_loop():
+            while not self._stop_refresh.wait(interval):
+                try:
+                    changed = self.refresh()
+                    if changed and on_change is not None:
+                        on_change(changed)
+                except Exception as e:
+                    logging.warning("Schema refresh failed: %s", e)
+
+        self._refresh_thread = threading.Thread(target=refresh_loop, name="schema-refresh", daemon=True)
+        self._refresh_thread.start()
+
+    def stop_background_refresh(self):
+        """
+        Stops the refresh thread, used when the database is closed.
+        """
+        self._stop_refresh.set()
+
+
+class CatalogSQLDatabase(SQLDatabase):
+    """
+    SQLDatabase that lists tables and builds table info through a SchemaCatalog
+    instead of reflecting the whole database up front. With a SchemaIndex, table
+    info is returned in its compact form.
+    """
+
+    def __init__(self, engine, schema_catalog=None, schema_index=None, **kwargs):
+        self._schema_catalog = schema_catalog
+        self._schema_index = schema_index
+        self._reflection_lock = threading.Lock()
+        if schema_catalog is not None:
+            kwargs.setdefault("lazy_table_reflection", True)
+        super().__init__(engine, **kwargs)
+
+    def get_usable_table_names(self):
+        if self._schema_catalog is None:
+            return super().get_usable_table_names()
+        if self._include_tables:
+            return sorted(self._include_tables)
+        return sorted(set(self._schema_catalog.table_names()) - self._ignore_tables)
+
+    def get_table_info(self, table_names=None):
+        if self._schema_catalog is None:
+            return super().get_table_info(table_names)
+        all_table_names = self.get_usable_table_names()
+        if table_names is not None:
+            missing_tables = set(table_names).difference(all_table_names)
+            if missing_tables:
+                raise ValueError(f"table_names {missing_tables} not found in database")
+            all_table_names = table_names
+        if self._schema_index is not None and self._schema_index.ready:
+            # Compact one-line-per-table form instead of CREATE TABLE text
+            descriptions = [self._schema_index.describe(name) for name in all_table_names]
+            if all(descriptions):
+                return "\n".join(sorted(descriptions))
+        tables = [self._schema_catalog.get_table_info(name, self._render_table_info) for name in all_table_names]
+        tables.sort()
+        return "\n\n".join(tables)
+
+    def _render_table_info(self, table_name):
+        with self._reflection_lock:
+            return super().get_table_info([table_name])
+
+    def forget_tables(self, table_names):
+        """
+        Drops reflected tables so they are reflected again on next use.
+        """
+        with self._reflection_lock:
+            for table_name in table_names:
+                table = self._metadata.tables.get(table_name)
+                if table is not None:
+                    self._metadata.remove(table)
@@ -0,0 +1,331 @@
+import os
+import re
+import sys
+import json
+import math
+import logging
+import threading
+from collections import Counter
+
+from sqlalchemy import inspect, select, table, column
+
+from answer_cache import normalize_question
+
+SCHEMA_CONTEXT_ENABLED = os.getenv('SCHEMA_CONTEXT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Most tables put in the prompt for one question, FK neighbours included
+SCHEMA_CONTEXT_MAX_TABLES = int(os.getenv('SCHEMA_CONTEXT_MAX_TABLES', '5'))
+# Wider tables are cut down to their keys and the columns the question mentions
+SCHEMA_CONTEXT_MAX_COLUMNS = int(os.getenv('SCHEMA_CONTEXT_MAX_COLUMNS', '12'))
+SCHEMA_CONTEXT_SAMPLE_ROWS = int(os.getenv('SCHEMA_CONTEXT_SAMPLE_ROWS', '2'))
+# Sample values are cut to this many characters
+SCHEMA_CONTEXT_MAX_VALUE_LENGTH = int(os.getenv('SCHEMA_CONTEXT_MAX_VALUE_LENGTH', '30'))
+
+# Weight of a question word found in a table name, a column name or a comment / FK target
+NAME_WEIGHT, COLUMN_WEIGHT, COMMENT_WEIGHT = 3.0, 1.0, 0.5
+# Tables scoring below this share of the best table are left out
+MIN_RELATIVE_SCORE = 0.25
+
+_identifier_word_pattern = re.compile(r'[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+')
+_question_word_pattern = re.compile(r'[^\W_]+')
+
+
+def _stem(word):
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def identifier_words(identifier):
+    """
+    Splits a table or column name into stemmed lower-case words: OrderDate and
+    order_dates both give ["order", "date"].
+    """
+    return [_stem(word.lower()) for word in _identifier_word_pattern.findall(identifier or "")]
+
+
+def question_words(question):
+    return {_stem(word) for word in _question_word_pattern.findall(normalize_question(question))}
+
+
+def _type_name(column_type):
+    try:
+        return str(column_type)
+    except Exception:
+        return "?"
+
+
+def _sample_value(value):
+    if value is None:
+        return "NULL"
+    if isinstance(value, (int, float)):
+        return str(value)
+    value = str(value)
+    if len(value) > SCHEMA_CONTEXT_MAX_VALUE_LENGTH:
+        value = value[:SCHEMA_CONTEXT_MAX_VALUE_LENGTH] + "..."
+    return "'" + value.replace("'", "''") + "'"
+
+
+class SchemaIndex:
+    """
+    Local index over table names, column names, comments and foreign keys, used to
+    put only the tables and columns relevant to a question into the agent prompt, in
+    a compact one-line-per-table form with a few cached sample rows. Entries carry
+    the table version from the SchemaCatalog and are kept on disk next to it.
+    """
+
+    def __init__(self, engine, schema_catalog, max_tables=SCHEMA_CONTEXT_MAX_TABLES,
+                 max_columns=SCHEMA_CONTEXT_MAX_COLUMNS, sample_rows=SCHEMA_CONTEXT_SAMPLE_ROWS):
+        self.engine = engine
+        self.schema_catalog = schema_catalog
+        self.max_tables = max_tables
+        self.max_columns = max_columns
+        self.sample_rows = sample_rows
+        self.path = schema_catalog.cache_path("schema_index.json")
+        self._tables = {}
+        self._document_frequency = Counter()
+        self._fingerprint = None
+        self._lock = threading.Lock()
+        self._sample_lock = threading.Lock()
+        self._warm_thread = None
+
+    @property
+    def ready(self):
+        return self._fingerprint is not None
+
+    def _read_index_file(self):
+        try:
+            with open(self.path, encoding="utf-8") as index_file:
+                return json.load(index_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_index_file(self):
+        temp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as index_file:
+                json.dump(self._tables, index_file)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logging.warning("Could not write schema index: %s", e)
+
+    def _describe_table(self, inspector, table_name, version):
+        primary_key = set(inspector.get_pk_constraint(table_name).get("constrained_columns") or [])
+        references = {}
+        referenced_tables = []
+        for foreign_key in inspector.get_foreign_keys(table_name):
+            referred_table = foreign_key["referred_table"]
+            referenced_tables.append(referred_table)
+            for local, remote in zip(foreign_key["constrained_columns"], foreign_key["referred_columns"]):
+                references[local] = f"{referred_table}.{remote}"
+        try:
+            comment = inspector.get_table_comment(table_name).get("text") or ""
+        except NotImplementedError:
+            comment = ""
+        columns = [{
+            "name": column_info["name"],
+            "type": _type_name(column_info["type"]),
+            "primary_key": column_info["name"] in primary_key,
+            "references": references.get(column_info["name"]),
+            "comment": column_info.get("comment") or "",
+            "words": identifier_words(column_info["name"]) + identifier_words(column_info.get("comment") or "")
+        } for column_info in inspector.get_columns(table_name)]
+        return {
+            "version": version,
+            "name": table_name,
+            "comment": comment,
+            "name_words": identifier_words(table_name),
+            "column_words": sorted({word for column_info in columns for word in column_info["words"]}),
+            "comment_words": sorted(set(identifier_words(comment)).union(
+                *(identifier_words(name) for name in referenced_tables))),
+            "references": sorted(set(referenced_tables)),
+            "columns": columns,
+            "samples": None
+        }
+
+    def build(self):
+        """
+        Brings the index up to date with the catalog, re-inspecting only tables whose
+        version changed since the index was written.
+        """
+        versions = dict(self.schema_catalog.versions)
+        fingerprint = self.schema_catalog.fingerprint
+        with self._lock:
+            tables = dict(self._tables) or self._read_index_file()
+        stale = [name for name, version in versions.items()
+                 if name not in tables or tables[name]["version"] != version]
+        if stale:
+            inspector = inspect(self.engine)
+            for table_name in stale:
+                try:
+                    tables[table_name] = self._describe_table(inspector, table_name, versions[table_name])
+                except Exception as e:
+                    logging.warning("Could not index table %s: %s", table_name, e)
+        tables = {name: entry for name, entry in tables.items() if name in versions}
+
+        document_frequency = Counter()
+        for entry in tables.values():
+            document_frequency.update(set(entry["name_words"] + entry["column_words"] + entry["comment_words"]))
+        with self._lock:
+            self._tables = tables
+            self._document_frequency = document_frequency
+            self._fingerprint = fingerprint
+            if stale:
+                self._write_index_file()
+
+    def start_background_build(self):
+        """
+        Builds the index in a daemon thread; questions asked before it is ready get
+        no schema context and the agent looks the tables up itself.
+        """
+        if self._warm_thread is not None:
+            return
+
+        def build_index():
+            try:
+                self.build()
+            except Exception as e:
+                logging.warning("Schema index build failed: %s", e)
+
+        self._warm_thread = threading.Thread(target=build_index, name="schema-index", daemon=True)
+        self._warm_thread.start()
+
+    def wait(self, timeout=None):
+        """
+        Waits for the background build and returns whether the index is ready.
+        """
+        if self._warm_thread is not None:
+            self._warm_thread.join(timeout)
+        return self.ready
+
+    def rank(self, question):
+        """
+        Returns the names of the tables most relevant to a question, best first,
+        followed by the tables they reference while there is room.
+        """
+        words = question_words(question)
+        with self._lock:
+            table_count = len(self._tables)
+            scores = []
+            for name, entry in self._tables.items():
+                score = 0.0
+                for word in words:
+                    if word not in self._document_frequency:
+                        continue
+                    idf = math.log(1 + table_count / self._document_frequency[word])
+                    if word in entry["name_words"]:
+                        score += NAME_WEIGHT * idf
+                    elif word in entry["column_words"]:
+                        score += COLUMN_WEIGHT * idf
+                    elif word in entry["comment_words"]:
+                        score += COMMENT_WEIGHT * idf
+                if score > 0:
+                    scores.append((score, name))
+            scores.sort(key=lambda item: (-item[0], item[1]))
+            selected = [name for score, name in scores[:self.max_tables]
+                        if score >= scores[0][0] * MIN_RELATIVE_SCORE]
+            for name in list(selected):
+                for referenced in self._tables[name]["references"]:
+                    if len(selected) >= self.max_tables:
+                        break
+                    if referenced in self._tables and referenced not in selected:
+                        selected.append(referenced)
+        return selected
+
+    def _load_samples(self, entry):
+        if entry["samples"] is not None or self.sample_rows <= 0:
+            return entry["samples"] or []
+        statement = select(*[column(c["name"]) for c in entry["columns"]]).select_from(
+            table(entry["name"])).limit(self.sample_rows)
+        try:
+            with self.engine.connect() as connection:
+                rows = connection.execute(statement).fetchall()
+            samples = [[_sample_value(value) for value in row] for row in rows]
+        except Exception as e:
+            logging.warning("Could not read sample rows of %s: %s", entry["name"], e)
+            samples = []
+        with self._sample_lock:
+            entry["samples"] = samples
+            with self._lock:
+                self._write_index_file()
+        return samples
+
+    def _pick_columns(self, entry, words):
+        columns = list(enumerate(entry["columns"]))
+        if len(columns) <= self.max_columns:
+            return columns
+        keys = [item for item in columns if item[1]["primary_key"] or item[1]["references"]]
+        mentioned = [item for item in columns if item not in keys and words.intersection(item[1]["words"])]
+        rest = [item for item in columns if item not in keys and item not in mentioned]
+        return sorted((keys + mentioned + rest)[:max(self.max_columns, len(keys))])
+
+    def describe(self, table_name, question=None):
+        """
+        Renders one table as Name(column TYPE PK, column TYPE -> Other.column, ...)
+        with its sample rows. With a question, wide tables keep their keys and the
+        columns the question mentions.
+        """
+        with self._lock:
+            entry = self._tables.get(table_name)
+        if entry is None:
+            return None
+        if question is None:
+            picked = list(enumerate(entry["columns"]))
+        else:
+            picked = self._pick_columns(entry, question_words(question))
+        parts = []
+        for _, column_info in picked:
+            part = f"{column_info['name']} {column_info['type']}"
+            if column_info["primary_key"]:
+                part += " PK"
+            if column_info["references"]:
+                part += f" -> {column_info['references']}"
+            parts.append(part)
+        hidden = len(entry["columns"]) - len(picked)
+        if hidden:
+            parts.append(f"... +{hidden} more columns")
+        lines = [f"{table_name}({', '.join(parts)})"]
+        if entry["comment"]:
+            lines[0] += f" -- {entry['comment']}"
+        samples = self._load_samples(entry)
+        if samples:
+            lines.append("  rows: " + "; ".join(
+                "(" + ", ".join(row[index] for index, _ in picked) + ")" for row in samples))
+        return "\n".join(lines)
+
+    def context_for(self, question):
+        """
+        Returns the compact schema of the tables relevant to a question, or None when
+        the index is not built yet or no table matches.
+        """
+        if self._fingerprint is None:
+            return None
+        if self._fingerprint != self.schema_catalog.fingerprint:
+            self.build()
+        descriptions = [self.describe(name, question) for name in self.rank(question)]
+        descriptions = [description for description in descriptions if description]
+        return "\n".join(descriptions) or None
+
+
+if __name__ == "__main__":
+    # Compares the compact context with the CREATE TABLE text the schema tool returns:
+    # python schema_context.py "How many orders per category?" [...]
+    from sqlalchemy import create_engine
+    from conversation_store import count_tokens
+    from schema_catalog import SchemaCatalog, CatalogSQLDatabase
+
+    engine = create_engine(os.environ["SQL_DATABASE_URL"])
+    catalog = SchemaCatalog(engine)
+    index = SchemaIndex(engine, catalog)
+    index.build()
+    full_db = CatalogSQLDatabase(engine, schema_catalog=catalog)
+    for question in sys.argv[1:] or ["How many products are in each category?"]:
+        tables = index.rank(question)
+        context = index.context_for(question) or ""
+        full_info = full_db.get_table_info(tables) if tables else ""
+        all_info = full_db.get_table_info()
+        print(f"{question}\n  tables: {', '.join(tables) or '-'}\n"
+              f"  compact context: {count_tokens(context)} tokens, "
+              f"CREATE TABLE for the same tables: {count_tokens(full_info)} tokens, "
+              f"all tables: {count_tokens(all_info)} tokens")
@@ -0,0 +1,289 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: requests are only coalesced within a process
+    fcntl = None
+
+# Concurrent requests for the same question wait for the one already answering it
+COALESCE_ENABLED = os.getenv('COALESCE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Directory of lock and result files shared by the workers of one host, empty coalesces within a process only
+COALESCE_LOCK_DIR = os.getenv('COALESCE_LOCK_DIR', os.path.join('.cache', 'inflight'))
+# Seconds a request waits for another one before answering the question itself
+COALESCE_WAIT_TIMEOUT = float(os.getenv('COALESCE_WAIT_TIMEOUT', '120'))
+# Seconds result files are kept for workers that were waiting on them
+COALESCE_RESULT_TTL = int(os.getenv('COALESCE_RESULT_TTL', '60'))
+
+_POLL_INTERVAL = 0.05
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.succeeded = False
+        self.result = None
+        # (event loop, future) of async callers waiting for this call
+        self.waiters = []
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class SingleFlight:
+    """
+    Runs one computation per key at a time. Callers that arrive while a thread of
+    this process computes the key wait for its result. Across worker processes the
+    computing thread holds an flock on a per-key lock file and writes its result
+    next to it, so a worker that had to wait for the lock reads that result instead
+    of computing it again. When the computation fails or a waiter times out, the
+    waiter computes the result itself.
+    """
+
+    def __init__(self, lock_dir=COALESCE_LOCK_DIR, wait_timeout=COALESCE_WAIT_TIMEOUT,
+                 result_ttl=COALESCE_RESULT_TTL):
+        self.lock_dir = lock_dir if lock_dir and fcntl is not None else None
+        self.wait_timeout = wait_timeout
+        self.result_ttl = result_ttl
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+        self.process_followers = 0
+        if lock_dir and fcntl is None:
+            logging.info("fcntl is not available, requests are coalesced within each process only")
+        if self.lock_dir:
+            os.makedirs(self.lock_dir, exist_ok=True)
+
+    def _join(self, key, loop=None):
+        """
+        Returns (call, leader, waiter), where waiter is a future of the given event
+        loop that is done when a call this caller follows finishes.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                return call, True, None
+            self.followers += 1
+            waiter = None
+            if loop is not None:
+                waiter = loop.create_future()
+                call.waiters.append((loop, waiter))
+            return call, False, waiter
+
+    def _leave(self, key, call):
+        with self._lock:
+            self._calls.pop(key, None)
+        call.done.set()
+        # No caller can join the call once it is removed, so the waiters are final
+        for loop, waiter in call.waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, waiter)
+            except RuntimeError:  # the loop of the waiter was closed
+                pass
+
+    def run(self, key, compute):
+        """
+        Returns (result, coalesced), where coalesced tells whether the result was
+        computed by another request.
+        """
+        call, leader, _ = self._join(key)
+        if not leader:
+            if call.done.wait(self.wait_timeout) and call.succeeded:
+                return call.result, True
+            return compute(), False
+        try:
+            handle, shared = self._acquire(key)
+            if shared is not None:
+                call.result, call.succeeded = shared, True
+                return shared, True
+            try:
+                call.result = compute()
+                self._publish(key, handle, call.result)
+            finally:
+                self._release(handle)
+            call.succeeded = True
+            return call.result, False
+        finally:
+            self._leave(key, call)
+
+    async def run_async(self, key, compute):
+        """
+        Async variant of run() for a coroutine function. Waiting for another call or
+        for the lock of another worker sleeps on the event loop rather than holding
+        a thread, so waiters never take the threads the computation itself needs.
+        """
+        call, leader, waiter = self._join(key, asyncio.get_running_loop())
+        if not leader:
+            try:
+                await asyncio.wait_for(waiter, self.wait_timeout)
+            except asyncio.TimeoutError:
+                pass
+            if call.done.is_set() and call.succeeded:
+                return call.result, True
+            return await compute(), False
+        try:
+            handle, shared = await self._acquire_async(key)
+            if shared is not None:
+                call.result, call.succeeded = shared, True
+                return shared, True
+            try:
+                call.result = await compute()
+                await asyncio.to_thread(self._publish, key, handle, call.result)
+            finally:
+                self._release(handle)
+            call.succeeded = True
+            return call.result, False
+        finally:
+            self._leave(key, call)
+
+    def _path(self, key, extension):
+        return os.path.join(self.lock_dir, hashlib.sha256(key.encode()).hexdigest()[:32] + extension)
+
+    def _acquire(self, key):
+        """
+        Takes the cross-process lock of a key. Returns (lock file, None), or (None,
+        result) when another worker computed the result while this one waited.
+        """
+        if self.lock_dir is None:
+            return None, None
+        path = self._path(key, ".lock")
+        handle = open(path, "a+")
+        waiting_since = time.time()
+        deadline = time.monotonic() + self.wait_timeout
+        waited = False
+        while True:
+            handle, locked = self._try_lock(path, handle)
+            if locked:
+                break
+            if time.monotonic() >= deadline:
+                handle.close()
+                return None, None
+            waited = True
+            time.sleep(_POLL_INTERVAL)
+        return self._locked(key, handle, waited, waiting_since)
+
+    async def _acquire_async(self, key):
+        """
+        _acquire() that polls the lock from the event loop.
+        """
+        if self.lock_dir is None:
+            return None, None
+        path = self._path(key, ".lock")
+        handle = open(path, "a+")
+        waiting_since = time.time()
+        deadline = time.monotonic() + self.wait_timeout
+        waited = False
+        while True:
+            handle, locked = self._try_lock(path, handle)
+            if locked:
+                break
+            if time.monotonic() >= deadline:
+                handle.close()
+                return None, None
+            waited = True
+            await asyncio.sleep(_POLL_INTERVAL)
+        return self._locked(key, handle, waited, waiting_since)
+
+    @staticmethod
+    def _try_lock(path, handle):
+        """
+        Takes the lock of an open lock file without waiting and returns (handle,
+        locked). A file pruned between opening and locking is opened again, so the
+        lock taken is always the one at the path. Taking a lock touches the file,
+        which keeps lock files of questions still asked from being pruned.
+        """
+        while True:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return handle, False
+            if os.fstat(handle.fileno()).st_nlink:
+                os.utime(handle.fileno())
+                return handle, True
+            handle.close()
+            handle = open(path, "a+")
+
+    def _locked(self, key, handle, waited, waiting_since):
+        if waited:
+            shared = self._read_result(key, waiting_since)
+            if shared is not None:
+                self._release(handle)
+                with self._lock:
+                    self.process_followers += 1
+                return None, shared
+        return handle, None
+
+    @staticmethod
+    def _release(handle):
+        if handle is not None:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+            handle.close()
+
+    def _read_result(self, key, finished_after):
+        try:
+            with open(self._path(key, ".json"), encoding="utf-8") as result_file:
+                entry = json.load(result_file)
+        except (OSError, ValueError):
+            return None
+        if entry["finished_at"] < finished_after:
+            return None
+        # JSON turns tuples into lists
+        return tuple(entry["result"]) if isinstance(entry["result"], list) else entry["result"]
+
+    def _publish(self, key, handle, result):
+        if handle is None:
+            return
+        path = self._path(key, ".json")
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as result_file:
+                json.dump({"finished_at": time.time(), "result": result}, result_file, default=str)
+            os.replace(temp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logging.warning("Could not share the result with other workers: %s", e)
+        self._prune()
+
+    def _prune(self):
+        """
+        Removes result files older than the result TTL, and lock files not taken for
+        that long. A lock file is only removed while this worker holds its lock, so
+        a file another worker holds or waits on is never removed.
+        """
+        deadline = time.time() - self.result_ttl
+        for file_name in os.listdir(self.lock_dir):
+            path = os.path.join(self.lock_dir, file_name)
+            try:
+                if os.path.getmtime(path) >= deadline:
+                    continue
+                if not file_name.endswith(".lock"):
+                    os.remove(path)
+                    continue
+                with open(path) as handle:
+                    try:
+                        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue
+                    # Taken again since it was listed
+                    if os.path.getmtime(path) < deadline:
+                        os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "leaders": self.leaders,
+                "followers": self.followers,
+                "process_followers": self.process_followers,
+                "in_flight": len(self._calls)
+            }
@@ -0,0 +1,89 @@
+import time
+import logging
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+from telemetry import record_span
+
+# Statement trace of the request currently being served
+current_statement_trace = ContextVar('current_statement_trace', default=None)
+
+
+class StatementTrace:
+    """
+    Records every SQL statement issued while serving one request, with its
+    duration and row count. The row count of a SELECT is only known once its rows
+    are fetched, so it is left out unless the fetching code fills it in.
+    """
+
+    def __init__(self):
+        self.statements = []
+        # Query governor decisions for the agent's queries
+        self.governor_decisions = []
+
+    def record(self, statement, duration_ms, row_count=None, error=None, shared=False, source=None):
+        entry = {
+            "statement": statement,
+            "duration_ms": round(duration_ms, 2)
+        }
+        if row_count is not None:
+            entry["row_count"] = row_count
+        if error is not None:
+            entry["error"] = error
+        if shared:
+            # Rows reused from another question of the same batch
+            entry["shared"] = True
+        if source is not None:
+            # Rows served without a database round trip, such as a materialized result
+            entry["source"] = source
+        self.statements.append(entry)
+
+    def set_last_row_count(self, row_count):
+        # Drivers report -1 or nothing useful for SELECTs, so the fetched row count is filled in afterwards
+        if self.statements:
+            self.statements[-1]["row_count"] = row_count
+
+    def record_decision(self, decision):
+        self.governor_decisions.append(decision)
+
+    @property
+    def last_statement(self):
+        return self.statements[-1]["statement"] if self.statements else ""
+
+    def to_list(self):
+        return list(self.statements)
+
+
+def install_statement_trace(engine):
+    """
+    Registers cursor listeners on the engine that feed the request's statement trace
+    and the SQL span metrics.
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("statement_start_times", []).append(time.perf_counter())
+        logging.debug("Generated SQL Statement: %s", statement)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started_at = conn.info["statement_start_times"].pop()
+        duration_s = time.perf_counter() - started_at
+        record_span("sql", statement.split(None, 1)[0].upper() if statement.strip() else "statement", duration_s)
+        trace = current_statement_trace.get()
+        if trace is not None:
+            # rowcount only counts rows for INSERT, UPDATE and DELETE
+            row_count = cursor.rowcount if cursor.description is None and cursor.rowcount >= 0 else None
+            trace.record(statement, duration_s * 1000, row_count)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        connection = exception_context.connection
+        if connection is None or not connection.info.get("statement_start_times"):
+            return
+        started_at = connection.info["statement_start_times"].pop()
+        trace = current_statement_trace.get()
+        if trace is not None and exception_context.statement:
+            trace.record(exception_context.statement, (time.perf_counter() - started_at) * 1000,
+                         error=str(exception_context.original_exception))
@@ -2,6 +2,19 @@ $(document).ready(function() {
     const chatWindow = $('#chatWindow');
     const inputField = $('#inputMessage');
     const sendButton = $('#sendButton');
+    // Ask for chart data instead of a PNG when Chart.js is available to draw it
+    const chartFormat = window.Chart ? 'spec' : 'png';
+    const databaseSelect = $('#databaseSelect');
+
+    // Offer a choice of database when the server has more than one
+    $.getJSON('/databases', function(response) {
+        if (response.databases.length < 2) return;
+        response.databases.forEach(function(database) {
+            const option = $('<option>').val(database.name).text(database.name);
+            databaseSelect.append(option.prop('selected', database['default']));
+        });
+        databaseSelect.show();
+    });
 
     // Trigger sendMessage when the send button is clicked
     sendButton.click(sendMessage);
@@ -25,90 +38,230 @@ $(document).ready(function() {
         // Clear the input field
         inputField.val('');
 
+        // Stream the answer when the browser can read a response body incrementally
+        if (window.fetch && window.ReadableStream && window.TextDecoder) {
+            streamMessage(inputMessage);
+            return;
+        }
+
         // Send the request to the Flask backend
         $.ajax({
             url: '/ask',
             method: 'POST',
             contentType: 'application/json',
-            data: JSON.stringify({ message: inputMessage }),
+            data: JSON.stringify({ message: inputMessage, chart_format: chartFormat, database: databaseSelect.val() || undefined }),
 
-            beforeSend: function() {
-                // Show a typing indicator
-                const typingIndicator = `
-                    <div id="typing-indicator" class="message system">
-                        <img src="https://media.tenor.com/6DR9HRfOFu8AAAAM/typing-loading.gif" alt="AI is typing..." style="width: 100px; height: auto;" />
-                    </div>
-                `;
-                chatWindow.append(typingIndicator);
-                chatWindow.scrollTop(chatWindow[0].scrollHeight);
-            },
+            beforeSend: showTypingIndicator,
 
             success: function(data) {
                 // Remove the typing indicator
                 console.log(data)
-                $('#typing-indicator').fadeOut(100, function() {
-                    $(this).remove();
-                });
-                
-
-                // Display the summary message from the AI response
-                if (data.summary) {
-                    function checkIfEmpty (){
-                        if(data.chart_image ===""){
-                            return '';
-                        }else{
-                            return  `<img class="img-fluid" src="data:image/png;base64,${data.chart_image}"></img>`
-                        }
-                    }
-                    const summaryMessage = `
-                        <div class="message system">
-                            <p> ${data.summary}
-                           
-                            ${checkIfEmpty ()}
-                            
-                            </p>
-                            <small>AI-generated summary</small>
-                        </div>
-                    `;
-                    chatWindow.append(summaryMessage);
-                }
-
-                // Check if the response contains a list of results
-                if (Array.isArray(data.response) && data.response.length > 0) {
-                    // Display each result in a formatted manner
-                    data.response.forEach(record => {
-                        const recordMessage = `
-                            <div class="message system">
-
-                                <p>${formatRecord(record)}</p>
-                                <small>AI-generated database result</small>
-                            </div>
-                        `;
-                        chatWindow.append(recordMessage);
-                    });
-                }
-
-                chatWindow.scrollTop(chatWindow[0].scrollHeight);
+                removeTypingIndicator();
+                renderAnswer(data);
             },
 
             error: function(err) {
                 // Remove the typing indicator in case of an error
-                $('#typing-indicator').fadeOut(100, function() {
-                    $(this).remove();
+                removeTypingIndicator();
+                console.error("Error: ", err);
+                renderError();
+            }
+        });
+    }
+
+    // Send the question to the streaming endpoint and render each event as it arrives
+    function streamMessage(inputMessage) {
+        showTypingIndicator();
+        const progressMessage = $(`
+            <div class="message system">
+                <ul class="agent-steps"></ul>
+                <p class="streamed-answer"></p>
+                <small>AI is working on your question...</small>
+            </div>
+        `);
+        let finished = false;
+        let streamedText = '';
+        let streamedHtml = '';
+
+        fetch('/ask/stream', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ message: inputMessage, chart_format: chartFormat, database: databaseSelect.val() || undefined })
+        }).then(function(response) {
+            if (!response.ok) {
+                throw new Error(`Request failed with status ${response.status}`);
+            }
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+
+            function read() {
+                return reader.read().then(function(result) {
+                    if (result.done) {
+                        return;
+                    }
+                    buffer += decoder.decode(result.value, { stream: true });
+                    // Events are separated by a blank line
+                    let boundary = buffer.indexOf('\n\n');
+                    while (boundary !== -1) {
+                        handleEvent(buffer.slice(0, boundary));
+                        buffer = buffer.slice(boundary + 2);
+                        boundary = buffer.indexOf('\n\n');
+                    }
+                    return read();
                 });
+            }
+            return read();
+        }).then(function() {
+            if (!finished) {
+                throw new Error('Stream ended before the answer was complete');
+            }
+        }).catch(function(err) {
+            console.error("Error: ", err);
+            removeTypingIndicator();
+            progressMessage.remove();
+            if (!finished) {
+                renderError();
+            }
+        });
 
-                console.error("Error: ", err);
-                const errorMessage = `
+        function handleEvent(rawEvent) {
+            let eventName = 'message';
+            let data = '';
+            rawEvent.split('\n').forEach(line => {
+                if (line.startsWith('event: ')) {
+                    eventName = line.slice(7);
+                } else if (line.startsWith('data: ')) {
+                    data += line.slice(6);
+                }
+            });
+            const payload = data ? JSON.parse(data) : {};
+
+            // Show progress in place of the typing indicator once the agent starts working
+            if (!progressMessage.parent().length) {
+                removeTypingIndicator();
+                chatWindow.append(progressMessage);
+            }
+
+            if (eventName === 'step') {
+                progressMessage.find('.agent-steps').append($('<li>').text(`Using ${payload.tool}`));
+            } else if (eventName === 'sql') {
+                progressMessage.find('.agent-steps').append($('<li>').append($('<code>').text(payload.statement)));
+            } else if (eventName === 'rows') {
+                progressMessage.find('.agent-steps').append($('<li>').text(`${payload.row_count} rows returned`));
+            } else if (eventName === 'token') {
+                // Completed lines arrive rendered, the line still being written is shown as text
+                streamedText += payload.text;
+                streamedHtml += payload.html || '';
+                const currentLine = payload.complete ? '' : streamedText.slice(streamedText.lastIndexOf('\n') + 1);
+                progressMessage.find('.streamed-answer').html(streamedHtml).append(document.createTextNode(currentLine));
+            } else if (eventName === 'final') {
+                finished = true;
+                progressMessage.remove();
+                renderAnswer(payload);
+            } else if (eventName === 'error') {
+                finished = true;
+                progressMessage.remove();
+                renderError();
+            }
+            chatWindow.scrollTop(chatWindow[0].scrollHeight);
+        }
+    }
+
+    function showTypingIndicator() {
+        // Show a typing indicator
+        const typingIndicator = `
+            <div id="typing-indicator" class="message system">
+                <img src="https://media.tenor.com/6DR9HRfOFu8AAAAM/typing-loading.gif" alt="AI is typing..." style="width: 100px; height: auto;" />
+            </div>
+        `;
+        chatWindow.append(typingIndicator);
+        chatWindow.scrollTop(chatWindow[0].scrollHeight);
+    }
+
+    function removeTypingIndicator() {
+        $('#typing-indicator').fadeOut(100, function() {
+            $(this).remove();
+        });
+    }
+
+    function renderAnswer(data) {
+        // Display the summary message from the AI response
+        if (data.summary) {
+            function checkIfEmpty (){
+                if(data.chart_spec){
+                    return '<canvas class="chart-canvas"></canvas>';
+                }else if(data.chart_image ===""){
+                    return '';
+                }else{
+                    return  `<img class="img-fluid" src="data:image/png;base64,${data.chart_image}"></img>`
+                }
+            }
+            const summaryMessage = `
+                <div class="message system">
+                    <p> ${data.summary}
+                   
+                    ${checkIfEmpty ()}
+                    
+                    </p>
+                    <small>AI-generated summary</small>
+                </div>
+            `;
+            chatWindow.append(summaryMessage);
+            if (data.chart_spec) {
+                drawChart(chatWindow.find('.chart-canvas').last()[0], data.chart_spec);
+            }
+        }
+
+        // Check if the response contains a list of results
+        if (Array.isArray(data.response) && data.response.length > 0) {
+            // Display each result in a formatted manner
+            data.response.forEach(record => {
+                const recordMessage = `
                     <div class="message system">
-                        <p>There was an error processing your request. Please try again.</p>
+
+                        <p>${formatRecord(record)}</p>
+                        <small>AI-generated database result</small>
                     </div>
                 `;
-                chatWindow.append(errorMessage);
-                chatWindow.scrollTop(chatWindow[0].scrollHeight);
+                chatWindow.append(recordMessage);
+            });
+        }
+
+        chatWindow.scrollTop(chatWindow[0].scrollHeight);
+    }
+
+    // Draw a chart spec returned by the server with Chart.js
+    function drawChart(canvas, spec) {
+        new Chart(canvas, {
+            type: spec.type,
+            data: {
+                labels: spec.labels,
+                datasets: [{ label: spec.y_label, data: spec.values }]
+            },
+            options: {
+                plugins: {
+                    title: { display: true, text: spec.title },
+                    legend: { display: spec.type === 'pie' }
+                },
+                scales: spec.type === 'pie' ? {} : {
+                    x: { title: { display: true, text: spec.x_label } },
+                    y: { title: { display: true, text: spec.y_label } }
+                }
             }
         });
     }
 
+    function renderError() {
+        const errorMessage = `
+            <div class="message system">
+                <p>There was an error processing your request. Please try again.</p>
+            </div>
+        `;
+        chatWindow.append(errorMessage);
+        chatWindow.scrollTop(chatWindow[0].scrollHeight);
+    }
+
     // Helper function to format each record as a string
     function formatRecord(record) {
         return Object.entries(record).map(([key, value]) => `<strong>${key}:</strong> ${value}`).join("<br>");
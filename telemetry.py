@@ -0,0 +1,263 @@
+import os
+import time
+import json
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Console log level; DEBUG logs every statement and agent step on the request path
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'DEBUG').upper()
+# Prints the agent's ReAct steps to stdout
+AGENT_VERBOSE = os.getenv('AGENT_VERBOSE', 'true').lower() in ('1', 'true', 'yes')
+# Logs the spans of each request as one JSON line at INFO level
+TRACE_LOG_ENABLED = os.getenv('TRACE_LOG_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+# Exports spans as OpenTelemetry traces when the opentelemetry packages are installed
+OTEL_ENABLED = os.getenv('OTEL_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+OTEL_SERVICE_NAME = os.getenv('OTEL_SERVICE_NAME', 'sql-agent')
+
+# Histogram bucket bounds in seconds, from a fast statement to a slow agent run
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Spans of the request currently being served
+current_request_trace = ContextVar('current_request_trace', default=None)
+
+
+def configure_logging(level=LOG_LEVEL):
+    logging.basicConfig(level=getattr(logging, level, logging.DEBUG))
+
+
+class Histogram:
+    """
+    Prometheus-style histogram with one series per label value tuple.
+    """
+
+    def __init__(self, name, help_text, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series["buckets"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series_items = sorted((labels, dict(series, buckets=list(series["buckets"])))
+                                  for labels, series in self._series.items())
+        for label_values, series in series_items:
+            labels = ",".join(f'{name}="{_escape_label(value)}"' for name, value in zip(self.label_names, label_values))
+            separator = "," if labels else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets, series["buckets"]):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels}{separator}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{labels}{separator}le="+Inf"}} {series["count"]}')
+            lines.append(f"{self.name}_sum{{{labels}}} {series['sum']:.6f}")
+            lines.append(f"{self.name}_count{{{labels}}} {series['count']}")
+        return lines
+
+
+class Counter:
+    """
+    Prometheus-style counter with one value per label value tuple.
+    """
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            labels = ",".join(f'{name}="{_escape_label(v)}"' for name, v in zip(self.label_names, label_values))
+            lines.append(f"{self.name}{{{labels}}} {value}")
+        return lines
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+span_seconds = Histogram("sqlagent_span_seconds", "Duration of request spans by kind.", ("kind",))
+request_seconds = Histogram("sqlagent_request_seconds", "Duration of HTTP requests.", ("route", "status"))
+llm_tokens = Counter("sqlagent_llm_tokens_total", "Tokens sent to and received from the LLM.", ("direction",))
+# Callables returning {name: value} read at scrape time, such as cache and pool statistics
+_gauge_collectors = []
+
+
+def register_gauges(prefix, collect):
+    """
+    Exposes the numeric values of collect() as gauges named prefix_key on /metrics.
+    """
+    _gauge_collectors.append((prefix, collect))
+
+
+def render_metrics():
+    """
+    Returns all metrics in the Prometheus text exposition format.
+    """
+    lines = span_seconds.render() + request_seconds.render() + llm_tokens.render()
+    for prefix, collect in _gauge_collectors:
+        try:
+            values = collect()
+        except Exception as e:
+            logging.warning("Could not collect %s metrics: %s", prefix, e)
+            continue
+        for key, value in sorted(values.items()):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            lines.append(f"# TYPE {prefix}_{key} gauge")
+            lines.append(f"{prefix}_{key} {value}")
+    return "\n".join(lines) + "\n"
+
+
+_tracer = None
+
+
+def _get_tracer():
+    """
+    Returns an OpenTelemetry tracer, exporting over OTLP when the SDK and exporter
+    are installed, or None when tracing is disabled or unavailable.
+    """
+    global _tracer
+    if _tracer is not None or not OTEL_ENABLED:
+        return _tracer or None
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        logging.warning("OTEL_ENABLED is set but opentelemetry-api is not installed")
+        _tracer = False
+        return None
+    try:
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        provider = TracerProvider(resource=Resource.create({"service.name": OTEL_SERVICE_NAME}))
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+        trace.set_tracer_provider(provider)
+    except ImportError:
+        # Without the SDK, spans go to whatever provider opentelemetry-instrument configured
+        pass
+    _tracer = trace.get_tracer("sqlagent")
+    return _tracer
+
+
+class RequestTrace:
+    """
+    Spans recorded while serving one request: agent steps, LLM calls, SQL
+    statements, chart renders and answer formatting.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.started_at = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+        # OpenTelemetry span of the whole request and the context its child spans start in
+        self.otel_span = None
+        self.otel_context = None
+        self._otel_token = None
+
+    def start(self):
+        """
+        Opens the OpenTelemetry span of the request, when tracing is enabled, and makes
+        it the current span, so the spans recorded during the request are its children.
+        """
+        tracer = _get_tracer()
+        if tracer is None:
+            return
+        from opentelemetry import context, trace
+        self.otel_span = tracer.start_span("request", attributes={"question": self.name})
+        self.otel_context = trace.set_span_in_context(self.otel_span)
+        self._otel_token = context.attach(self.otel_context)
+
+    def end(self, error=None):
+        if self.otel_span is None:
+            return
+        from opentelemetry import context
+        from opentelemetry.trace import Status, StatusCode
+        if error is not None:
+            self.otel_span.record_exception(error)
+            self.otel_span.set_status(Status(StatusCode.ERROR, str(error)))
+        context.detach(self._otel_token)
+        self.otel_span.end()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def totals(self):
+        """
+        Returns the summed milliseconds per span kind and the elapsed total.
+        """
+        totals = {}
+        with self._lock:
+            for span in self.spans:
+                key = f"{span['kind']}_ms"
+                totals[key] = round(totals.get(key, 0.0) + span["duration_ms"], 1)
+        totals["total_ms"] = round((time.perf_counter() - self.started_at) * 1000, 1)
+        return totals
+
+    def to_list(self):
+        with self._lock:
+            return list(self.spans)
+
+    def log(self):
+        if TRACE_LOG_ENABLED:
+            logging.info("Request trace: %s", json.dumps(
+                {"name": self.name, **self.totals(), "spans": self.to_list()}, default=str))
+
+
+def record_span(kind, name, duration_s, started_at=None, **attributes):
+    """
+    Records a finished span in the request trace, the span histogram and, when
+    enabled, OpenTelemetry. started_at is a time.time() timestamp.
+    """
+    span_seconds.observe(duration_s, kind)
+    trace = current_request_trace.get()
+    if trace is not None:
+        trace.add({"kind": kind, "name": name, "duration_ms": round(duration_s * 1000, 2), **attributes})
+    tracer = _get_tracer()
+    if tracer is not None:
+        end_ns = time.time_ns() if started_at is None else int((started_at + duration_s) * 1e9)
+        # The request span is passed explicitly, since spans may be recorded on worker threads
+        otel_span = tracer.start_span(f"{kind} {name}", context=trace.otel_context if trace is not None else None,
+                                      start_time=end_ns - int(duration_s * 1e9),
+                                      attributes={key: value for key, value in attributes.items()
+                                                  if isinstance(value, (str, int, float, bool))})
+        otel_span.end(end_time=end_ns)
+
+
+@contextmanager
+def span(kind, name=None, **attributes):
+    """
+    Times the enclosed block as a span of the given kind.
+    """
+    started_at, started = time.time(), time.perf_counter()
+    try:
+        yield attributes
+    finally:
+        record_span(kind, name or kind, time.perf_counter() - started, started_at, **attributes)
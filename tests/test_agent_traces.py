@@ -0,0 +1,46 @@
+import time
+
+from agent_traces import AgentTraceStore
+
+
+def _trace(question, schema_version="v1", created_at=None):
+    return {"database": "shop", "schema_version": schema_version, "question": question, "answer": "",
+            "succeeded": True, "tables": ["orders"], "sql": "SELECT 1", "created_at": created_at or time.time()}
+
+
+def test_similar_finds_a_past_question_of_the_same_schema():
+    store = AgentTraceStore()
+    store.save(_trace("total quantity ordered per category"))
+    store.save(_trace("list customers by country"))
+    hints = store.similar("total quantity per category", "v1")
+    assert [hint["question"] for hint in hints] == ["total quantity ordered per category"]
+    assert store.similar("total quantity per category", "v2") == []
+
+
+def test_each_schema_version_keeps_at_most_the_cap():
+    store = AgentTraceStore(max_per_schema=2)
+    for number in range(5):
+        store.save(_trace(f"orders of customer {number}"))
+    store.save(_trace("orders of customer 9", schema_version="v2"))
+    assert len(store) == 3
+    assert [trace["question"] for trace in store.export()] == [
+        "orders of customer 3", "orders of customer 4", "orders of customer 9"]
+
+
+def test_expired_traces_are_not_hinted_or_loaded(tmp_path):
+    path = str(tmp_path / "traces.db")
+    store = AgentTraceStore(path, ttl=60)
+    store.save(_trace("revenue per product", created_at=time.time() - 120))
+    assert store.similar("revenue per product", "v1") == []
+    store.save(_trace("revenue per month"))
+    store.prune()
+    assert [trace["question"] for trace in store.export()] == ["revenue per month"]
+
+
+def test_a_schema_version_is_loaded_from_the_file_when_first_needed(tmp_path):
+    path = str(tmp_path / "traces.db")
+    AgentTraceStore(path).save(_trace("revenue per product"))
+    store = AgentTraceStore(path)
+    assert len(store) == 0
+    assert [hint["question"] for hint in store.similar("revenue per product", "v1")] == ["revenue per product"]
+    assert len(store) == 1
@@ -0,0 +1,12 @@
+from answer_cache import make_cache_key, normalize_question
+
+
+def test_case_whitespace_and_trailing_punctuation_share_a_key():
+    assert normalize_question("Top 10  products by Sales?") == "top 10 products by sales"
+    assert make_cache_key("Top 10 products?", [], "v1") == make_cache_key("top 10  products", [], "v1")
+
+
+def test_operators_signs_and_decimals_are_kept():
+    questions = ["orders with total > 100", "orders with total < 100", "orders with total >= 10",
+                 "orders with total != 10", "orders with total -10", "orders with total 1.5", "orders with total 15"]
+    assert len({make_cache_key(question, [], "v1") for question in questions}) == len(questions)
@@ -0,0 +1,19 @@
+import pytest
+
+from materialized_results import is_materializable
+
+
+@pytest.mark.parametrize("statement", [
+    "SELECT COUNT(*) FROM Orders WHERE OrderDate > DATEADD(day, -7, SYSUTCDATETIME())",
+    "SELECT COUNT(*) FROM Orders WHERE OrderDate > SYSDATETIMEOFFSET()",
+    "SELECT COUNT(*) FROM Orders WHERE OrderDate > GETDATE() - 7",
+    "SELECT Category, SUM(Quantity) FROM Orders GROUP BY Category ORDER BY NEWID()",
+    "SELECT COUNT(*) FROM Orders WHERE OrderDate > DATE('now', '-7 days')",
+])
+def test_clock_and_random_dependent_aggregates_are_not_materialized(statement):
+    assert not is_materializable(statement)
+
+
+def test_repeatable_aggregate_is_materialized():
+    assert is_materializable("SELECT Category, SUM(Quantity) FROM Orders GROUP BY Category")
+    assert not is_materializable("SELECT * FROM Orders")
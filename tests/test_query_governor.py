@@ -0,0 +1,37 @@
+import pytest
+
+from query_governor import limit_statement
+
+UNION = "SELECT Name FROM Customers UNION ALL SELECT Name FROM Suppliers"
+
+
+@pytest.mark.parametrize("statement, expected", [
+    ("SELECT Name FROM Products", "SELECT TOP (10) Name FROM Products"),
+    ("select distinct Category from Products", "select distinct TOP (10) Category from Products"),
+    ("SELECT Name FROM Products ORDER BY Price DESC", "SELECT TOP (10) Name FROM Products ORDER BY Price DESC"),
+    ("SELECT Name FROM Products WHERE Id IN (SELECT ProductId FROM Orders UNION SELECT ProductId FROM Returns)",
+     "SELECT TOP (10) Name FROM Products WHERE Id IN (SELECT ProductId FROM Orders UNION SELECT ProductId FROM Returns)"),
+    ("SELECT Name FROM Products WHERE Notes = 'union'", "SELECT TOP (10) Name FROM Products WHERE Notes = 'union'"),
+])
+def test_mssql_select_gets_top(statement, expected):
+    assert limit_statement(statement, "mssql", 10) == (expected, True)
+
+
+@pytest.mark.parametrize("statement", [
+    UNION,
+    "SELECT Name FROM Customers EXCEPT SELECT Name FROM Suppliers",
+    "(SELECT Name FROM Customers) INTERSECT (SELECT Name FROM Suppliers)",
+    "SELECT Name FROM Products ORDER BY Name OFFSET 10 ROWS FETCH NEXT 5 ROWS ONLY",
+    "SELECT Name FROM Products ORDER BY Name OFFSET 10 ROWS",
+    "SELECT TOP 5 Name FROM Products",
+    "SELECT DISTINCT TOP (5) Category FROM Products",
+    "WITH recent AS (SELECT * FROM Orders) SELECT * FROM recent",
+])
+def test_mssql_statements_left_to_the_fetch_ceiling(statement):
+    assert limit_statement(statement, "mssql", 10) == (statement, False)
+
+
+def test_other_dialects_limit_the_whole_compound_select():
+    assert limit_statement(UNION + ";", "sqlite", 10) == (UNION + " LIMIT 10", True)
+    assert limit_statement("SELECT Name FROM Products LIMIT 3", "sqlite", 10) == (
+        "SELECT Name FROM Products LIMIT 3", False)
@@ -0,0 +1,74 @@
+from question_router import TemplateLibrary, question_tokens
+
+NAIROBI_SQL = ("SELECT p.Name, SUM(o.Total) FROM Orders o JOIN Products p ON p.Id = o.ProductId "
+               "JOIN Customers c ON c.Id = o.CustomerId WHERE c.City = 'Nairobi' GROUP BY p.Name")
+
+
+def test_operators_and_signs_are_tokens():
+    assert question_tokens("orders with quantity >= -5") == ["orders", "with", "quantity", ">=", "-", "param"]
+    assert "aren't" in question_tokens("orders that aren't shipped")
+
+
+def test_template_with_another_operator_does_not_match():
+    library = TemplateLibrary()
+    library.learn("orders with quantity > 10", "SELECT * FROM Orders WHERE Quantity > 10", "v1")
+
+    assert library.match("orders with quantity < 5", "v1") is None
+    assert library.match("orders with quantity >= 5", "v1") is None
+    template, sql = library.match("Orders with quantity > 5?", "v1")
+    assert sql == "SELECT * FROM Orders WHERE Quantity > 5"
+
+
+def test_template_with_an_extra_filter_does_not_match():
+    library = TemplateLibrary()
+    library.learn("total sales by product for customers in Nairobi", NAIROBI_SQL, "v1")
+
+    assert library.match("total sales by product for customers", "v1") is None
+    assert library.match("total sales by product for customers in Nairobi", "v1")[1] == NAIROBI_SQL
+
+
+def test_question_with_an_extra_filter_does_not_match():
+    library = TemplateLibrary()
+    library.learn("total sales by product", "SELECT ProductId, SUM(Total) FROM Orders GROUP BY ProductId", "v1")
+
+    assert library.match("total sales by product for customers in Nairobi", "v1") is None
+    assert library.match("total sales by product excluding returns", "v1") is None
+    assert library.match("show me the total sales by product", "v1") is not None
+
+
+def test_literals_are_replaced_and_filled_again():
+    library = TemplateLibrary()
+    library.learn("top 3 customers in 'Nairobi'",
+                  "SELECT TOP 3 Name FROM Customers WHERE City = 'Nairobi' AND Notes <> '{none}'", "v1")
+
+    assert library.match("top 10 customers in 'Mombasa'", "v1")[1] == (
+        "SELECT TOP 10 Name FROM Customers WHERE City = 'Mombasa' AND Notes <> '{none}'")
+
+
+def test_value_not_in_the_sql_is_not_learned():
+    library = TemplateLibrary()
+
+    assert library.learn("top 3 products", "SELECT TOP 5 Name FROM Products", "v1") is None
+    assert library.match("top 10 products", "v1") is None
+
+
+def test_value_written_differently_in_the_sql_is_not_learned():
+    library = TemplateLibrary()
+
+    assert library.learn("products with price above 100", "SELECT * FROM Products WHERE Price > 100.00", "v1") is None
+    assert library.match("products with price above 500", "v1") is None
+
+
+def test_value_only_inside_a_longer_literal_is_not_learned():
+    library = TemplateLibrary()
+    sql = "SELECT SUM(Total) FROM Orders WHERE OrderDate >= '2023-01-01' AND OrderDate < '2024-01-01'"
+
+    assert library.learn("total sales in 2023", sql, "v1") is None
+    assert library.match("total sales in 2022", "v1") is None
+
+
+def test_value_found_more_than_once_is_not_learned():
+    library = TemplateLibrary()
+    sql = "SELECT * FROM Orders WHERE Quantity > 10 AND Total > 10"
+
+    assert library.learn("orders with quantity above 10", sql, "v1") is None
@@ -0,0 +1,49 @@
+import pytest
+
+from response_format import MarkdownRenderer, format_response_to_html, render_inline
+
+SAMPLES = [
+    "The **total revenue** for *2024* was 1,234 units, see [report](https://example.com).",
+    "Top products:\n- **Chai**: 39 units\n- *Chang*: 17 units\n  - nested `code`\n1. first\n2. second\n\nDone.",
+    "| OrderID | Product |\n|---|---|\n| 1 | **Chai** |\n| 2 | `a|b` |\n| 3 | [x|y](https://e.com/a|b) |\nAfter",
+    "# Heading\n```sql\nSELECT * FROM Orders WHERE Total > 10\n```\nLine one\r\nLine two\n",
+    "| lone row\nmixed **bold *italic* bold** and ***both*** with *a**b** and <script>x</script> & more",
+    "a\x1fb\x1ec | d \x1c- e",
+]
+
+
+@pytest.mark.parametrize("text", SAMPLES)
+@pytest.mark.parametrize("chunk_size", [1, 3, 8, 64])
+def test_streamed_output_equals_one_shot(text, chunk_size):
+    renderer = MarkdownRenderer()
+    streamed = "".join(renderer.feed(text[offset:offset + chunk_size]) for offset in range(0, len(text), chunk_size))
+    assert streamed + renderer.close() == format_response_to_html(text)
+
+
+def test_markup_does_not_span_table_cells():
+    html = format_response_to_html("| **a | b** |\n|---|---|\n| c | d |")
+    assert html == ("<table><thead><tr><th>**a</th><th>b**</th></tr></thead>"
+                    "<tbody><tr><td>c</td><td>d</td></tr></tbody></table>")
+
+
+def test_pipes_inside_code_spans_links_and_escapes_stay_in_the_cell():
+    html = format_response_to_html("| `a|b` | [x|y](https://e.com/a|b) | c \\| d |\n| e | f | g |")
+    assert html == ('<table><tbody><tr><td><code>a|b</code></td>'
+                    '<td><a href="https://e.com/a|b" target="_blank">x|y</a></td><td>c | d</td></tr>'
+                    '<tr><td>e</td><td>f</td><td>g</td></tr></tbody></table>')
+
+
+def test_lists_are_grouped_and_nested():
+    html = format_response_to_html("Items:\n- **a**\n- b\n  1. c\n  2. d\n- e")
+    assert html == ("Items:<ul><li><b>a</b></li><li>b<ol><li>c</li><li>d</li></ol></li><li>e</li></ul>")
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("**a** and *b*", "<b>a</b> and <i>b</i>"),
+    ("**a *b* c**", "<b>a <i>b</i> c</b>"),
+    ("*a**b**", "<i>a</i><i>b</i>*"),
+    ("<b>&", "&lt;b&gt;&amp;"),
+    ("[x](javascript:void)", "x"),
+])
+def test_inline_markup(text, expected):
+    assert render_inline(text) == expected
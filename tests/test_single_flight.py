@@ -0,0 +1,123 @@
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from single_flight import SingleFlight
+
+
+def test_concurrent_async_calls_share_one_computation():
+    flight = SingleFlight(lock_dir="")
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def main():
+        return await asyncio.gather(*(flight.run_async("key", compute) for _ in range(25)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert sorted(coalesced for _, coalesced in results) == [False] + [True] * 24
+    assert {result for result, _ in results} == {"answer"}
+
+
+def test_async_followers_do_not_use_executor_threads():
+    flight = SingleFlight(lock_dir="")
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        # A single executor thread, which the leader needs for its own work
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=1))
+
+        async def compute():
+            await asyncio.sleep(0.05)
+            return await asyncio.to_thread(lambda: "answer")
+
+        return await asyncio.wait_for(asyncio.gather(*(flight.run_async("key", compute) for _ in range(5))), 5)
+
+    assert [result for result, _ in asyncio.run(main())] == ["answer"] * 5
+
+
+def test_async_followers_of_a_thread_leader_get_its_result():
+    flight = SingleFlight(lock_dir="")
+    started, release = threading.Event(), threading.Event()
+
+    def compute():
+        started.set()
+        release.wait()
+        return "answer"
+
+    leader = threading.Thread(target=flight.run, args=("key", compute))
+    leader.start()
+    started.wait()
+
+    async def follow():
+        follower = asyncio.ensure_future(flight.run_async("key", compute))
+        await asyncio.sleep(0.05)
+        release.set()
+        return await follower
+
+    assert asyncio.run(follow()) == ("answer", True)
+    leader.join()
+
+
+def test_a_worker_waiting_on_the_lock_reads_the_shared_result(tmp_path):
+    first, second = SingleFlight(lock_dir=str(tmp_path)), SingleFlight(lock_dir=str(tmp_path))
+
+    async def main():
+        async def slow():
+            await asyncio.sleep(0.2)
+            return "answer"
+
+        async def unused():
+            raise AssertionError("the second worker should not compute")
+
+        leader = asyncio.ensure_future(first.run_async("key", slow))
+        await asyncio.sleep(0.05)
+        return await asyncio.gather(leader, second.run_async("key", unused))
+
+    assert asyncio.run(main()) == [("answer", False), ("answer", True)]
+    assert second.stats()["process_followers"] == 1
+
+
+def _age(path, seconds):
+    old = time.time() - seconds
+    os.utime(path, (old, old))
+
+
+def test_a_held_lock_file_is_not_pruned_however_old(tmp_path):
+    flight = SingleFlight(lock_dir=str(tmp_path), result_ttl=60)
+    handle, _ = flight._acquire("key")
+    path = flight._path("key", ".lock")
+    _age(path, 3600)
+
+    flight._prune()
+    assert os.path.exists(path)
+    flight._release(handle)
+
+
+def test_lock_files_not_taken_within_the_ttl_are_pruned(tmp_path):
+    flight = SingleFlight(lock_dir=str(tmp_path), result_ttl=60)
+    assert flight.run("old", lambda: "answer") == ("answer", False)
+    assert flight.run("new", lambda: "answer") == ("answer", False)
+    for extension in (".lock", ".json"):
+        _age(flight._path("old", extension), 3600)
+
+    flight._prune()
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(flight._path("new", extension))
+                                                  for extension in (".lock", ".json"))
+
+
+def test_a_lock_file_pruned_before_it_is_locked_is_opened_again(tmp_path):
+    flight = SingleFlight(lock_dir=str(tmp_path))
+    path = flight._path("key", ".lock")
+    stale = open(path, "a+")
+    os.remove(path)
+
+    handle, locked = flight._try_lock(path, stale)
+    assert locked and os.fstat(handle.fileno()).st_ino == os.stat(path).st_ino
+    flight._release(handle)
@@ -0,0 +1,47 @@
+import pytest
+from sqlalchemy import create_engine, text
+
+from query_results import CapturingSQLDatabase
+from sql_trace import StatementTrace, current_statement_trace, install_statement_trace
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://")
+    install_statement_trace(engine)
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE products (name TEXT, price REAL)"))
+        connection.execute(text("INSERT INTO products VALUES ('Chai', 18), ('Chang', 19), ('Tofu', 23)"))
+    return engine
+
+
+@pytest.fixture
+def trace():
+    trace = StatementTrace()
+    token = current_statement_trace.set(trace)
+    yield trace
+    current_statement_trace.reset(token)
+
+
+def test_select_rows_are_left_out_and_changed_rows_kept(engine, trace):
+    with engine.begin() as connection:
+        connection.execute(text("SELECT * FROM products")).fetchall()
+        connection.execute(text("UPDATE products SET price = price + 1 WHERE price < 20"))
+
+    select, update = trace.to_list()
+    assert "row_count" not in select
+    assert update["row_count"] == 2
+
+
+def test_failed_statement_has_no_row_count(engine, trace):
+    with pytest.raises(Exception), engine.connect() as connection:
+        connection.execute(text("SELECT * FROM missing"))
+
+    assert "row_count" not in trace.to_list()[0]
+    assert "error" in trace.to_list()[0]
+
+
+def test_agent_query_gets_the_fetched_row_count(engine, trace):
+    CapturingSQLDatabase(engine)._execute("SELECT name FROM products WHERE price > 18")
+
+    assert trace.to_list()[-1]["row_count"] == 2
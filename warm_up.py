@@ -0,0 +1,76 @@
+import os
+import time
+import logging
+import threading
+
+# Build clients and open the default database in a background thread right after start-up
+WARM_UP_ENABLED = os.getenv('WARM_UP_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Seconds between attempts of a warm-up step that failed, such as a database that was not reachable yet
+WARM_UP_RETRY_INTERVAL = float(os.getenv('WARM_UP_RETRY_INTERVAL', '10'))
+
+
+class WarmUp:
+    """
+    Runs named start-up steps in order in a background thread, so the process can
+    serve requests while clients are built and connections opened. Failed steps are
+    retried until they succeed. The state and duration of each step is reported by
+    the readiness endpoint.
+    """
+
+    def __init__(self, steps, retry_interval=WARM_UP_RETRY_INTERVAL):
+        self.steps = list(steps)
+        self.retry_interval = retry_interval
+        self._states = {name: {"state": "pending"} for name, _ in self.steps}
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._started_at = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self.run, name="warm-up", daemon=True)
+        self._thread.start()
+
+    def _set_state(self, name, **state):
+        with self._lock:
+            self._states[name] = state
+
+    def run(self):
+        if self._started_at is None:
+            self._started_at = time.perf_counter()
+        for name, step in self.steps:
+            attempts = 0
+            while True:
+                attempts += 1
+                self._set_state(name, state="running", attempts=attempts)
+                started_at = time.perf_counter()
+                try:
+                    step()
+                except Exception as e:
+                    logging.warning("Warm-up step %s failed, retrying in %ss: %s", name, self.retry_interval, e)
+                    self._set_state(name, state="failed", attempts=attempts, error=str(e))
+                    time.sleep(self.retry_interval)
+                    continue
+                self._set_state(name, state="ready", attempts=attempts,
+                                duration_ms=round((time.perf_counter() - started_at) * 1000, 1))
+                break
+        logging.info("Warm-up finished in %.2fs", time.perf_counter() - self._started_at)
+        self._done.set()
+
+    @property
+    def ready(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def status(self):
+        with self._lock:
+            steps = {name: dict(state) for name, state in self._states.items()}
+        return {
+            "ready": self.ready,
+            "uptime_s": round(time.perf_counter() - self._started_at, 2) if self._started_at is not None else 0.0,
+            "steps": steps
+        }